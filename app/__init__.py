@@ -2,8 +2,9 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from config import Config, TestingConfig
+from app.db_routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 jwt = JWTManager()
 
 
@@ -11,12 +12,43 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    from app import db_routing
+    db_routing.configure(app)
     db.init_app(app)
     jwt.init_app(app)
 
-    from app.routes import users, products, orders
+    from app import (
+        blocklist, cache, carts, changes, idempotency, inventory, metrics, migrations,
+        notifications, order_writer, passwords, product_import, ratelimit, search,
+        singleflight
+    )
+    db_routing.init_app(app)
+    blocklist.init_app(app)
+    cache.init_app(app)
+    carts.init_app(app)
+    changes.init_app(app)
+    idempotency.init_app(app)
+    inventory.init_app(app)
+    metrics.init_app(app)
+    migrations.init_app(app)
+    notifications.init_app(app)
+    order_writer.init_app(app)
+    passwords.init_app(app)
+    product_import.init_app(app)
+    ratelimit.init_app(app)
+    search.init_app(app)
+    singleflight.init_app(app)
+
+    from app.routes import (
+        users, products, orders, exports, notifications, carts, wishlist, reviews
+    )
     app.register_blueprint(users.bp)
     app.register_blueprint(products.bp)
     app.register_blueprint(orders.bp)
+    app.register_blueprint(exports.bp)
+    app.register_blueprint(notifications.bp)
+    app.register_blueprint(carts.bp)
+    app.register_blueprint(wishlist.bp)
+    app.register_blueprint(reviews.bp)
 
     return app
@@ -0,0 +1,66 @@
+""" This module contains the request-scoped authorization context.
+
+Access tokens carry the user's role as claims, so handlers can authorize a
+request from the verified token alone instead of loading the User row.
+Role changes reach clients when they exchange their refresh token, which is
+why access tokens are kept short-lived.
+"""
+
+from flask import g
+from flask_jwt_extended import (
+        create_access_token, create_refresh_token, get_jwt, get_jwt_identity
+)
+
+from app import db
+from app.models.user import User
+
+
+class AuthContext:
+    """ Identity and role of the caller of the current request """
+
+    def __init__(self, jti, user_id, is_admin):
+        self.jti = jti
+        self.user_id = user_id
+        self.is_admin = is_admin
+
+    def __repr__(self):
+        return f"<AuthContext {self.user_id}{' admin' if self.is_admin else ''}>"
+
+    def can_access(self, user_id):
+        """ True if the caller may act on resources owned by user_id """
+        return self.is_admin or self.user_id == user_id
+
+
+def user_claims(user):
+    """ Returns the claims embedded in access tokens issued to user """
+    return {'is_admin': bool(user.is_admin)}
+
+
+def issue_tokens(user):
+    """ Returns a fresh access and refresh token pair for user """
+    return {
+        'access_token': create_access_token(identity=user.id,
+                                            additional_claims=user_claims(user)),
+        'refresh_token': create_refresh_token(identity=user.id),
+    }
+
+
+def current_auth():
+    """ Returns the AuthContext of the JWT verified for this request.
+
+    Tokens issued before role claims existed carry no 'is_admin' claim; for
+    those the role is read from the database once per request.
+    """
+    claims = get_jwt()
+    context = g.get('auth_context')
+    if context is not None and context.jti == claims.get('jti'):
+        return context
+
+    user_id = get_jwt_identity()
+    if 'is_admin' in claims:
+        is_admin = bool(claims['is_admin'])
+    else:
+        user = db.session.get(User, user_id)
+        is_admin = bool(user and user.is_admin)
+    g.auth_context = AuthContext(claims.get('jti'), user_id, is_admin)
+    return g.auth_context
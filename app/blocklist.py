@@ -0,0 +1,183 @@
+""" This module keeps the set of revoked JWT ids in process memory.
+
+The token_blacklist table stays the source of truth, but looking a jti up
+there on every authenticated request is wasteful: the set is small, changes
+rarely and every entry becomes irrelevant once the token it names expires.
+RevokedTokenStore loads the table lazily, picks up rows written by other
+processes every JWT_BLOCKLIST_REFRESH_SECONDS, drops entries from memory as
+their tokens expire and periodically deletes expired rows from the table.
+"""
+
+import hashlib
+import heapq
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+
+from app import db
+from app.models.blacklist import TokenBlacklist
+
+# Rows committed slightly out of created_at order are still picked up by
+# re-reading this much history on every refresh.
+REFRESH_OVERLAP = timedelta(seconds=30)
+
+
+class BloomFilter:
+    """ A fixed size Bloom filter over strings """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:16], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+
+class RevokedTokenStore:
+    """ A hash set of revoked jtis plus a heap ordered by token expiry """
+
+    def __init__(self, refresh_interval=5, purge_interval=600,
+                 max_token_age=3600, bloom_capacity=0):
+        self.refresh_interval = refresh_interval
+        self.purge_interval = purge_interval
+        self.max_token_age = timedelta(seconds=max_token_age)
+        self.bloom_capacity = bloom_capacity
+        self._lock = threading.Lock()
+        self._expiry = {}
+        self._heap = []
+        self._bloom = None
+        self._loaded_until = None
+        self._next_refresh = 0.0
+        self._next_purge = time.monotonic() + purge_interval
+
+    def _expires_at(self, row_expires_at, created_at):
+        if row_expires_at is not None:
+            return row_expires_at
+        return (created_at or datetime.utcnow()) + self.max_token_age
+
+    def _add(self, jti, expires_at):
+        if self._expiry.get(jti) == expires_at:
+            return
+        self._expiry[jti] = expires_at
+        heapq.heappush(self._heap, (expires_at, jti))
+        if self._bloom is not None:
+            self._bloom.add(jti)
+
+    def _rebuild_bloom(self):
+        if not self.bloom_capacity:
+            return
+        self._bloom = BloomFilter(max(self.bloom_capacity, len(self._expiry)))
+        for jti in self._expiry:
+            self._bloom.add(jti)
+
+    def _drop_expired(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, jti = heapq.heappop(self._heap)
+            if self._expiry.get(jti) == expires_at:
+                del self._expiry[jti]
+
+    def refresh(self):
+        """ Loads rows written since the last refresh """
+        now = datetime.utcnow()
+        query = db.session.query(TokenBlacklist.jti, TokenBlacklist.expires_at,
+                                 TokenBlacklist.created_at)
+        if self._loaded_until is None:
+            query = query.filter(db.or_(
+                TokenBlacklist.expires_at > now,
+                db.and_(TokenBlacklist.expires_at.is_(None),
+                        TokenBlacklist.created_at > now - self.max_token_age)))
+        else:
+            query = query.filter(
+                TokenBlacklist.created_at >= self._loaded_until - REFRESH_OVERLAP)
+        rows = query.all()
+        with self._lock:
+            for jti, expires_at, created_at in rows:
+                self._add(jti, self._expires_at(expires_at, created_at))
+            if self._loaded_until is None:
+                self._rebuild_bloom()
+                self._next_refresh = time.monotonic() + self.refresh_interval
+            self._loaded_until = now
+
+    def purge(self):
+        """ Deletes rows for tokens that have expired; returns the row count """
+        now = datetime.utcnow()
+        deleted = db.session.query(TokenBlacklist).filter(db.or_(
+            TokenBlacklist.expires_at <= now,
+            db.and_(TokenBlacklist.expires_at.is_(None),
+                    TokenBlacklist.created_at <= now - self.max_token_age)
+        )).delete(synchronize_session=False)
+        db.session.commit()
+        with self._lock:
+            self._drop_expired(now)
+            self._rebuild_bloom()
+        return deleted
+
+    def revoke(self, jti, expires_at):
+        """ Records a token revoked by this process after its row is committed """
+        with self._lock:
+            self._add(jti, expires_at)
+
+    def _claim(self, attribute, interval):
+        """ Lets one caller run a due periodic task instead of all of them """
+        monotonic = time.monotonic()
+        with self._lock:
+            if monotonic < getattr(self, attribute):
+                return False
+            setattr(self, attribute, monotonic + interval)
+            return True
+
+    def is_revoked(self, jti):
+        if self._loaded_until is None or self._claim('_next_refresh',
+                                                     self.refresh_interval):
+            self.refresh()
+        if self._claim('_next_purge', self.purge_interval):
+            self.purge()
+        if self._bloom is not None and jti not in self._bloom:
+            return False
+        with self._lock:
+            self._drop_expired(datetime.utcnow())
+            return jti in self._expiry
+
+
+def _seconds(value):
+    """ Normalizes a JWT_*_EXPIRES setting to seconds """
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return value or 0
+
+
+def init_app(app):
+    """ Creates the revoked token store and its CLI command for app """
+    app.extensions['token_blocklist'] = RevokedTokenStore(
+        refresh_interval=app.config.get('JWT_BLOCKLIST_REFRESH_SECONDS', 5),
+        purge_interval=app.config.get('JWT_BLOCKLIST_PURGE_SECONDS', 600),
+        max_token_age=max(_seconds(app.config.get('JWT_ACCESS_TOKEN_EXPIRES', 3600)),
+                          _seconds(app.config.get('JWT_REFRESH_TOKEN_EXPIRES', 0))),
+        bloom_capacity=app.config.get('JWT_BLOCKLIST_BLOOM_CAPACITY', 0))
+
+    @app.cli.command('purge-revoked-tokens')
+    def purge_revoked_tokens():
+        """ Deletes blocklist rows for tokens that have expired """
+        deleted = get_token_blocklist().purge()
+        click.echo(f'Purged {deleted} expired revoked tokens')
+
+
+def get_token_blocklist():
+    """ Returns the revoked token store of the current app """
+    return current_app.extensions['token_blocklist']
@@ -0,0 +1,191 @@
+""" This module contains the read-through response cache for catalog routes.
+
+Cached entries are keyed by a tag (e.g. 'products' or 'product:42') plus the
+request path and query string. Each tag carries a generation number kept by
+the cache backend; write routes call invalidate(tag) to bump it, which orphans
+every entry built under the old generation without scanning the cache.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, make_response, request
+
+from app.db_routing import reads_own_writes
+
+
+class CacheBackend:
+    """ Interface for cache stores, so a shared store can replace LocalCache """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def counter(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class LocalCache(CacheBackend):
+    """ A bounded, thread-safe in-process LRU cache with per-entry TTL """
+
+    def __init__(self, max_entries=2048, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Counters live outside the LRU so eviction can never reset them.
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+
+class ResponseCache:
+    """ Stores serialized responses under tag generations """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def key(self, tag, path):
+        generation = self.backend.counter(f'gen:{tag}')
+        return f'resp:{tag}:{generation}:{path}'
+
+    def invalidate(self, *tags):
+        """ Drops every cached response built under any of tags """
+        for tag in tags:
+            self.backend.incr(f'gen:{tag}')
+
+    def stats(self):
+        return self.backend.stats()
+
+
+def init_app(app):
+    """ Creates the configured response cache for app """
+    name = app.config.get('CACHE_BACKEND', 'local')
+    if name != 'local':
+        raise ValueError(f'Unknown CACHE_BACKEND {name!r}')
+    backend = LocalCache(max_entries=app.config.get('CACHE_MAX_ENTRIES', 2048),
+                         ttl=app.config.get('CACHE_TTL', 300))
+    app.extensions['response_cache'] = ResponseCache(backend)
+
+
+def get_cache():
+    """ Returns the response cache of the current app """
+    return current_app.extensions['response_cache']
+
+
+def invalidate(*tags):
+    """ Invalidates tags in the current app's response cache """
+    get_cache().invalidate(*tags)
+
+
+def make_etag(body):
+    """ Returns a strong ETag value for a response body """
+    return hashlib.sha1(body).hexdigest()
+
+
+def request_key(ignore_args=()):
+    """ Returns the request path and query string, minus ignore_args """
+    if not any(name in request.args for name in ignore_args):
+        return request.full_path
+    args = [(name, value) for name, value in request.args.items(multi=True)
+            if name not in ignore_args]
+    return f'{request.path}?{urlencode(args)}'
+
+
+def cached_response(tag, ignore_args=()):
+    """ Serves a GET view from the response cache.
+
+    tag is a string or a callable receiving the view arguments. Successful
+    responses are stored with a strong ETag, and requests whose If-None-Match
+    already holds that ETag get an empty 304 without running the view.
+    Query arguments in ignore_args do not change the response and are left
+    out of the key. Callers that just wrote bypass the cache: after their
+    invalidation another request may have refilled it from a lagging replica.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if reads_own_writes():
+                return view(*args, **kwargs)
+            cache = get_cache()
+            key = cache.key(tag(**kwargs) if callable(tag) else tag,
+                            request_key(ignore_args))
+            entry = cache.backend.get(key)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                body = response.get_data()
+                entry = (body, make_etag(body), response.mimetype)
+                cache.backend.set(key, entry)
+
+            body, etag, mimetype = entry
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                response = make_response(body, 200)
+                response.mimetype = mimetype
+            response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,318 @@
+""" This module keeps shopping carts in a fast store and persists them lazily.
+
+Cart mutations are the most frequent writes and most carts are abandoned,
+so live carts sit in a CartStore and requests never write the database.
+Changed carts are marked dirty, and a flusher thread writes all of them
+every CART_FLUSH_INTERVAL seconds: two DELETEs and two bulk INSERTs per
+flush, whatever the number of carts. With an interval of 0 each change is
+written through before the request returns.
+
+Item counts and subtotals are adjusted as lines change instead of being
+recomputed. Prices are captured when an item is added and refreshed for
+the whole cart, in one IN (...) query, once they are CART_PRICE_TTL seconds
+old. The price lookups and the load of a cart missing from the store are
+plain reads, so the cart routes send them to a read replica when one is
+configured.
+"""
+
+import atexit
+import copy
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, insert, select
+
+from app import db
+from app.models.cart import Cart
+from app.models.cart_item import CartItem
+from app.models.product import Product
+
+
+class CartState:
+    """ A cart's lines with incrementally maintained totals """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lines = {}  # product_id -> {'name', 'quantity', 'unit_price'}
+        self.item_count = 0
+        self.subtotal = 0.0
+        self.priced_at = time.time()
+
+    def set_line(self, product_id, quantity, unit_price, name):
+        """ Sets a line's quantity and price; a quantity of 0 removes it """
+        old = self.lines.pop(product_id, None)
+        if old is not None:
+            self.item_count -= old['quantity']
+            self.subtotal -= old['quantity'] * old['unit_price']
+        if quantity > 0:
+            self.lines[product_id] = {'name': name, 'quantity': quantity,
+                                      'unit_price': unit_price}
+            self.item_count += quantity
+            self.subtotal += quantity * unit_price
+        self.subtotal = round(self.subtotal, 2)
+
+    def line_dict(self, product_id):
+        line = self.lines[product_id]
+        return {
+            'product_id': product_id,
+            'name': line['name'],
+            'quantity': line['quantity'],
+            'unit_price': line['unit_price'],
+            'line_total': round(line['quantity'] * line['unit_price'], 2),
+        }
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'items': [self.line_dict(product_id) for product_id in self.lines],
+            'item_count': self.item_count,
+            'subtotal': self.subtotal,
+        }
+
+
+class CartStore:
+    """ Interface for cart stores, so a shared KV store can replace LocalCartStore.
+
+    mutate() must apply fn atomically per user, e.g. with a compare-and-set
+    loop in a shared store.
+    """
+
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def mutate(self, user_id, fn, load, dirty=True):
+        raise NotImplementedError
+
+    def take_dirty(self):
+        raise NotImplementedError
+
+    def mark_dirty(self, carts):
+        raise NotImplementedError
+
+    def expire(self):
+        raise NotImplementedError
+
+
+class LocalCartStore(CartStore):
+    """ An in-process, thread-safe cart store with an idle TTL """
+
+    def __init__(self, ttl=7 * 24 * 3600):
+        self.ttl = ttl
+        self._carts = {}  # user_id -> [CartState, last used]
+        self._dirty = {}  # user_id -> CartState, for carts not flushed yet
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._carts.get(user_id)
+            if entry is None:
+                return None
+            entry[1] = time.monotonic()
+            return copy.deepcopy(entry[0])
+
+    def mutate(self, user_id, fn, load, dirty=True):
+        """ Applies fn to the user's cart, loading it on a miss; returns fn's result """
+        loaded = None
+        while True:
+            with self._lock:
+                entry = self._carts.get(user_id)
+                if entry is None and loaded is not None:
+                    entry = self._carts[user_id] = [loaded, 0]
+                if entry is not None:
+                    result = fn(entry[0])
+                    entry[1] = time.monotonic()
+                    if dirty:
+                        self._dirty[user_id] = entry[0]
+                    return result
+            # A miss: load outside the lock, then apply fn on the next pass
+            # (to whichever copy got there first if two requests loaded).
+            loaded = load(user_id)
+
+    def take_dirty(self):
+        """ Returns copies of the dirty carts and marks them clean """
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            return {user_id: copy.deepcopy(cart) for user_id, cart in dirty.items()}
+
+    def mark_dirty(self, carts):
+        """ Puts back carts whose flush failed, unless they changed since """
+        with self._lock:
+            for user_id, cart in carts.items():
+                self._dirty.setdefault(user_id, cart)
+
+    def expire(self):
+        """ Drops carts idle for longer than the TTL that are already flushed """
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            for user_id in [user_id for user_id, (_, used) in self._carts.items()
+                            if used < cutoff and user_id not in self._dirty]:
+                del self._carts[user_id]
+
+    def __len__(self):
+        return len(self._carts)
+
+
+def load_cart(user_id):
+    """ Builds a user's cart from its persisted copy, or an empty one """
+    cart = CartState(user_id)
+    persisted = db.session.get(Cart, user_id)
+    if persisted is not None:
+        for item in persisted.items:
+            cart.set_line(item.product_id, item.quantity, item.unit_price, None)
+        # Names are not persisted and prices may be stale; refresh on first read.
+        cart.priced_at = 0
+    return cart
+
+
+def product_prices(product_ids):
+    """ Returns {product_id: (price, name)} in one IN (...) query """
+    if not product_ids:
+        return {}
+    rows = db.session.execute(
+        select(Product.id, Product.price, Product.name).where(Product.id.in_(product_ids)))
+    return {product_id: (price, name) for product_id, price, name in rows}
+
+
+def refresh_prices(cart, prices):
+    """ Applies current prices to cart; lines of deleted products are dropped """
+    for product_id, line in list(cart.lines.items()):
+        price, name = prices.get(product_id, (None, None))
+        if price is None:
+            cart.set_line(product_id, 0, 0, None)
+        elif price != line['unit_price'] or name != line['name']:
+            cart.set_line(product_id, line['quantity'], price, name)
+    cart.priced_at = time.time()
+
+
+# Flushes take and write carts under this lock, so two flushes cannot commit
+# copies of the same cart out of order (e.g. write-through requests).
+_flush_lock = threading.Lock()
+
+
+def _write_carts(carts, now):
+    """ Replaces the persisted copies of carts in one transaction """
+    user_ids = list(carts)
+    db.session.execute(delete(CartItem).where(CartItem.user_id.in_(user_ids)))
+    db.session.execute(delete(Cart).where(Cart.user_id.in_(user_ids)))
+    rows = [{'user_id': cart.user_id, 'item_count': cart.item_count,
+             'subtotal': cart.subtotal, 'updated_at': now}
+            for cart in carts.values() if cart.lines]
+    items = [{'user_id': cart.user_id, 'product_id': product_id,
+              'quantity': line['quantity'], 'unit_price': line['unit_price']}
+             for cart in carts.values() for product_id, line in cart.lines.items()]
+    if rows:
+        db.session.execute(insert(Cart), rows)
+    if items:
+        db.session.execute(insert(CartItem), items)
+    db.session.commit()
+
+
+def _drop_deleted_products(store, cart):
+    """ Removes lines of products that no longer exist from cart and the store """
+    existing = set(db.session.scalars(
+        select(Product.id).where(Product.id.in_(list(cart.lines)))))
+    missing = [product_id for product_id in cart.lines if product_id not in existing]
+    if not missing:
+        return
+
+    def drop(live):
+        for product_id in missing:
+            live.set_line(product_id, 0, 0, None)
+    for product_id in missing:
+        cart.set_line(product_id, 0, 0, None)
+    store.mutate(cart.user_id, drop, load_cart, dirty=False)
+
+
+def flush_carts(store=None):
+    """ Writes every dirty cart to the database; returns how many.
+
+    If the batch fails, each cart is retried in its own transaction, without
+    lines whose product was deleted, so one bad cart cannot hold back the
+    others. Carts that still fail are put back for the next flush.
+    """
+    store = store or get_cart_store()
+    with _flush_lock:
+        carts = store.take_dirty()
+        if not carts:
+            return 0
+        now = datetime.utcnow()
+        try:
+            _write_carts(carts, now)
+            return len(carts)
+        except Exception:
+            db.session.rollback()
+        failed, error = {}, None
+        for user_id, cart in carts.items():
+            try:
+                _drop_deleted_products(store, cart)
+                _write_carts({user_id: cart}, now)
+            except Exception as e:
+                db.session.rollback()
+                failed[user_id], error = cart, e
+        if failed:
+            store.mark_dirty(failed)
+            raise error
+        return len(carts)
+
+
+class CartFlusher:
+    """ Flushes dirty carts on a background thread """
+
+    def __init__(self, app, store, interval):
+        self.app = app
+        self.store = store
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='cart-flusher',
+                                                daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def flush(self):
+        with self.app.app_context():
+            try:
+                flush_carts(self.store)
+            except Exception:
+                self.app.logger.exception('Cart flush failed; will retry')
+            finally:
+                db.session.remove()
+        self.store.expire()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+def init_app(app):
+    """ Creates the configured cart store and flusher for app """
+    name = app.config.get('CART_STORE', 'local')
+    if name != 'local':
+        raise ValueError(f'Unknown CART_STORE {name!r}')
+    store = LocalCartStore(ttl=app.config.get('CART_TTL', 7 * 24 * 3600))
+    app.extensions['cart_store'] = store
+    interval = app.config.get('CART_FLUSH_INTERVAL', 5)
+    app.extensions['cart_flusher'] = CartFlusher(app, store, interval) if interval > 0 else None
+
+
+def get_cart_store():
+    """ Returns the cart store of the current app """
+    return current_app.extensions['cart_store']
+
+
+def cart_changed():
+    """ Schedules persistence of the carts changed by this request """
+    flusher = current_app.extensions['cart_flusher']
+    if flusher is None:
+        flush_carts()
+    else:
+        flusher.start()
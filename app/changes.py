@@ -0,0 +1,226 @@
+""" This module numbers catalog changes so clients can sync incrementally.
+
+Every transaction that inserts, edits or deletes a product or category
+takes the next value of the 'catalog' change sequence and stamps it on the
+rows it wrote; deletions leave a ChangeTombstone at that version. The
+sequence row stays locked from the increment until commit, so versions
+become visible in order: once a reader sees version N committed, no
+transaction can still commit a change numbered N or below. A client that
+synced up to N therefore only ever needs the rows with a version above N.
+
+Stock and rating aggregates change on every order and review and are not
+catalog changes: tracking them would serialize checkouts on the sequence
+row. Clients read them from product pages.
+
+GET /products/changes returns the changes after a sync token, oldest first
+and paginated, then a new sync token. Without a token it returns the whole
+live catalog. Tombstones older than CHANGES_TOMBSTONE_DAYS can be pruned
+with 'flask changes prune'; tokens from before the pruned version are
+rejected so those clients start over.
+"""
+
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, delete, event, func, insert, inspect, or_, select, update
+from sqlalchemy.orm import Session
+
+from app import db
+from app.db_routing import read_primary
+from app.models.category import Category
+from app.models.change_sequence import ChangeSequence
+from app.models.change_tombstone import ChangeTombstone
+from app.models.product import Product
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+CATALOG = 'catalog'
+CATALOG_PRUNED = 'catalog_pruned'
+
+# Models whose changes are numbered, with the columns that count as a change.
+TRACKED = {
+    Product: ('name', 'description', 'price', 'image_path', 'category_id', 'status'),
+    Category: ('name', 'description'),
+}
+ENTITY_NAMES = {Product: 'product', Category: 'category'}
+
+
+class SyncTokenExpired(Exception):
+    """ Raised for a sync token older than the pruned tombstones """
+
+
+def next_change_version(session=None):
+    """ Returns the change version of the current transaction, taking one if needed """
+    session = session or db.session
+    version = session.info.get('change_version')
+    if version is not None:
+        return version
+    sequence = ChangeSequence.__table__
+    result = session.execute(update(sequence).where(sequence.c.name == CATALOG)
+                             .values(value=sequence.c.value + 1))
+    if result.rowcount == 0:
+        session.execute(insert(sequence).values(name=CATALOG, value=1))
+    version = session.execute(
+        select(sequence.c.value).where(sequence.c.name == CATALOG)).scalar_one()
+    session.info['change_version'] = version
+    return version
+
+
+def _sequence_value(name):
+    return db.session.scalar(
+        select(ChangeSequence.value).where(ChangeSequence.name == name)) or 0
+
+
+def _visible_high(required):
+    """ Returns the newest version this request reads, reading the primary if needed.
+
+    A lagging replica may not have reached the version that an earlier page
+    or sync token came from. Paging it would skip changes for good, so the
+    primary serves the rest of the request instead.
+    """
+    high = _sequence_value(CATALOG)
+    if high < required:
+        read_primary()
+        high = _sequence_value(CATALOG)
+    return high
+
+
+def _has_tracked_change(obj):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in TRACKED[type(obj)])
+
+
+@event.listens_for(Session, 'before_flush')
+def _stamp_changes(session, flush_context, instances):
+    changed = [obj for obj in session.new if type(obj) in TRACKED]
+    changed += [obj for obj in session.dirty
+                if type(obj) in TRACKED and _has_tracked_change(obj)]
+    deleted = [obj for obj in session.deleted if type(obj) in TRACKED]
+    if not changed and not deleted:
+        return
+    version = next_change_version(session)
+    for obj in changed:
+        obj.change_version = version
+    for obj in deleted:
+        session.add(ChangeTombstone(entity=ENTITY_NAMES[type(obj)], entity_id=obj.id,
+                                    change_version=version))
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _forget_version(session):
+    session.info.pop('change_version', None)
+
+
+def encode_sync_token(version):
+    return encode_cursor({'s': 'sync', 'v': version})
+
+
+def decode_sync_token(token):
+    position = decode_cursor(token)
+    if position.get('s') != 'sync' or not isinstance(position.get('v'), int):
+        raise InvalidCursor('Invalid sync token')
+    return position['v']
+
+
+def _after(version_column, id_column, rank, position):
+    """ Filters a source to the rows after position in (version, rank, id) order """
+    version, last_rank, last_id = position
+    if rank < last_rank:
+        return version_column > version
+    if rank > last_rank:
+        return version_column >= version
+    return or_(version_column > version,
+               and_(version_column == version, id_column > last_id))
+
+
+def _sources(include_deletes):
+    """ Yields (rank, version column, id column, base query, item builder) """
+    yield (0, Product.change_version, Product.id, db.session.query(Product),
+           lambda row: {'entity': 'product', 'op': 'upsert', 'id': row.id,
+                        'version': row.change_version, 'data': row.to_dict()})
+    yield (1, Category.change_version, Category.id, db.session.query(Category),
+           lambda row: {'entity': 'category', 'op': 'upsert', 'id': row.id,
+                        'version': row.change_version, 'data': row.to_dict()})
+    if include_deletes:
+        yield (2, ChangeTombstone.change_version, ChangeTombstone.id,
+               db.session.query(ChangeTombstone),
+               lambda row: {'entity': row.entity, 'op': 'delete', 'id': row.entity_id,
+                            'version': row.change_version})
+
+
+def changes_page(since=None, cursor=None, limit=50):
+    """ Returns (items, next_cursor, sync_token) for one page of changes.
+
+    since is a sync token (None for the full catalog) and cursor the
+    next_cursor of the previous page. sync_token is set on the last page.
+    """
+    if cursor:
+        state = decode_cursor(cursor)
+        if state.get('s') != 'changes' or not all(
+                isinstance(state.get(name), int) for name in ('h', 'v', 'r', 'id')):
+            raise InvalidCursor('Invalid cursor')
+        since_version = state.get('since')
+        high = state['h']
+        _visible_high(high)
+        position = (state['v'], state['r'], state['id'])
+    else:
+        since_version = decode_sync_token(since) if since else None
+        # Read the high-water mark first: everything at or below it has
+        # committed, so the pages below are consistent with it as long as
+        # they read the same database (@read_replica pins one per request).
+        high = _visible_high(since_version or 0)
+        position = (-1, 0, 0)
+    if since_version is not None and since_version < _sequence_value(CATALOG_PRUNED):
+        raise SyncTokenExpired('Sync token expired, fetch the catalog without since')
+
+    rows = []
+    for rank, version_column, id_column, query, build in _sources(since_version is not None):
+        query = query.filter(version_column <= high,
+                             _after(version_column, id_column, rank, position))
+        if since_version is not None:
+            query = query.filter(version_column > since_version)
+        for row in query.order_by(version_column, id_column).limit(limit + 1):
+            item = build(row)
+            rows.append(((item['version'], rank, getattr(row, id_column.key)), item))
+    rows.sort(key=lambda pair: pair[0])
+
+    if len(rows) <= limit:
+        return [item for _, item in rows], None, encode_sync_token(high)
+    rows = rows[:limit]
+    version, rank, last_id = rows[-1][0]
+    next_cursor = encode_cursor({'s': 'changes', 'since': since_version, 'h': high,
+                                 'v': version, 'r': rank, 'id': last_id})
+    return [item for _, item in rows], next_cursor, None
+
+
+def prune_tombstones(days):
+    """ Deletes tombstones older than days; returns how many """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    pruned = db.session.scalar(
+        select(func.max(ChangeTombstone.change_version))
+        .where(ChangeTombstone.deleted_at < cutoff))
+    if pruned is None:
+        return 0
+    count = db.session.execute(
+        delete(ChangeTombstone).where(ChangeTombstone.change_version <= pruned)).rowcount
+    sequence = ChangeSequence.__table__
+    result = db.session.execute(update(sequence).where(sequence.c.name == CATALOG_PRUNED)
+                                .values(value=pruned))
+    if result.rowcount == 0:
+        db.session.execute(insert(sequence).values(name=CATALOG_PRUNED, value=pruned))
+    db.session.commit()
+    return count
+
+
+def init_app(app):
+    """ Registers the 'flask changes' commands """
+    @app.cli.group('changes')
+    def changes_cli():
+        """ Manage the catalog change log """
+
+    @changes_cli.command('prune')
+    @click.option('--days', type=int, default=None)
+    def prune_command(days):
+        """ Delete tombstones older than --days (CHANGES_TOMBSTONE_DAYS) """
+        count = prune_tombstones(days or app.config.get('CHANGES_TOMBSTONE_DAYS') or 30)
+        click.echo(f'Pruned {count} tombstones')
@@ -0,0 +1,168 @@
+""" This module tunes the connection pools and routes reads to replicas.
+
+Handlers decorated with @read_replica run their queries on one of the
+DATABASE_REPLICA_URLS engines, picked once per request so every query of
+the request sees the same replica's state; everything else, and anything
+flushed inside the request, stays on the primary. After a caller commits a
+write, their reads stick to the primary for DB_REPLICA_STICKY_SECONDS so
+they always see their own changes despite replication lag; cached_response
+skips the shared cache for them too, since others may have refilled it from
+a replica. The sticky window is tracked per process, keyed by JWT identity
+or, for anonymous callers, remote address.
+"""
+
+import itertools
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+
+
+class RoutingSession(Session):
+    """ A session that sends reads of @read_replica handlers to a replica """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if getattr(clause, 'is_dml', False):
+            # INSERT/UPDATE/DELETE run through session.execute() always go to
+            # the primary, and count as a write for read-your-writes.
+            self.info['wrote'] = True
+        elif bind is None and not self._flushing and _reads_from_replica(self):
+            return g.db_read_replica
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _reads_from_replica(session):
+    return (has_request_context() and g.get('db_read_replica') is not None
+            and not session.info.get('wrote'))
+
+
+def _next_replica():
+    router = current_app.extensions.get('db_router')
+    if router is None or not router.replicas:
+        return None
+    with router.lock:
+        return next(router.replicas)
+
+
+def _caller_key():
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:
+        identity = None
+    if identity is not None:
+        return f'user:{identity}'
+    return f'ip:{request.remote_addr}'
+
+
+class ReplicaRouter:
+    """ Round-robins replica engines and remembers recent writers """
+
+    def __init__(self, engines, sticky_seconds):
+        self.engines = engines
+        self.replicas = itertools.cycle(engines) if engines else None
+        self.sticky_seconds = sticky_seconds
+        self._writers = {}
+        self.lock = threading.Lock()
+
+    def wrote(self, key):
+        now = time.monotonic()
+        with self.lock:
+            self._writers[key] = now + self.sticky_seconds
+            if len(self._writers) > 10000:
+                self._writers = {k: until for k, until in self._writers.items()
+                                 if until > now}
+
+    def is_sticky(self, key):
+        until = self._writers.get(key)
+        return until is not None and until > time.monotonic()
+
+
+def reads_own_writes():
+    """ Returns True if the caller wrote recently and must read the primary """
+    router = current_app.extensions.get('db_router')
+    if router is None or not router.replicas:
+        return False
+    try:
+        # Public views: only used to recognise the caller.
+        verify_jwt_in_request(optional=True)
+    except Exception:
+        pass
+    return router.is_sticky(_caller_key())
+
+
+def read_primary():
+    """ Sends the rest of the current request's reads to the primary """
+    g.pop('db_read_replica', None)
+
+
+def read_replica(view):
+    """ Lets a read-only view query a replica, unless the caller just wrote """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        router = current_app.extensions.get('db_router')
+        if router is not None and router.replicas and not reads_own_writes():
+            # One replica for the whole request: replicas lag by different
+            # amounts, so mixing them could pair rows from different points in time.
+            g.db_read_replica = _next_replica()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.pop('db_read_replica', None)
+    return wrapper
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_writer(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        router = current_app.extensions.get('db_router')
+        if router is not None and router.replicas:
+            router.wrote(_caller_key())
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('wrote', None)
+
+
+def _engine_options(app, uri):
+    if uri.startswith('sqlite'):
+        return {}
+    config = app.config
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def configure(app):
+    """ Fills in the pool options of the primary before its engine exists """
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if not uri.startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = _engine_options(app, uri)
+
+
+def init_app(app):
+    """ Creates the replica engines and the router for app """
+    engines = [create_engine(url, **_engine_options(app, url))
+               for url in app.config.get('DATABASE_REPLICA_URLS') or []]
+    app.extensions['db_router'] = ReplicaRouter(
+        engines, app.config.get('DB_REPLICA_STICKY_SECONDS', 5))
+
+
+def get_replica_engines():
+    """ Returns the replica engines of the current app """
+    return current_app.extensions['db_router'].engines
@@ -0,0 +1,119 @@
+""" This module implements sparse fieldsets (?fields=) for list routes.
+
+List screens usually need a few small fields, yet to_dict() returns every
+one, including large text columns, and the query loads full entities into
+the identity map. With ?fields=id,name,price a list route selects only the
+columns those fields read, as plain row tuples, and serializes each row
+with just those fields. Without ?fields= routes keep using to_dict(). The
+id is always included so clients can key the rows.
+"""
+
+from collections import defaultdict
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from app import db
+from app.models.order import Order
+from app.models.order_item import OrderItem
+from app.models.product import Product
+
+
+class InvalidFields(ValueError):
+    """ Raised when ?fields= names a field the route does not have """
+
+
+class FieldSet:
+    """ The fields a route may return, with the columns each one reads """
+
+    def __init__(self, fields):
+        self.fields = fields  # name -> (columns, function of a row)
+
+    def parse(self, args):
+        """ Returns the requested field names, or None for the full objects """
+        value = args.get('fields')
+        if not value:
+            return None
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = sorted(set(names) - set(self.fields))
+        if unknown:
+            raise InvalidFields(f"Unknown fields: {', '.join(unknown)}")
+        return ['id'] + [name for name in dict.fromkeys(names) if name != 'id']
+
+    def columns(self, names, *extra):
+        """ Returns the columns to select for names, plus extra (e.g. sort keys) """
+        columns = {}
+        for name in names:
+            for column in self.fields[name][0]:
+                columns.setdefault(column.key, column)
+        for column in extra:
+            columns.setdefault(column.key, column)
+        return list(columns.values())
+
+    def serialize(self, row, names):
+        return {name: self.fields[name][1](row) for name in names}
+
+
+def _rating(row):
+    return {
+        'average': round(row.rating_avg or 0, 2),
+        'count': row.rating_count or 0,
+        'histogram': {str(stars): getattr(row, f'rating_{stars}') or 0 for stars in range(1, 6)}
+    }
+
+
+def _column(column):
+    return (column,), lambda row: getattr(row, column.key)
+
+
+PRODUCT_FIELDS = FieldSet({
+    'id': _column(Product.id),
+    'name': _column(Product.name),
+    'description': _column(Product.description),
+    'price': _column(Product.price),
+    'stock': ((Product.total_stock,), lambda row: row.total_stock),
+    'status': _column(Product.status),
+    'category_id': _column(Product.category_id),
+    'image_path': _column(Product.image_path),
+    'rating': ((Product.rating_avg, Product.rating_count, Product.rating_1, Product.rating_2,
+                Product.rating_3, Product.rating_4, Product.rating_5), _rating),
+})
+
+
+def _order_items(row):
+    items = getattr(row, 'items', None) or []
+    if not items and row.product_id is not None:
+        # Orders placed before order items existed, as in Order.to_dict().
+        items = [{'product_id': row.product_id, 'quantity': row.quantity,
+                  'unit_price': row.total_price / row.quantity}]
+    return items
+
+
+ORDER_FIELDS = FieldSet({
+    'id': _column(Order.id),
+    'quantity': _column(Order.quantity),
+    'total_price': _column(Order.total_price),
+    'status': _column(Order.status),
+    'user_id': _column(Order.user_id),
+    'product_id': _column(Order.product_id),
+    'date_ordered': ((Order.date_ordered,),
+                     lambda row: row.date_ordered.isoformat() if row.date_ordered else None),
+    'items': ((Order.product_id, Order.quantity, Order.total_price), _order_items),
+})
+
+
+def serialize_orders(rows, names):
+    """ Serializes order rows, loading their items in one IN (...) query if asked """
+    rows = [row._asdict() for row in rows]
+    if 'items' in names and rows:
+        items = defaultdict(list)
+        for order_id, product_id, quantity, unit_price in db.session.execute(
+                select(OrderItem.order_id, OrderItem.product_id, OrderItem.quantity,
+                       OrderItem.unit_price)
+                .where(OrderItem.order_id.in_([row['id'] for row in rows]))
+                .order_by(OrderItem.id)):
+            items[order_id].append({'product_id': product_id, 'quantity': quantity,
+                                    'unit_price': unit_price})
+        for row in rows:
+            row['items'] = items[row['id']]
+    return [ORDER_FIELDS.serialize(SimpleNamespace(**row), names) for row in rows]
@@ -0,0 +1,251 @@
+""" This module makes write endpoints safe to retry with an Idempotency-Key.
+
+Clients on flaky networks retry writes whose response they never saw. A
+request carrying an Idempotency-Key header is recorded under the caller,
+the route and the key, together with a fingerprint of its body. Once the
+original finishes, its response is stored and repeats replay it with an
+Idempotent-Replayed header, without running the view or opening a
+transaction. A repeat that arrives while the original is still running
+waits for it instead of racing it. Reusing a key with a different body is
+an error (422).
+
+Only responses below 500 are stored: server errors and exceptions release
+the key so the client's retry runs again. A view whose outcome is still
+unknown when it returns calls hold() and settles the key later. Records live in an
+IdempotencyStore. LocalIdempotencyStore keeps them in process, which
+covers retries that land on the same process; a shared store implements
+the same interface.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, jsonify, make_response, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class _Record:
+    """ The fingerprint of a keyed request and, once done, its response """
+
+    def __init__(self, fingerprint, expires):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.response = None  # (body, status, headers) once complete
+
+
+class IdempotencyStore:
+    """ Interface for idempotency stores, so a shared store can replace the local one """
+
+    def _evict(self):
+        """ Drops the oldest settled records past max_entries.
+
+        Records still in flight are kept: dropping one would let a retry
+        run the operation a second time. They are bounded by the number of
+        concurrent requests.
+        """
+        excess = len(self._records) - self.max_entries
+        if excess <= 0:
+            return
+        victims = []
+        for key, record in self._records.items():
+            if record.response is not None:
+                victims.append(key)
+                if len(victims) == excess:
+                    break
+        for key in victims:
+            del self._records[key]
+        self.evictions += len(victims)
+
+    def begin(self, key, fingerprint, timeout):
+        """ Claims key for a new request.
+
+        Returns None if the caller now owns key and must run the request,
+        otherwise the existing record, waiting up to timeout seconds for it
+        to complete if it is still in flight.
+        """
+        raise NotImplementedError
+
+    def complete(self, key, response):
+        raise NotImplementedError
+
+    def release(self, key):
+        raise NotImplementedError
+
+
+class LocalIdempotencyStore(IdempotencyStore):
+    """ An in-process, thread-safe idempotency store with a fixed TTL.
+
+    At most max_entries settled records are kept; past that the oldest are
+    evicted before they expire, so a burst of unique keys cannot grow memory.
+    """
+
+    def __init__(self, ttl=24 * 3600, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Every record gets the same TTL, so insertion order is expiry order.
+        self._records = OrderedDict()
+        self._condition = threading.Condition()
+        self.evictions = 0
+
+    def _expire(self, now):
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.expires > now:
+                break
+            del self._records[key]
+
+    def _evict(self):
+        """ Drops the oldest settled records past max_entries.
+
+        Records still in flight are kept: dropping one would let a retry
+        run the operation a second time. They are bounded by the number of
+        concurrent requests.
+        """
+        excess = len(self._records) - self.max_entries
+        if excess <= 0:
+            return
+        victims = []
+        for key, record in self._records.items():
+            if record.response is not None:
+                victims.append(key)
+                if len(victims) == excess:
+                    break
+        for key in victims:
+            del self._records[key]
+        self.evictions += len(victims)
+
+    def begin(self, key, fingerprint, timeout):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                record = self._records.get(key)
+                if record is None:
+                    self._records[key] = _Record(fingerprint, now + self.ttl)
+                    self._evict()
+                    return None
+                remaining = deadline - now
+                if record.response is not None or record.fingerprint != fingerprint \
+                        or remaining <= 0:
+                    return record
+                self._condition.wait(remaining)
+
+    def complete(self, key, response):
+        with self._condition:
+            record = self._records.get(key)
+            if record is not None:
+                record.response = response
+            self._condition.notify_all()
+
+    def release(self, key):
+        with self._condition:
+            self._records.pop(key, None)
+            self._condition.notify_all()
+
+    def __len__(self):
+        return len(self._records)
+
+
+def init_app(app):
+    """ Creates the configured idempotency store for app """
+    name = app.config.get('IDEMPOTENCY_STORE', 'local')
+    if name != 'local':
+        raise ValueError(f'Unknown IDEMPOTENCY_STORE {name!r}')
+    app.extensions['idempotency_store'] = LocalIdempotencyStore(
+        ttl=app.config.get('IDEMPOTENCY_TTL', 24 * 3600),
+        max_entries=app.config.get('IDEMPOTENCY_MAX_ENTRIES', 10000))
+
+
+def get_idempotency_store():
+    """ Returns the idempotency store of the current app """
+    return current_app.extensions['idempotency_store']
+
+
+def hold():
+    """ Keeps the current request's key in flight after the view returns.
+
+    For views that respond before their write is settled. Returns a
+    settle(payload, status) function to call, from any thread, once the
+    outcome is known; settle(None) releases the key instead. Returns None
+    when the request has no Idempotency-Key.
+    """
+    key = g.get('idempotency_key')
+    if key is None:
+        return None
+    g.idempotency_held = True
+    store = get_idempotency_store()
+
+    def settle(payload, status=200):
+        if payload is None:
+            store.release(key)
+        else:
+            store.complete(key, (json.dumps(payload).encode('utf-8'), status,
+                                 [('Content-Type', 'application/json')]))
+    return settle
+
+
+def _fingerprint():
+    digest = hashlib.sha256(request.method.encode('utf-8'))
+    digest.update(request.full_path.encode('utf-8'))
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def idempotent(view):
+    """ Honours the Idempotency-Key header on a write view.
+
+    Apply it below @jwt_required() so keys are scoped to the caller.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        idempotency_key = request.headers.get(HEADER)
+        if idempotency_key is None:
+            return view(*args, **kwargs)
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            return jsonify({'message':
+                            f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}), 400
+
+        verify_jwt_in_request(optional=True)
+        key = (get_jwt_identity(), request.endpoint, idempotency_key)
+        fingerprint = _fingerprint()
+        store = get_idempotency_store()
+        record = store.begin(key, fingerprint,
+                             current_app.config['IDEMPOTENCY_WAIT_TIMEOUT'])
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                return jsonify({'message':
+                                f'{HEADER} was already used for a different request'}), 422
+            if record.response is None:
+                response = jsonify({'message': 'A request with this key is still in progress'})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+            body, status, headers = record.response
+            response = current_app.response_class(body, status, headers)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        g.idempotency_key = key
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            store.release(key)
+            raise
+        finally:
+            g.pop('idempotency_key', None)
+        if g.pop('idempotency_held', False):
+            return response
+        if response.status_code >= 500 or response.direct_passthrough:
+            store.release(key)
+        else:
+            store.complete(key, (response.get_data(), response.status_code,
+                                 list(response.headers.items())))
+        return response
+    return wrapper
@@ -0,0 +1,221 @@
+""" This module reserves and releases product stock atomically.
+
+Stock is never read, checked and written back from Python, which loses
+updates under concurrency. Each reservation is a single conditional UPDATE
+whose row count says whether there was enough stock:
+
+    UPDATE products SET stock = stock - :q WHERE id = :id AND stock >= :q
+
+For flash sales a product's stock can be split across STOCK_SHARDS rows in
+product_stock_shards (see split_stock). Reservations then pick a random
+shard with enough stock, so concurrent checkouts rarely wait on the same
+row lock; a quantity no single shard covers is gathered from several. While
+a product is split, products.stock only holds the part that was not moved
+into shards; Product.total_stock and available_stock() report the total.
+
+Every stock change invalidates the product's cached responses once its
+transaction commits.
+"""
+
+import random
+
+import click
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.orm import Session
+
+from app import db
+from app.cache import invalidate
+from app.models.product import Product
+from app.models.stock_shard import ProductStockShard
+
+
+class InsufficientStock(Exception):
+    """ Raised when a product cannot cover the requested quantity """
+
+    def __init__(self, product_id):
+        super().__init__(f'Insufficient stock for product {product_id}')
+        self.product_id = product_id
+
+
+def _take_from_product(product_id, quantity):
+    result = db.session.execute(
+        update(Product)
+        .where(Product.id == product_id, Product.stock >= quantity)
+        .values(stock=Product.stock - quantity)
+        .execution_options(synchronize_session=False))
+    return result.rowcount == 1
+
+
+def _stock_changed(product_id):
+    db.session.info.setdefault('stock_changed', set()).add(product_id)
+
+
+def _take_from_shards(product_id, quantity):
+    """ Takes up to quantity from the product's shards; returns how much it took.
+
+    A single shard that covers the whole quantity is tried first. Otherwise
+    the shards are drained in shard order, which keeps the lock order fixed.
+    """
+    candidates = [shard for (shard,) in db.session.execute(
+        db.select(ProductStockShard.shard).where(
+            ProductStockShard.product_id == product_id,
+            ProductStockShard.stock >= quantity))]
+    random.shuffle(candidates)
+    for shard in candidates:
+        result = db.session.execute(
+            update(ProductStockShard)
+            .where(ProductStockShard.product_id == product_id,
+                   ProductStockShard.shard == shard,
+                   ProductStockShard.stock >= quantity)
+            .values(stock=ProductStockShard.stock - quantity)
+            .execution_options(synchronize_session=False))
+        if result.rowcount == 1:
+            return quantity
+
+    taken = 0
+    rows = db.session.execute(
+        select(ProductStockShard.shard, ProductStockShard.stock)
+        .where(ProductStockShard.product_id == product_id, ProductStockShard.stock > 0)
+        .order_by(ProductStockShard.shard)
+        .with_for_update()).all()
+    for shard, stock in rows:
+        take = min(stock, quantity - taken)
+        result = db.session.execute(
+            update(ProductStockShard)
+            .where(ProductStockShard.product_id == product_id,
+                   ProductStockShard.shard == shard,
+                   ProductStockShard.stock >= take)
+            .values(stock=ProductStockShard.stock - take)
+            .execution_options(synchronize_session=False))
+        taken += take * result.rowcount
+        if taken == quantity:
+            break
+    return taken
+
+
+def reserve_stock(quantities):
+    """ Takes {product_id: quantity} out of stock in the current transaction.
+
+    Raises InsufficientStock on the first product that cannot be covered;
+    the caller must roll back so earlier reservations are undone. Products
+    are updated in id order so concurrent orders cannot deadlock. Shards
+    cover what they can and products.stock the rest.
+    """
+    sharded = current_app.config.get('STOCK_SHARDS', 0) > 0
+    for product_id, quantity in sorted(quantities.items()):
+        taken = _take_from_shards(product_id, quantity) if sharded else 0
+        if taken < quantity and not _take_from_product(product_id, quantity - taken):
+            if taken:
+                # Give the shard units back so the product's reservation is
+                # all or nothing even for callers that do not roll back.
+                release_stock({product_id: taken})
+            raise InsufficientStock(product_id)
+        _stock_changed(product_id)
+
+
+def release_stock(quantities):
+    """ Puts {product_id: quantity} back, e.g. when an order is canceled """
+    for product_id, quantity in sorted(quantities.items()):
+        db.session.execute(
+            update(Product)
+            .where(Product.id == product_id)
+            .values(stock=Product.stock + quantity)
+            .execution_options(synchronize_session=False))
+        _stock_changed(product_id)
+
+
+def available_stock(product_id):
+    """ Returns the product row's stock plus whatever sits in its shards """
+    product_stock = db.session.query(Product.stock).filter_by(id=product_id).scalar()
+    if product_stock is None:
+        return None
+    shard_stock = db.session.query(func.coalesce(func.sum(ProductStockShard.stock), 0)) \
+        .filter_by(product_id=product_id).scalar()
+    return product_stock + shard_stock
+
+
+def split_stock(product_id, shards):
+    """ Moves a product's stock evenly into shard rows """
+    if shards <= 0:
+        raise ValueError("Shard count must be positive")
+    product = db.session.query(Product).filter_by(id=product_id) \
+        .with_for_update().one()
+    existing = {row.shard: row for row in
+                db.session.query(ProductStockShard).filter_by(product_id=product_id)
+                .with_for_update()}
+    total = product.stock + sum(row.stock for row in existing.values())
+    for shard in range(max(shards, len(existing))):
+        row = existing.get(shard)
+        if row is None:
+            row = ProductStockShard(product_id=product_id, shard=shard)
+            db.session.add(row)
+        if shard < shards:
+            row.stock = total // shards + (1 if shard < total % shards else 0)
+        else:
+            row.stock = 0
+    product.stock = 0
+    db.session.commit()
+
+
+def clear_shards(product_ids):
+    """ Drops the shard rows of products whose stock is being set outright.
+
+    An absolute stock value replaces the product's total, so what the
+    shards held must not be added on top of it. Runs in the caller's
+    transaction, before products.stock is written.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return
+    db.session.execute(
+        delete(ProductStockShard).where(ProductStockShard.product_id.in_(product_ids))
+        .execution_options(synchronize_session=False))
+    for product_id in product_ids:
+        _stock_changed(product_id)
+
+
+def collect_stock(product_id):
+    """ Moves all shard stock back onto the product row """
+    product = db.session.query(Product).filter_by(id=product_id) \
+        .with_for_update().one()
+    rows = db.session.query(ProductStockShard).filter_by(product_id=product_id) \
+        .with_for_update().all()
+    product.stock += sum(row.stock for row in rows)
+    for row in rows:
+        db.session.delete(row)
+    db.session.commit()
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_cached_stock(session):
+    product_ids = session.info.pop('stock_changed', None)
+    if product_ids and has_app_context():
+        invalidate('products', *(f'product:{product_id}' for product_id in sorted(product_ids)))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_stock_changes(session):
+    session.info.pop('stock_changed', None)
+
+
+def init_app(app):
+    """ Registers the 'flask stock' commands """
+    @app.cli.group('stock')
+    def stock_cli():
+        """ Manage sharded stock for hot products """
+
+    @stock_cli.command('split')
+    @click.argument('product_id', type=int)
+    @click.option('--shards', type=int, default=None)
+    def split_command(product_id, shards):
+        """ Spread a product's stock over shard rows """
+        split_stock(product_id, shards or app.config.get('STOCK_SHARDS') or 8)
+        click.echo(f'Split stock of product {product_id}')
+
+    @stock_cli.command('collect')
+    @click.argument('product_id', type=int)
+    def collect_command(product_id):
+        """ Fold a product's shard rows back into products.stock """
+        collect_stock(product_id)
+        click.echo(f'Collected stock of product {product_id}')
@@ -0,0 +1,286 @@
+""" This module instruments requests and SQL and serves them at /metrics.
+
+Every request records its latency in a per-endpoint histogram. SQLAlchemy
+cursor events count the statements each request runs and the time spent in
+the database; a request that runs the same statement METRICS_N_PLUS_ONE_THRESHOLD
+times or more is logged as a suspected N+1 and counted. /metrics renders
+everything, plus the response cache and single-flight counters, in the
+Prometheus text format. Scrapers authenticate with METRICS_TOKEN as a
+bearer token; admins may use their access token instead.
+
+The hot path is a few perf_counter() calls, a bisect and one short locked
+update per request and per statement; rendering happens only on scrape.
+"""
+
+import hmac
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app, g, has_request_context, jsonify, request
+from flask_jwt_extended import verify_jwt_in_request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.auth import current_auth
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    """ A monotonically increasing value per label set """
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def inc_unlocked(self, labels, amount=1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            series = dict(self.series)
+        for labels, value in sorted(series.items()):
+            yield self.name, _labels(self.label_names, labels), value
+
+
+class Histogram:
+    """ Cumulative bucket counts, sum and count per label set """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            self.observe_unlocked(labels, value)
+
+    def observe_unlocked(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total)
+                      for labels, (counts, total) in self.series.items()}
+        names = self.label_names + ('le',)
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', _labels(names, labels + (bound,)), cumulative
+            yield f'{self.name}_sum', _labels(self.label_names, labels), total
+            yield f'{self.name}_count', _labels(self.label_names, labels), cumulative
+
+
+class Metrics:
+    """ The metrics recorded for one app """
+
+    def __init__(self, n_plus_one_threshold=10):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        # One lock for the whole per-request update keeps the hot path short;
+        # each metric shares it so scrapes see consistent values.
+        self._lock = threading.Lock()
+        self.latency = Histogram(
+            'http_request_duration_seconds', 'Request latency by endpoint',
+            ('endpoint', 'method'))
+        self.requests = Counter(
+            'http_requests_total', 'Requests by endpoint and status',
+            ('endpoint', 'method', 'status'))
+        self.statements = Histogram(
+            'db_statements_per_request', 'SQL statements run per request',
+            ('endpoint',), STATEMENT_BUCKETS)
+        self.db_time = Counter(
+            'db_duration_seconds_total', 'Time spent in SQL statements by endpoint',
+            ('endpoint',))
+        self.n_plus_one = Counter(
+            'db_n_plus_one_suspected_total', 'Requests repeating one statement many times',
+            ('endpoint',))
+        for metric in (self.latency, self.requests, self.statements,
+                       self.db_time, self.n_plus_one):
+            metric._lock = self._lock
+
+    def record(self, endpoint, method, status, elapsed, sql):
+        suspected = sql.max_repeats >= self.n_plus_one_threshold
+        with self._lock:
+            self.latency.observe_unlocked((endpoint, method), elapsed)
+            self.requests.inc_unlocked((endpoint, method, status))
+            self.statements.observe_unlocked((endpoint,), sql.count)
+            if sql.count:
+                self.db_time.inc_unlocked((endpoint,), sql.seconds)
+            if suspected:
+                self.n_plus_one.inc_unlocked((endpoint,))
+        if suspected:
+            current_app.logger.warning(
+                'Suspected N+1 in %s: statement ran %d times: %s',
+                endpoint, sql.max_repeats, sql.max_statement[:200])
+
+    def render(self, extra=()):
+        lines = []
+        for metric in (self.latency, self.requests, self.statements,
+                       self.db_time, self.n_plus_one, *extra):
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Gauge:
+    """ A value read at scrape time """
+
+    def __init__(self, name, help_text, value, kind='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.value = value
+
+    def samples(self):
+        yield self.name, '', self.value
+
+
+class _RequestSQL:
+    """ Statement count, time and repeats of the current request """
+
+    __slots__ = ('count', 'seconds', 'repeats', 'max_repeats', 'max_statement')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.repeats = {}
+        self.max_repeats = 0
+        self.max_statement = None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('request_sql') is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    started = starts.pop()
+    sql = g.get('request_sql') if has_request_context() else None
+    if sql is None:
+        return
+    sql.seconds += time.perf_counter() - started
+    sql.count += 1
+    repeats = sql.repeats[statement] = sql.repeats.get(statement, 0) + 1
+    if repeats > sql.max_repeats:
+        sql.max_repeats = repeats
+        sql.max_statement = statement
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    starts = connection.info.get('query_start') if connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def _external_metrics():
+    from app.cache import get_cache
+    from app.singleflight import get_single_flight
+    cache = get_cache().stats()
+    single_flight = get_single_flight().stats()
+    return [
+        _Gauge('response_cache_hits_total', 'Response cache hits', cache.get('hits', 0), 'counter'),
+        _Gauge('response_cache_misses_total', 'Response cache misses',
+               cache.get('misses', 0), 'counter'),
+        _Gauge('response_cache_evictions_total', 'Response cache evictions',
+               cache.get('evictions', 0), 'counter'),
+        _Gauge('response_cache_entries', 'Entries in the response cache', cache.get('entries', 0)),
+        _Gauge('single_flight_leaders_total', 'Reads that ran their view',
+               single_flight['leaders'], 'counter'),
+        _Gauge('single_flight_coalesced_total', 'Reads that reused an identical one in flight',
+               single_flight['coalesced'], 'counter'),
+        _Gauge('single_flight_timeouts_total', 'Coalesced reads that gave up waiting',
+               single_flight['timeouts'], 'counter'),
+    ]
+
+
+def _scrape_error():
+    """ Returns an error response unless the request may read /metrics """
+    token = current_app.config.get('METRICS_TOKEN')
+    header = request.headers.get('Authorization', '')
+    if token and hmac.compare_digest(header.encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+        return None
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        response = jsonify({'error': 'Metrics require METRICS_TOKEN or an admin token'})
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response, 401
+    if not current_auth().is_admin:
+        return jsonify({'error': 'Only admins can read metrics'}), 403
+    return None
+
+
+def init_app(app):
+    """ Installs the request hooks and the /metrics route on app """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    metrics = app.extensions['metrics'] = Metrics(
+        n_plus_one_threshold=app.config.get('METRICS_N_PLUS_ONE_THRESHOLD', 10))
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.request_sql = _RequestSQL()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        sql = g.pop('request_sql', None)
+        if started is not None and request.endpoint != 'metrics':
+            metrics.record(request.endpoint or 'unmatched', request.method,
+                           response.status_code, time.perf_counter() - started, sql)
+        return response
+
+    @app.route('/metrics', endpoint='metrics')
+    def metrics_view():
+        """ Returns the metrics in the Prometheus text format """
+        error = _scrape_error()
+        if error:
+            return error
+        body = metrics.render(_external_metrics())
+        return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def get_metrics():
+    """ Returns the metrics of the current app """
+    return current_app.extensions['metrics']
@@ -0,0 +1,234 @@
+""" This module contains the versioned schema migrations.
+
+Each migration is a function of an open connection, registered in order with
+@migration. upgrade() applies the ones newer than the version recorded in
+the schema_version table, each in its own transaction. Migrations must be
+safe on a database that create_all() already brought up to date, so they
+check the live schema before changing it.
+
+    flask db upgrade      apply pending migrations
+    flask db current      print the current schema version
+"""
+
+from datetime import datetime
+
+import click
+from sqlalchemy import inspect, text
+
+from app import db
+
+MIGRATIONS = []
+
+schema_version = db.Table(
+    'schema_version', db.MetaData(),
+    db.Column('version', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('name', db.String(200), nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+
+def migration(version, name):
+    """ Registers fn as the migration to schema version """
+    def decorator(fn):
+        if MIGRATIONS and MIGRATIONS[-1][0] >= version:
+            raise ValueError(f'Migration {version} is out of order')
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return decorator
+
+
+def _has_column(connection, table, column):
+    return column in {c['name'] for c in inspect(connection).get_columns(table)}
+
+
+def _create_missing_indexes(connection, table, indexes):
+    """ Creates the indexes (name -> columns) on table that the database lacks.
+
+    Each migration lists its own indexes rather than reading them from the
+    models, whose later columns may not exist yet at that version.
+    """
+    existing = {index['name'] for index in inspect(connection).get_indexes(table)}
+    for name, columns in indexes.items():
+        if name not in existing:
+            connection.execute(text(f'CREATE INDEX {name} ON {table} ({", ".join(columns)})'))
+
+
+@migration(1, 'baseline: create missing tables')
+def baseline(connection):
+    import app.models  # noqa: F401 - registers every model on the metadata
+    db.metadata.create_all(connection)
+
+
+@migration(2, 'token_blacklist.expires_at')
+def token_blacklist_expires_at(connection):
+    if not _has_column(connection, 'token_blacklist', 'expires_at'):
+        connection.execute(text('ALTER TABLE token_blacklist ADD COLUMN expires_at DATETIME NULL'))
+    _create_missing_indexes(connection, 'token_blacklist', {
+        'ix_token_blacklist_created_at': ('created_at',),
+        'ix_token_blacklist_expires_at': ('expires_at',),
+    })
+
+
+@migration(3, 'orders.product_id nullable for multi-item orders')
+def orders_product_id_nullable(connection):
+    if connection.dialect.name == 'mysql':
+        connection.execute(text('ALTER TABLE orders MODIFY product_id INTEGER NULL'))
+        return
+    if connection.dialect.name != 'sqlite':
+        return
+    product_id = next(column for column in inspect(connection).get_columns('orders')
+                      if column['name'] == 'product_id')
+    if not product_id['nullable']:
+        # SQLite cannot alter column constraints: copy the table into one
+        # with the new definition. It has no indexes before migration 5.
+        connection.execute(text(
+            'CREATE TABLE orders_rebuild ('
+            'id INTEGER NOT NULL PRIMARY KEY, '
+            'user_id INTEGER NOT NULL REFERENCES users (id), '
+            'product_id INTEGER NULL REFERENCES products (id), '
+            'quantity INTEGER NOT NULL, '
+            'total_price FLOAT NOT NULL, '
+            'status VARCHAR(20) NOT NULL, '
+            'date_ordered DATETIME NOT NULL)'))
+        connection.execute(text(
+            'INSERT INTO orders_rebuild (id, user_id, product_id, quantity, total_price, '
+            'status, date_ordered) SELECT id, user_id, product_id, quantity, total_price, '
+            'status, date_ordered FROM orders'))
+        connection.execute(text('DROP TABLE orders'))
+        connection.execute(text('ALTER TABLE orders_rebuild RENAME TO orders'))
+
+
+@migration(4, 'products FULLTEXT index')
+def products_fulltext(connection):
+    if connection.dialect.name != 'mysql':
+        return
+    existing = {index['name'] for index in inspect(connection).get_indexes('products')}
+    if 'ix_products_fulltext' not in existing:
+        connection.execute(text(
+            'ALTER TABLE products ADD FULLTEXT INDEX ix_products_fulltext (name, description)'))
+
+
+@migration(5, 'indexes for order and product access paths')
+def access_path_indexes(connection):
+    _create_missing_indexes(connection, 'orders', {
+        'ix_orders_user_id_date_ordered': ('user_id', 'date_ordered'),
+        'ix_orders_status_date_ordered': ('status', 'date_ordered'),
+        'ix_orders_date_ordered': ('date_ordered',),
+    })
+    _create_missing_indexes(connection, 'products', {
+        'ix_products_category_id_id': ('category_id', 'id'),
+        'ix_products_status_id': ('status', 'id'),
+        'ix_products_price_id': ('price', 'id'),
+        'ix_products_name_id': ('name', 'id'),
+    })
+    _create_missing_indexes(connection, 'order_items', {
+        'ix_order_items_order_id': ('order_id',),
+    })
+
+
+@migration(6, 'notifications and unread counters')
+def notifications_tables(connection):
+    import app.models  # noqa: F401
+    tables = [db.metadata.tables[name] for name in ('notifications', 'notification_counters')]
+    db.metadata.create_all(connection, tables=tables)
+    _create_missing_indexes(connection, 'notifications', {
+        'ix_notifications_user_id_id': ('user_id', 'id'),
+        'ix_notifications_user_id_is_read': ('user_id', 'is_read'),
+    })
+
+
+@migration(7, 'carts and cart_items')
+def carts_tables(connection):
+    import app.models  # noqa: F401
+    tables = [db.metadata.tables[name] for name in ('carts', 'cart_items')]
+    db.metadata.create_all(connection, tables=tables)
+
+
+@migration(8, 'wishlist_items')
+def wishlist_items_table(connection):
+    import app.models  # noqa: F401
+    db.metadata.create_all(connection, tables=[db.metadata.tables['wishlist_items']])
+
+
+@migration(9, 'reviews and product rating aggregates')
+def reviews_and_ratings(connection):
+    import app.models  # noqa: F401
+    columns = {'rating_count': 'INTEGER', 'rating_sum': 'INTEGER', 'rating_avg': 'FLOAT'}
+    columns.update({f'rating_{stars}': 'INTEGER' for stars in range(1, 6)})
+    for column, column_type in columns.items():
+        if not _has_column(connection, 'products', column):
+            connection.execute(text(
+                f'ALTER TABLE products ADD COLUMN {column} {column_type} NOT NULL DEFAULT 0'))
+    db.metadata.create_all(connection, tables=[db.metadata.tables['reviews']])
+    _create_missing_indexes(connection, 'products', {
+        'ix_products_rating_avg_id': ('rating_avg', 'id'),
+    })
+    _create_missing_indexes(connection, 'reviews', {
+        'ix_reviews_product_id_id': ('product_id', 'id'),
+    })
+
+
+@migration(10, 'catalog change versions and tombstones')
+def catalog_change_versions(connection):
+    import app.models  # noqa: F401
+    for table in ('products', 'categories'):
+        if not _has_column(connection, table, 'change_version'):
+            connection.execute(text(
+                f'ALTER TABLE {table} ADD COLUMN change_version BIGINT NOT NULL DEFAULT 0'))
+    tables = [db.metadata.tables[name] for name in ('change_sequences', 'change_tombstones')]
+    db.metadata.create_all(connection, tables=tables)
+    for table in ('products', 'categories'):
+        _create_missing_indexes(connection, table, {
+            f'ix_{table}_change_version_id': ('change_version', 'id'),
+        })
+    _create_missing_indexes(connection, 'change_tombstones', {
+        'ix_change_tombstones_entity_version_id': ('entity', 'change_version', 'entity_id'),
+    })
+    # Existing rows stay at version 0, which full syncs (no since) include.
+    if not connection.execute(text(
+            "SELECT 1 FROM change_sequences WHERE name = 'catalog'")).first():
+        connection.execute(text(
+            "INSERT INTO change_sequences (name, value) VALUES ('catalog', 0)"))
+
+
+def current_version(connection):
+    """ Returns the schema version of the database, 0 if unversioned """
+    schema_version.create(connection, checkfirst=True)
+    return connection.execute(
+        db.select(db.func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(engine=None):
+    """ Applies pending migrations; returns the list of versions applied """
+    engine = engine or db.engine
+    with engine.begin() as connection:
+        version = current_version(connection)
+    applied = []
+    for number, name, fn in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as connection:
+            fn(connection)
+            connection.execute(schema_version.insert().values(
+                version=number, name=name, applied_at=datetime.utcnow()))
+        applied.append(number)
+    return applied
+
+
+def init_app(app):
+    """ Registers the 'flask db' commands """
+    @app.cli.group('db')
+    def db_cli():
+        """ Manage the database schema """
+
+    @db_cli.command('upgrade')
+    def upgrade_command():
+        """ Apply pending schema migrations """
+        applied = upgrade()
+        click.echo(f'Applied migrations: {applied}' if applied else 'Schema is up to date')
+
+    @db_cli.command('current')
+    def current_command():
+        """ Print the current schema version """
+        with db.engine.begin() as connection:
+            click.echo(current_version(connection))
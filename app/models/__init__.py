@@ -1,5 +1,15 @@
 from app.models.user import User
 from app.models.product import Product
 from app.models.order import Order
+from app.models.order_item import OrderItem
 from app.models.category import Category
 from app.models.blacklist import TokenBlacklist
+from app.models.stock_shard import ProductStockShard
+from app.models.notification import Notification
+from app.models.notification_counter import NotificationCounter
+from app.models.cart import Cart
+from app.models.cart_item import CartItem
+from app.models.wishlist_item import WishlistItem
+from app.models.review import Review
+from app.models.change_sequence import ChangeSequence
+from app.models.change_tombstone import ChangeTombstone
@@ -6,4 +6,7 @@ class TokenBlacklist(db.Model):
     __tablename__ = 'token_blacklist'
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(36), nullable=False, unique=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # When the revoked token would have expired anyway; the row can be
+    # purged after that.
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
@@ -0,0 +1,23 @@
+""" This module contains the cart model for creating database. """
+
+from datetime import datetime
+
+from app import db
+
+
+class Cart(db.Model):
+    __tablename__ = 'carts'
+    """ This class creates the Cart model, the persisted copy of a user's
+    cart. Live carts are served from the cart store (see app/carts.py) and
+    written here behind the requests that change them.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True,
+                        autoincrement=False)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    subtotal = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    items = db.relationship('CartItem', lazy='selectin', cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<Cart {self.user_id}>'
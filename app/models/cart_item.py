@@ -0,0 +1,19 @@
+""" This module contains the cart item model for creating database. """
+
+from app import db
+
+
+class CartItem(db.Model):
+    __tablename__ = 'cart_items'
+    """ This class creates the CartItem model, one product line of a
+    persisted cart, with fields user_id, product_id, quantity and unit_price.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('carts.user_id'), primary_key=True,
+                        autoincrement=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True,
+                           autoincrement=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    unit_price = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<CartItem {self.user_id}/{self.product_id}>'
@@ -9,10 +9,15 @@ from sqlalchemy.orm import relationship
 class Category(db.Model):
     __tablename__ = 'categories'
     """ This class creates the Category model for products """
+    __table_args__ = (
+        db.Index('ix_categories_change_version_id', 'change_version', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, unique=True)
     description = db.Column(db.Text, nullable=True)
+    # Catalog change version, for GET /products/changes (see app/changes.py).
+    change_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return f'<Category {self.name}>'
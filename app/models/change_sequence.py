@@ -0,0 +1,17 @@
+""" This module contains the change sequence model. """
+
+from app import db
+
+
+class ChangeSequence(db.Model):
+    __tablename__ = 'change_sequences'
+    """ This class creates the ChangeSequence model, a named counter handing
+    out change versions (see app/changes.py). The 'catalog' row numbers
+    catalog changes and 'catalog_pruned' records how far tombstones were
+    pruned.
+    """
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ChangeSequence {self.name}: {self.value}>'
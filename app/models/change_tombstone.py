@@ -0,0 +1,26 @@
+""" This module contains the change tombstone model. """
+
+from datetime import datetime
+
+from app import db
+
+
+class ChangeTombstone(db.Model):
+    __tablename__ = 'change_tombstones'
+    """ This class creates the ChangeTombstone model, the record that a
+    product or category was deleted at a change version, with fields id,
+    entity, entity_id, change_version and deleted_at.
+    """
+    __table_args__ = (
+        db.Index('ix_change_tombstones_entity_version_id',
+                 'entity', 'change_version', 'entity_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    change_version = db.Column(db.BigInteger, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ChangeTombstone {self.entity} {self.entity_id} @{self.change_version}>'
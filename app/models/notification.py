@@ -0,0 +1,37 @@
+""" This module contains the notification model for creating database. """
+
+from datetime import datetime
+
+from app import db
+
+
+class Notification(db.Model):
+    __tablename__ = 'notifications'
+    """ This class creates the Notification model, a message for one user,
+    with fields id, user_id, kind, message, is_read and created_at.
+    """
+    __table_args__ = (
+        # Newest-first listing and long-poll "id > after" per user.
+        db.Index('ix_notifications_user_id_id', 'user_id', 'id'),
+        # Bulk mark-as-read only touches the user's unread rows.
+        db.Index('ix_notifications_user_id_is_read', 'user_id', 'is_read'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(50), nullable=False, default='info')
+    message = db.Column(db.String(255), nullable=False)
+    is_read = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Notification {self.id} - User {self.user_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'message': self.message,
+            'is_read': self.is_read,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
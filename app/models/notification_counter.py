@@ -0,0 +1,17 @@
+""" This module contains the unread notification counter model. """
+
+from app import db
+
+
+class NotificationCounter(db.Model):
+    __tablename__ = 'notification_counters'
+    """ This class creates the NotificationCounter model, the number of
+    unread notifications of a user, kept in step with the notifications
+    table so unread badges are a primary key lookup instead of a COUNT(*).
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True,
+                        autoincrement=False)
+    unread = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<NotificationCounter {self.user_id}: {self.unread}>'
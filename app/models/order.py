@@ -9,26 +9,48 @@ from datetime import datetime
 class Order(db.Model):
     __tablename__ = 'orders'
     """ This class creates the Order model with fields id, user_id, product_id, quantity,
-    total_price, status, and created_at.
+    total_price, status, and created_at. The lines of the order live in
+    OrderItem; product_id is only set for single-line orders and quantity
+    is the total number of units.
     """
+    # Secondary indexes carry the primary key, so each of these also serves
+    # keyset pages ordered by (date_ordered, id) in either direction.
+    __table_args__ = (
+        db.Index('ix_orders_user_id_date_ordered', 'user_id', 'date_ordered'),
+        db.Index('ix_orders_status_date_ordered', 'status', 'date_ordered'),
+        db.Index('ix_orders_date_ordered', 'date_ordered'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=True)
     quantity = db.Column(db.Integer, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), nullable=False, default='Pending')
     date_ordered = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
+    # selectin loads the items of a whole page of orders in one query.
+    items = db.relationship('OrderItem', backref='order', lazy='selectin',
+                            cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<Order {self.id} - User {self.user_id}>'
 
-    def to_dict(self):
+    def to_dict(self, items=None):
+        """ items may be passed in to avoid loading the relationship """
+        if items is None:
+            items = [item.to_dict() for item in self.items]
+        if not items and self.product_id is not None:
+            # Orders placed before order items existed.
+            items = [{'product_id': self.product_id,
+                      'quantity': self.quantity,
+                      'unit_price': self.total_price / self.quantity}]
         return {
             'id': self.id,
             'quantity': self.quantity,
             'total_price': self.total_price,
             'status': self.status,
             'user_id': self.user_id,
-            'product_id': self.product_id
+            'product_id': self.product_id,
+            'items': items
         }
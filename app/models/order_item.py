@@ -0,0 +1,25 @@
+""" This module contains the order item model for creating database. """
+
+from app import db
+
+
+class OrderItem(db.Model):
+    __tablename__ = 'order_items'
+    """ This class creates the OrderItem model, one line of an order, with
+    fields id, order_id, product_id, quantity and unit_price.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    unit_price = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<OrderItem {self.id} - Order {self.order_id}>'
+
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'quantity': self.quantity,
+            'unit_price': self.unit_price
+        }
@@ -1,8 +1,11 @@
 """ This module contain the Product class for creating database. """
 
+import math
+
 from app import db
-from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey
-from sqlalchemy.orm import validates
+from app.models.stock_shard import ProductStockShard
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, func, select
+from sqlalchemy.orm import column_property, validates
 
 
 class Product(db.Model):
@@ -10,6 +13,16 @@ class Product(db.Model):
         """ This class represents a Product in the system with fields like id, name,
         description, etc.
         """
+        # One index per listing access path: category pages and the sort
+        # keys offered by GET /products, each ending in the id tie-breaker.
+        __table_args__ = (
+            db.Index('ix_products_category_id_id', 'category_id', 'id'),
+            db.Index('ix_products_status_id', 'status', 'id'),
+            db.Index('ix_products_price_id', 'price', 'id'),
+            db.Index('ix_products_name_id', 'name', 'id'),
+            db.Index('ix_products_rating_avg_id', 'rating_avg', 'id'),
+            db.Index('ix_products_change_version_id', 'change_version', 'id'),
+        )
 
         id = db.Column(db.Integer, primary_key=True)
         name = db.Column(db.String(100), nullable=False)
@@ -19,6 +32,25 @@ class Product(db.Model):
         category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
         stock = db.Column(db.Integer, nullable=False, default=0)
         status = db.Column(db.String(20), nullable=False, default='available')
+        # stock plus whatever split_stock moved into shard rows (app/inventory.py);
+        # a primary key range lookup, empty for products that were never split.
+        total_stock = column_property(
+            stock + select(func.coalesce(func.sum(ProductStockShard.stock), 0))
+            .where(ProductStockShard.product_id == id)
+            .correlate_except(ProductStockShard)
+            .scalar_subquery())
+        # Review aggregates, kept current by app/ratings.py so listings never
+        # aggregate reviews. rating_avg is stored only so it can be indexed.
+        rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+        rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+        rating_avg = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+        rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+        rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+        rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+        rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+        rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+        # Catalog change version, for GET /products/changes (see app/changes.py).
+        change_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
 
         orders = db.relationship('Order', backref='products', lazy='dynamic')
         category = db.relationship('Category', backref='products')
@@ -32,23 +64,43 @@ class Product(db.Model):
                 'name': self.name,
                 'description': self.description,
                 'price': self.price,
-                'stock': self.stock,
+                'stock': self.total_stock,
                 'status': self.status,
-                'category_id': self.category_id
+                'category_id': self.category_id,
+                'rating': {
+                    'average': round(self.rating_avg or 0, 2),
+                    'count': self.rating_count or 0,
+                    'histogram': {str(stars): getattr(self, f'rating_{stars}') or 0
+                                  for stars in range(1, 6)}
+                }
             }
         
-        @validates('price')
-        def validate_price(self, key, value):
+        @staticmethod
+        def check_price(value):
+            """ Price rule, shared by the ORM validator and bulk imports """
+            if not math.isfinite(value):
+                raise ValueError("Price must be a finite number")
             if value < 0:
                 raise ValueError("Price must be non-negative")
             return value
 
-        @validates('stock')
-        def validate_stock(self, key, value):
+        @staticmethod
+        def check_stock(value):
+            """ Stock rule, shared by the ORM validator and bulk imports """
+            if not math.isfinite(value):
+                raise ValueError("Stock must be a finite number")
             if value < 0:
                 raise ValueError("Stock cannot be negative")
             return value
 
+        @validates('price')
+        def validate_price(self, key, value):
+            return self.check_price(value)
+
+        @validates('stock')
+        def validate_stock(self, key, value):
+            return self.check_stock(value)
+
         def is_in_stock(self):
             return self.stock > 0
 
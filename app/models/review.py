@@ -0,0 +1,43 @@
+""" This module contains the review model for creating database. """
+
+from datetime import datetime
+
+from app import db
+
+
+class Review(db.Model):
+    __tablename__ = 'reviews'
+    """ This class creates the Review model, one user's rating (1-5) and
+    comment on a product, with fields id, product_id, user_id, rating,
+    comment, created_at and updated_at.
+    """
+    __table_args__ = (
+        # One review per user and product.
+        db.UniqueConstraint('product_id', 'user_id', name='uq_reviews_product_user'),
+        # Newest-first listing per product.
+        db.Index('ix_reviews_product_id_id', 'product_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'),
+                           nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    rating = db.Column(db.Integer, nullable=False)
+    comment = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Review {self.id} - Product {self.product_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'user_id': self.user_id,
+            'rating': self.rating,
+            'comment': self.comment,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
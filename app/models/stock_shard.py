@@ -0,0 +1,17 @@
+""" This module contains the stock shard model for creating database. """
+
+from app import db
+
+
+class ProductStockShard(db.Model):
+    __tablename__ = 'product_stock_shards'
+    """ This class creates the ProductStockShard model. A hot product's stock
+    can be split across several shard rows so concurrent checkouts update
+    different rows instead of queueing on one.
+    """
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    stock = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ProductStockShard {self.product_id}/{self.shard}>'
@@ -3,9 +3,9 @@
 from sqlalchemy import Column, Integer, String, Boolean, DateTime
 from sqlalchemy.orm import relationship
 import datetime
-import bcrypt
 import re
 from app import db
+from app.passwords import get_password_hasher
 
 
 class User(db.Model):
@@ -25,14 +25,18 @@ class User(db.Model):
 
 
     def set_password(self, password):
-        """ This function hashs the user password """
+        """ This function hashs the user password on the hashing pool """
         if len(password) < 8:
             raise ValueError("Password must be at least 8 characters long")
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        self.password_hash = get_password_hasher().hash(password)
 
     def check_password(self, password):
-        """ This dunction verifies the password """
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        """ This dunction verifies the password on the hashing pool """
+        return get_password_hasher().verify(password, self.password_hash)
+
+    def password_needs_rehash(self):
+        """ True if the stored hash uses an outdated bcrypt cost """
+        return get_password_hasher().needs_rehash(self.password_hash)
 
     @staticmethod
     def validate_email(email):
@@ -0,0 +1,37 @@
+""" This module contains the wishlist item model for creating database. """
+
+from datetime import datetime
+
+from app import db
+
+
+class WishlistItem(db.Model):
+    __tablename__ = 'wishlist_items'
+    """ This class creates the WishlistItem model, one product saved by a
+    user, with fields id, user_id, product_id and created_at.
+    """
+    __table_args__ = (
+        # Membership lookups for a page of products and duplicate adds.
+        db.UniqueConstraint('user_id', 'product_id', name='uq_wishlist_items_user_product'),
+        # Newest-first listing per user.
+        db.Index('ix_wishlist_items_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'),
+                           nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    product = db.relationship('Product', lazy='joined')
+
+    def __repr__(self):
+        return f'<WishlistItem {self.user_id}/{self.product_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'added_at': self.created_at.isoformat() if self.created_at else None,
+            'product': self.product.to_dict() if self.product else None
+        }
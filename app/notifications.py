@@ -0,0 +1,140 @@
+""" This module delivers user notifications and keeps unread counters.
+
+Clients poll for their unread badge every few seconds, so the count lives in
+notification_counters instead of being a COUNT(*) per poll. Every change to
+a notification's read state is a conditional UPDATE whose row count is
+applied to the counter in the same transaction, which keeps the two in step
+without ever recounting.
+
+Clients waiting for new notifications use the long-poll route. Waiters
+block on an in-process NotificationHub that notify() wakes once its
+transaction commits. Other processes cannot wake them, so waiters also
+re-query every NOTIFICATIONS_POLL_RECHECK seconds.
+"""
+
+import threading
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, insert, update
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.notification import Notification
+from app.models.notification_counter import NotificationCounter
+
+
+class NotificationHub:
+    """ Wakes long-poll requests waiting on a user's notifications """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._versions = {}
+
+    def version(self, user_id):
+        """ Returns a token that changes whenever user_id is notified """
+        with self._condition:
+            return self._versions.get(user_id, 0)
+
+    def publish(self, user_ids):
+        with self._condition:
+            for user_id in user_ids:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._condition.notify_all()
+
+    def wait(self, user_id, version, timeout):
+        """ Blocks until user_id is notified after version, or timeout """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._versions.get(user_id, 0) != version, timeout)
+
+
+def _add_unread(user_id, delta):
+    """ Adds delta to a user's unread counter, creating the row if needed """
+    if delta < 0:
+        db.session.execute(
+            update(NotificationCounter)
+            .where(NotificationCounter.user_id == user_id)
+            .values(unread=NotificationCounter.unread + delta))
+        return
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        statement = mysql_insert(NotificationCounter).values(user_id=user_id, unread=delta)
+        statement = statement.on_duplicate_key_update(
+            unread=NotificationCounter.unread + delta)
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        statement = sqlite_insert(NotificationCounter).values(user_id=user_id, unread=delta)
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id'], set_={'unread': NotificationCounter.unread + delta})
+    else:
+        result = db.session.execute(
+            update(NotificationCounter)
+            .where(NotificationCounter.user_id == user_id)
+            .values(unread=NotificationCounter.unread + delta))
+        if result.rowcount:
+            return
+        statement = insert(NotificationCounter).values(user_id=user_id, unread=delta)
+    db.session.execute(statement)
+
+
+def notify(user_id, message, kind='info'):
+    """ Adds a notification for user_id to the current transaction.
+
+    Long-poll waiters of user_id are woken once the transaction commits.
+    """
+    notification = Notification(user_id=user_id, message=message, kind=kind)
+    db.session.add(notification)
+    _add_unread(user_id, 1)
+    db.session.info.setdefault('notified_users', set()).add(user_id)
+    return notification
+
+
+def unread_count(user_id):
+    """ Returns the number of unread notifications of user_id """
+    counter = db.session.get(NotificationCounter, user_id)
+    return counter.unread if counter else 0
+
+
+def mark_read(user_id, ids=None, up_to=None):
+    """ Marks notifications of user_id read; returns how many changed.
+
+    ids limits the change to those notifications and up_to to ids at or
+    below it; with neither, every unread notification is marked.
+    """
+    statement = update(Notification).where(
+        Notification.user_id == user_id, Notification.is_read.is_(False))
+    if ids is not None:
+        statement = statement.where(Notification.id.in_(ids))
+    if up_to is not None:
+        statement = statement.where(Notification.id <= up_to)
+    changed = db.session.execute(
+        statement.values(is_read=True).execution_options(synchronize_session=False)).rowcount
+    if changed:
+        _add_unread(user_id, -changed)
+    return changed
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish(session):
+    user_ids = session.info.pop('notified_users', None)
+    if user_ids and has_app_context():
+        hub = current_app.extensions.get('notification_hub')
+        if hub is not None:
+            hub.publish(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('notified_users', None)
+
+
+def init_app(app):
+    """ Creates the long-poll hub for app """
+    app.extensions['notification_hub'] = NotificationHub()
+
+
+def get_notification_hub():
+    """ Returns the long-poll hub of the current app """
+    return current_app.extensions['notification_hub']
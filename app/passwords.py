@@ -0,0 +1,79 @@
+""" This module runs bcrypt hashing off the request threads.
+
+bcrypt is deliberately slow, so a burst of logins can occupy every web
+worker and starve cheap catalog reads. PasswordHasher gives hashing its own
+small thread pool (bcrypt releases the GIL while it works) and admits at
+most PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE jobs at a time.
+Anything beyond that fails fast with PasswordHasherBusy, which the routes
+turn into a 503.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import bcrypt
+from flask import current_app
+
+
+class PasswordHasherBusy(Exception):
+    """ Raised when the hashing pool cannot take more work """
+
+
+class PasswordHasher:
+    """ Hashes and verifies passwords on a bounded worker pool """
+
+    def __init__(self, rounds=12, workers=2, queue_size=16, timeout=10):
+        self.rounds = rounds
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy('Password hashing pool is full')
+        try:
+            future = self._executor.submit(fn, *args)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PasswordHasherBusy('Password hashing timed out')
+
+    def hash(self, password, rounds=None):
+        """ Returns the bcrypt hash of password as a string """
+        salt = bcrypt.gensalt(rounds or self.rounds)
+        hashed = self._run(bcrypt.hashpw, password.encode('utf-8'), salt)
+        return hashed.decode('utf-8')
+
+    def verify(self, password, hashed):
+        """ Checks password against a stored bcrypt hash """
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed)
+
+    def needs_rehash(self, hashed):
+        """ True if hashed was made with a different cost than configured """
+        if isinstance(hashed, bytes):
+            hashed = hashed.decode('utf-8')
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+def init_app(app):
+    """ Creates the password hashing pool for app """
+    app.extensions['password_hasher'] = PasswordHasher(
+        rounds=app.config.get('BCRYPT_LOG_ROUNDS', 12),
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+        queue_size=app.config.get('PASSWORD_HASH_QUEUE_SIZE', 16),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10))
+
+
+def get_password_hasher():
+    """ Returns the password hasher of the current app """
+    return current_app.extensions['password_hasher']
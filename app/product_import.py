@@ -0,0 +1,221 @@
+""" This module bulk imports products from CSV or NDJSON files.
+
+Rows are parsed and validated one at a time from a stream, so a supplier
+file never has to fit in memory, and written in chunks of IMPORT_CHUNK_SIZE:
+one IN (...) query finds which ids already exist, then one bulk UPDATE and
+one bulk INSERT statement write the chunk, which commits on its own.
+"""
+
+import csv
+import io
+import json
+from itertools import islice
+
+import click
+from flask import current_app
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.cache import invalidate
+from app.changes import next_change_version
+from app.inventory import clear_shards
+from app.models.product import Product
+from app.search import get_search_backend
+
+FORMATS = ('csv', 'ndjson')
+
+# Product columns a row may set, with the function that parses each one.
+FIELDS = {
+    'id': int,
+    'name': str,
+    'description': str,
+    'price': float,
+    'image_path': str,
+    'category_id': int,
+    'stock': int,
+    'status': str,
+}
+MAX_LENGTHS = {'name': 100, 'image_path': 255, 'status': 20}
+
+
+def iter_rows(stream, import_format):
+    """ Yields raw row dicts from a binary stream """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if import_format == 'csv':
+        yield from csv.DictReader(text)
+        return
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row if isinstance(row, dict) else {'__invalid__': line}
+
+
+def validate_row(raw):
+    """ Returns (clean row, errors) using the same rules as the Product model """
+    if '__invalid__' in raw:
+        return None, [{'field': None, 'message': 'Row is not a JSON object'}]
+
+    row, errors = {}, []
+    for field, parse in FIELDS.items():
+        value = raw.get(field)
+        if value is None or value == '':
+            continue
+        try:
+            if parse is int and isinstance(value, float) and not value.is_integer():
+                raise ValueError
+            row[field] = parse(value)
+        except (TypeError, ValueError):
+            errors.append({'field': field, 'message': f'Invalid {field}'})
+            continue
+        if field in MAX_LENGTHS and len(row[field]) > MAX_LENGTHS[field]:
+            errors.append({'field': field, 'message':
+                           f'{field} is longer than {MAX_LENGTHS[field]} characters'})
+
+    for field, check in (('price', Product.check_price), ('stock', Product.check_stock)):
+        if field in row:
+            try:
+                check(row[field])
+            except ValueError as e:
+                errors.append({'field': field, 'message': str(e)})
+    return row, errors
+
+
+def _write_chunk(chunk, report):
+    """ Upserts one chunk of (row number, validated row) pairs """
+    ids = [row['id'] for _, row in chunk if 'id' in row]
+    existing = set()
+    if ids:
+        existing = {product_id for (product_id,) in
+                    db.session.query(Product.id).filter(Product.id.in_(ids))}
+
+    updates, inserts, numbers = [], [], {}
+    for number, row in chunk:
+        if row.get('id') in existing:
+            updates.append(row)
+            numbers[id(row)] = number
+            continue
+        missing = [field for field in ('name', 'price') if field not in row]
+        if missing:
+            _fail(report, number, [{'field': field, 'message': f'Missing {field}'}
+                                   for field in missing])
+            continue
+        row = dict({'stock': 0, 'status': 'available'}, **row)
+        inserts.append(row)
+        numbers[id(row)] = number
+
+    try:
+        if updates or inserts:
+            # One change version for the chunk, which commits as one transaction.
+            version = next_change_version()
+            for row in updates + inserts:
+                row['change_version'] = version
+        if updates:
+            clear_shards(row['id'] for row in updates if 'stock' in row)
+            db.session.execute(update(Product), updates)
+        if inserts:
+            db.session.execute(insert(Product), inserts)
+        db.session.commit()
+    except IntegrityError:
+        # Something in the chunk broke a constraint (e.g. an unknown
+        # category_id); replay it row by row to find out which rows.
+        db.session.rollback()
+        return _write_rows_singly(updates, inserts, numbers, report)
+    report['inserted'] += len(inserts)
+    report['updated'] += len(updates)
+    return [row['id'] for row in updates]
+
+
+def _write_rows_singly(updates, inserts, numbers, report):
+    updated_ids = []
+    for statement, rows in ((update(Product), updates), (insert(Product), inserts)):
+        for row in rows:
+            try:
+                # The chunk's version was rolled back with it.
+                row['change_version'] = next_change_version()
+                if rows is updates and 'stock' in row:
+                    clear_shards([row['id']])
+                db.session.execute(statement, [row])
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                _fail(report, numbers[id(row)], [
+                    {'field': None, 'message': 'Row violates a database constraint'}])
+                continue
+            if rows is updates:
+                report['updated'] += 1
+                updated_ids.append(row['id'])
+            else:
+                report['inserted'] += 1
+    return updated_ids
+
+
+def _fail(report, number, errors):
+    report['failed'] += 1
+    for error in errors:
+        if len(report['errors']) < report['max_errors']:
+            report['errors'].append(dict(error, row=number))
+
+
+def import_products(raw_rows, chunk_size=None, max_errors=None):
+    """ Validates and upserts raw_rows; returns a report dict.
+
+    Rows with an id that exists are updated with the fields they carry;
+    other rows are inserted and need at least a name and a price. Errors
+    are reported per row (1-based) and never stop the import.
+    """
+    chunk_size = chunk_size or current_app.config['IMPORT_CHUNK_SIZE']
+    report = {'rows': 0, 'inserted': 0, 'updated': 0, 'failed': 0, 'errors': [],
+              'max_errors': max_errors or current_app.config['IMPORT_MAX_ERRORS']}
+    updated_ids = []
+    seen_ids = set()
+
+    def valid_rows():
+        for number, raw in enumerate(raw_rows, start=1):
+            report['rows'] += 1
+            row, errors = validate_row(raw)
+            if not errors and row.get('id') in seen_ids:
+                errors = [{'field': 'id', 'message': 'Duplicate id in file'}]
+            if errors:
+                _fail(report, number, errors)
+                continue
+            if 'id' in row:
+                seen_ids.add(row['id'])
+            yield number, row
+
+    rows = valid_rows()
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        updated_ids.extend(_write_chunk(chunk, report))
+
+    if report['inserted'] or updated_ids:
+        get_search_backend().mark_stale()
+        invalidate('products', *(f'product:{product_id}' for product_id in updated_ids))
+    del report['max_errors']
+    return report
+
+
+def init_app(app):
+    """ Registers the 'flask products import' command """
+    @app.cli.group('products')
+    def products_cli():
+        """ Manage the product catalog """
+
+    @products_cli.command('import')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'import_format', type=click.Choice(FORMATS), default=None,
+                  help='Defaults to the file extension')
+    @click.option('--chunk-size', type=int, default=None)
+    def import_command(path, import_format, chunk_size):
+        """ Upsert products from a CSV or NDJSON file """
+        import_format = import_format or ('csv' if path.endswith('.csv') else 'ndjson')
+        with open(path, 'rb') as stream:
+            report = import_products(iter_rows(stream, import_format), chunk_size)
+        click.echo(json.dumps(report, indent=2))
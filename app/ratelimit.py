@@ -0,0 +1,203 @@
+""" This module rate limits the unauthenticated, expensive routes.
+
+Login and registration each spend a bcrypt hash, so a credential-stuffing
+burst against them can starve every other route. RATE_LIMITS maps an
+endpoint to its rules, each written 'scope:algorithm:count/seconds':
+
+    ip:bucket:20/60        token bucket per client address: bursts of up
+                           to 20, refilled at 20 per 60 seconds
+    account:window:5/300   sliding window per account (the email in the
+                           query string or JSON body): 5 per 300 seconds
+
+Rules are checked in a before_request hook, so a rejected request gets a
+429 with Retry-After before the view runs: no database query, no bcrypt.
+A request counts against its rules only if all of them allow it, so
+rejected attempts do not use up the budget of the other rules.
+Counters live in a RateLimitBackend. LocalRateLimitBackend keeps them in
+process; a shared store implements the same interface to enforce limits
+across processes. Client addresses come from request.remote_addr, so
+deployments behind a proxy need ProxyFix.
+"""
+
+import math
+import threading
+import time
+
+from flask import current_app, jsonify, request
+
+SCOPES = ('ip', 'account')
+ALGORITHMS = ('bucket', 'window')
+
+
+class Rule:
+    """ One limit of an endpoint: count requests per period seconds """
+
+    def __init__(self, scope, algorithm, count, period):
+        self.scope = scope
+        self.algorithm = algorithm
+        self.count = count
+        self.period = period
+
+    def __repr__(self):
+        return f'<Rule {self.scope}:{self.algorithm}:{self.count}/{self.period}>'
+
+    @classmethod
+    def parse(cls, spec):
+        """ Builds a Rule from 'scope:algorithm:count/seconds' """
+        try:
+            scope, algorithm, limit = spec.split(':')
+            count, period = limit.split('/')
+            rule = cls(scope, algorithm, int(count), float(period))
+        except ValueError:
+            raise ValueError(f'Invalid rate limit {spec!r}')
+        if scope not in SCOPES or algorithm not in ALGORITHMS \
+                or rule.count <= 0 or rule.period <= 0:
+            raise ValueError(f'Invalid rate limit {spec!r}')
+        return rule
+
+
+class RateLimitBackend:
+    """ Interface for rate limit counters, so a shared store can replace the local one """
+
+    def hit(self, key, rule, now):
+        """ Counts one request for key; returns 0 if allowed, else seconds to wait """
+        return self.hit_all([(key, rule)], now)
+
+    def hit_all(self, hits, now):
+        """ Counts one request against every (key, rule) in hits if all allow it.
+
+        Returns 0 if allowed, else the longest wait in seconds. A rejected
+        request consumes nothing, so it does not extend other rules' limits.
+        """
+        raise NotImplementedError
+
+
+class LocalRateLimitBackend(RateLimitBackend):
+    """ In-process, thread-safe token buckets and sliding-window counters """
+
+    SWEEP_EVERY = 1024
+
+    def __init__(self):
+        # key -> [two algorithm-specific numbers, last update, rule period]
+        self._state = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+
+    def hit_all(self, hits, now):
+        with self._lock:
+            self._hits += 1
+            if self._hits % self.SWEEP_EVERY == 0:
+                self._sweep(now)
+            wait = max((self._apply(key, rule, now, False) for key, rule in hits), default=0)
+            if not wait:
+                for key, rule in hits:
+                    self._apply(key, rule, now, True)
+            return wait
+
+    def _apply(self, key, rule, now, consume):
+        if rule.algorithm == 'bucket':
+            return self._take_token(key, rule, now, consume)
+        return self._count_in_window(key, rule, now, consume)
+
+    def _take_token(self, key, rule, now, consume):
+        # state: tokens left, unused, last refill
+        rate = rule.count / rule.period
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = [float(rule.count), 0, now, rule.period]
+        else:
+            state[0] = min(rule.count, state[0] + (now - state[2]) * rate)
+            state[2] = now
+        if state[0] >= 1:
+            if consume:
+                state[0] -= 1
+            return 0
+        return (1 - state[0]) / rate
+
+    def _count_in_window(self, key, rule, now, consume):
+        # state: requests in the current fixed window, in the previous one,
+        # start of the current one. The sliding count weights the previous
+        # window by how much of it still overlaps the last period seconds.
+        start = now - now % rule.period
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = [0, 0, start, rule.period]
+        elif state[2] != start:
+            state[1] = state[0] if start - state[2] == rule.period else 0
+            state[0], state[2] = 0, start
+        overlap = 1 - (now - start) / rule.period
+        if state[0] + state[1] * overlap + 1 <= rule.count:
+            if consume:
+                state[0] += 1
+            return 0
+        until_next = start + rule.period - now
+        if state[1] and state[0] < rule.count:
+            # Wait until enough of the previous window has slid out.
+            return min(until_next, (state[0] + state[1] * overlap + 1 - rule.count)
+                       / state[1] * rule.period)
+        return until_next
+
+    def _sweep(self, now):
+        """ Drops state that is idle long enough to be back at its defaults """
+        for key in [key for key, state in self._state.items()
+                    if now - state[2] > 2 * state[3]]:
+            del self._state[key]
+
+    def __len__(self):
+        return len(self._state)
+
+
+class RateLimiter:
+    """ Applies the configured rules of each endpoint """
+
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.rules = {endpoint: [Rule.parse(spec) for spec in specs]
+                      for endpoint, specs in limits.items()}
+
+    def check(self, endpoint, ip, account, now=None):
+        """ Returns 0 if the request may proceed, else seconds to wait """
+        now = time.time() if now is None else now
+        hits = []
+        for rule in self.rules.get(endpoint, ()):
+            subject = ip if rule.scope == 'ip' else account
+            if subject is not None:
+                hits.append((f'{endpoint}:{rule.scope}:{rule.algorithm}:{subject}', rule))
+        return self.backend.hit_all(hits, now) if hits else 0
+
+
+def _account():
+    """ Returns the account a request targets: its email, lowercased """
+    email = request.args.get('email')
+    if email is None and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            email = data.get('email')
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+
+def init_app(app):
+    """ Installs the rate limiting hook for the endpoints in RATE_LIMITS """
+    if not app.config.get('RATE_LIMIT_ENABLED', True):
+        return
+    name = app.config.get('RATE_LIMIT_BACKEND', 'local')
+    if name != 'local':
+        raise ValueError(f'Unknown RATE_LIMIT_BACKEND {name!r}')
+    limiter = app.extensions['rate_limiter'] = RateLimiter(
+        LocalRateLimitBackend(), app.config.get('RATE_LIMITS', {}))
+
+    @app.before_request
+    def enforce_rate_limits():
+        if request.endpoint not in limiter.rules:
+            return None
+        wait = limiter.check(request.endpoint, request.remote_addr, _account())
+        if not wait:
+            return None
+        response = jsonify({'error': 'Too many requests, please retry later'})
+        response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+        return response, 429
+
+
+def get_rate_limiter():
+    """ Returns the rate limiter of the current app, or None if disabled """
+    return current_app.extensions.get('rate_limiter')
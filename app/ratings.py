@@ -0,0 +1,57 @@
+""" This module keeps the review aggregates stored on products current.
+
+Every product tile shows an average rating and a review count, and GET
+/products can sort by rating, so aggregating reviews per listing row is
+out of the question. Instead products carry rating_count, rating_sum, one
+counter per star value, and rating_avg for the (rating_avg, id) index.
+Each review change applies its delta to them in the same transaction with
+one UPDATE, computed by the database from the current row values, so
+concurrent reviews of a product never lose updates:
+
+    UPDATE products SET rating_avg = (rating_sum + :ds) / (rating_count + :dc),
+                        rating_count = rating_count + :dc, ...
+     WHERE id = :product_id
+
+rating_avg is assigned first because MySQL evaluates later assignments
+against the values already updated in the same statement.
+"""
+
+from sqlalchemy import case, update
+
+from app import db
+from app.models.product import Product
+
+RATINGS = range(1, 6)
+
+
+def valid_rating(value):
+    """ True if value is a star rating from 1 to 5 """
+    return isinstance(value, int) and not isinstance(value, bool) and value in RATINGS
+
+
+def apply_rating(product_id, old=None, new=None):
+    """ Moves a product's aggregates from a review rated old to one rated new.
+
+    old is None for a new review and new is None for a deleted one.
+    """
+    if old == new:
+        return
+    count_delta = (new is not None) - (old is not None)
+    sum_delta = (new or 0) - (old or 0)
+    count = Product.rating_count + count_delta
+    values = [
+        (Product.rating_avg,
+         case((count > 0, (Product.rating_sum + sum_delta) * 1.0 / count), else_=0.0)),
+        (Product.rating_count, count),
+        (Product.rating_sum, Product.rating_sum + sum_delta),
+    ]
+    if old is not None:
+        column = getattr(Product, f'rating_{old}')
+        values.append((column, column - 1))
+    if new is not None:
+        column = getattr(Product, f'rating_{new}')
+        values.append((column, column + 1))
+    db.session.execute(
+        update(Product).where(Product.id == product_id)
+        .ordered_values(*values)
+        .execution_options(synchronize_session=False))
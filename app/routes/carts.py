@@ -0,0 +1,147 @@
+import time
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import jwt_required
+
+from app.auth import current_auth
+from app.carts import cart_changed, get_cart_store, load_cart, product_prices, refresh_prices
+from app.db_routing import read_replica
+from app.idempotency import idempotent
+
+bp = Blueprint('carts', __name__, url_prefix='/carts')
+
+
+def _quantity(data, default=None):
+    """ Returns (quantity, error) for a cart payload """
+    quantity = data.get('quantity', default)
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+        return None, 'Quantity must be a positive integer'
+    return quantity, None
+
+
+def _cart_response(user_id):
+    """ Returns the user's cart, refreshing its prices if they are stale """
+    store = get_cart_store()
+    max_age = current_app.config['CART_PRICE_TTL']
+
+    def snapshot(cart):
+        return cart.to_dict(), time.time() - cart.priced_at > max_age, list(cart.lines)
+
+    payload, stale, product_ids = store.mutate(user_id, snapshot, load_cart, dirty=False)
+    if stale:
+        prices = product_prices(product_ids)
+
+        def reprice(cart):
+            refresh_prices(cart, prices)
+            return cart.to_dict()
+        payload = store.mutate(user_id, reprice, load_cart, dirty=False)
+    return jsonify(payload), 200
+
+
+@bp.route('/<int:user_id>', methods=['GET'])
+@jwt_required()
+@read_replica
+def get_cart(user_id):
+    """ Retrieve the contents of a user's cart """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+    return _cart_response(user_id)
+
+
+@bp.route('/<int:user_id>/<int:product_id>', methods=['GET'])
+@jwt_required()
+@read_replica
+def get_cart_item(user_id, product_id):
+    """ Retrieve one line of a user's cart """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    def line(cart):
+        return cart.line_dict(product_id) if product_id in cart.lines else None
+
+    item = get_cart_store().mutate(user_id, line, load_cart, dirty=False)
+    if item is None:
+        return jsonify({'message': 'Item not in cart'}), 404
+    return jsonify(item), 200
+
+
+@bp.route('/<int:user_id>/items', methods=['POST'])
+@jwt_required()
+@idempotent
+@read_replica
+def add_cart_item(user_id):
+    """ Add a product to the cart, or raise its quantity if already there """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+    data = request.get_json(silent=True) or {}
+    product_id = data.get('product_id')
+    if not isinstance(product_id, int) or isinstance(product_id, bool):
+        return jsonify({'message': 'Invalid product ID'}), 400
+    quantity, error = _quantity(data, default=1)
+    if error:
+        return jsonify({'message': error}), 400
+
+    price = product_prices([product_id]).get(product_id)
+    if price is None:
+        return jsonify({'message': 'Product not found'}), 404
+    max_items = current_app.config['ORDER_MAX_ITEMS']
+
+    def add(cart):
+        if product_id not in cart.lines and len(cart.lines) >= max_items:
+            return None
+        current = cart.lines.get(product_id, {}).get('quantity', 0)
+        cart.set_line(product_id, current + quantity, *price)
+        return cart.to_dict()
+
+    payload = get_cart_store().mutate(user_id, add, load_cart)
+    if payload is None:
+        return jsonify({'message': f'A cart can have at most {max_items} items'}), 400
+    cart_changed()
+    return jsonify(payload), 200
+
+
+@bp.route('/<int:user_id>/items/<int:product_id>', methods=['PUT'])
+@bp.route('/<int:user_id>/<int:product_id>', methods=['PATCH'])
+@jwt_required()
+@read_replica
+def update_cart_item(user_id, product_id):
+    """ Update the quantity of an item in the cart """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+    quantity, error = _quantity(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({'message': error}), 400
+
+    def update(cart):
+        line = cart.lines.get(product_id)
+        if line is None:
+            return None
+        cart.set_line(product_id, quantity, line['unit_price'], line['name'])
+        return cart.to_dict()
+
+    payload = get_cart_store().mutate(user_id, update, load_cart)
+    if payload is None:
+        return jsonify({'message': 'Item not in cart'}), 404
+    cart_changed()
+    return jsonify(payload), 200
+
+
+@bp.route('/<int:user_id>/items/<int:product_id>', methods=['DELETE'])
+@jwt_required()
+@read_replica
+def remove_cart_item(user_id, product_id):
+    """ Remove an item from the cart """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    def remove(cart):
+        if product_id not in cart.lines:
+            return None
+        cart.set_line(product_id, 0, 0, None)
+        return cart.to_dict()
+
+    payload = get_cart_store().mutate(user_id, remove, load_cart)
+    if payload is None:
+        return jsonify({'message': 'Item not in cart'}), 404
+    cart_changed()
+    return jsonify(payload), 200
@@ -0,0 +1,156 @@
+import csv
+import io
+import json
+from datetime import datetime
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from sqlalchemy import func, select
+from app import db
+from app.auth import current_auth
+from app.models.order import Order
+from app.models.order_item import OrderItem
+from app.models.product import Product
+from flask_jwt_extended import jwt_required
+
+bp = Blueprint('exports', __name__, url_prefix='/exports')
+
+ORDER_COLUMNS = [Order.id, Order.user_id, Order.product_id, Order.quantity,
+                 Order.total_price, Order.status, Order.date_ordered]
+# One row per order line. Orders placed before order items existed have no
+# item rows; their single line comes from the order itself.
+ORDER_ITEM_COLUMNS = [
+    Order.id.label('order_id'), Order.user_id, Order.status, Order.date_ordered,
+    func.coalesce(OrderItem.product_id, Order.product_id).label('product_id'),
+    func.coalesce(OrderItem.quantity, Order.quantity).label('quantity'),
+    func.coalesce(OrderItem.unit_price, Order.total_price / Order.quantity).label('unit_price'),
+]
+# stock is the total the API reports, shard rows included (see app/inventory.py).
+PRODUCT_COLUMNS = [Product.id, Product.name, Product.description, Product.price,
+                   Product.image_path, Product.category_id,
+                   Product.total_stock.label('stock'), Product.status]
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def _value(value):
+    """ Makes a column value JSON/CSV friendly """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _stream(statement, columns, export_format, filename):
+    """ Streams the rows of statement without materializing them.
+
+    The rows come through a server-side cursor on a dedicated connection,
+    batch_size at a time, and each batch is written out before the next is
+    fetched. If the client goes away the generator is closed, which closes
+    the cursor and returns the connection to the pool.
+    """
+    names = [column.key for column in columns]
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+
+    def generate():
+        with db.engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True, yield_per=batch_size).execute(statement)
+            try:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                if export_format == 'csv':
+                    writer.writerow(names)
+                for rows in result.partitions():
+                    for row in rows:
+                        values = [_value(value) for value in row]
+                        if export_format == 'csv':
+                            writer.writerow(values)
+                        else:
+                            buffer.write(json.dumps(dict(zip(names, values))))
+                            buffer.write('\n')
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                if buffer.tell():
+                    yield buffer.getvalue()
+            finally:
+                result.close()
+
+    response = Response(stream_with_context(generate()), mimetype=FORMATS[export_format])
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename={filename}.{export_format}'
+    return response
+
+
+def _export_request():
+    """ Returns (format, error response) after checking access and ?format= """
+    if not current_auth().is_admin:
+        return None, (jsonify({'error': 'Only admins can export data'}), 403)
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in FORMATS:
+        return None, (jsonify({'error': 'format must be ndjson or csv'}), 400)
+    return export_format, None
+
+
+def _parse_date(name):
+    value = request.args.get(name)
+    return datetime.fromisoformat(value) if value else None
+
+
+def _filter_orders(statement):
+    """ Applies ?status=, ?from= and ?to= to an orders statement.
+
+    Raises ValueError for dates that are not ISO 8601.
+    """
+    date_from, date_to = _parse_date('from'), _parse_date('to')
+    if request.args.get('status'):
+        statement = statement.where(Order.status == request.args['status'])
+    if date_from:
+        statement = statement.where(Order.date_ordered >= date_from)
+    if date_to:
+        statement = statement.where(Order.date_ordered < date_to)
+    return statement
+
+
+@bp.route('/orders', methods=['GET'])
+@jwt_required()
+def export_orders():
+    """ Stream every order as NDJSON or CSV (admin only) """
+    export_format, error = _export_request()
+    if error:
+        return error
+    try:
+        statement = _filter_orders(select(*ORDER_COLUMNS).order_by(Order.id))
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO 8601 dates'}), 400
+    return _stream(statement, ORDER_COLUMNS, export_format, 'orders')
+
+
+@bp.route('/order-items', methods=['GET'])
+@jwt_required()
+def export_order_items():
+    """ Stream every order line, with its order's columns, as NDJSON or CSV (admin only) """
+    export_format, error = _export_request()
+    if error:
+        return error
+    try:
+        statement = _filter_orders(
+            select(*ORDER_ITEM_COLUMNS)
+            .select_from(Order)
+            .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+            .order_by(Order.id, OrderItem.id))
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO 8601 dates'}), 400
+    return _stream(statement, ORDER_ITEM_COLUMNS, export_format, 'order-items')
+
+
+@bp.route('/products', methods=['GET'])
+@jwt_required()
+def export_products():
+    """ Stream every product as NDJSON or CSV (admin only) """
+    export_format, error = _export_request()
+    if error:
+        return error
+
+    statement = select(*PRODUCT_COLUMNS).order_by(Product.id)
+    if request.args.get('status'):
+        statement = statement.where(Product.status == request.args['status'])
+    return _stream(statement, PRODUCT_COLUMNS, export_format, 'products')
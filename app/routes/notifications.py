@@ -0,0 +1,139 @@
+import math
+import time
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import jwt_required
+
+from app import db
+from app.auth import current_auth
+from app.models.notification import Notification
+from app.notifications import get_notification_hub, mark_read, unread_count
+from app.pagination import InvalidCursor, get_limit, keyset_page
+
+bp = Blueprint('notifications', __name__)
+
+
+def _ids_argument(data, name):
+    """ Returns data[name] as a list of ints, None if absent """
+    values = data.get(name)
+    if values is None:
+        return None
+    if not isinstance(values, list) or not all(
+            isinstance(value, int) and not isinstance(value, bool) for value in values):
+        raise ValueError(f'{name} must be a list of integers')
+    return values
+
+
+@bp.route('/users/<int:user_id>/notifications', methods=['GET'])
+@jwt_required()
+def get_notifications(user_id):
+    """ Returns a newest-first page of the user's notifications """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    query = db.session.query(Notification).filter_by(user_id=user_id)
+    if request.args.get('unread') in ('1', 'true'):
+        query = query.filter(Notification.is_read.is_(False))
+    try:
+        limit = get_limit(request.args)
+        notifications, next_cursor = keyset_page(
+            query, Notification.id, Notification.id,
+            cursor=request.args.get('cursor'), limit=limit,
+            descending=True, sort_name='-id')
+    except InvalidCursor as e:
+        return jsonify({'message': str(e)}), 400
+
+    return jsonify({
+        'items': [notification.to_dict() for notification in notifications],
+        'limit': limit,
+        'next_cursor': next_cursor,
+        'unread': unread_count(user_id)
+    }), 200
+
+
+@bp.route('/users/<int:user_id>/notifications/unread-count', methods=['GET'])
+@jwt_required()
+def get_unread_count(user_id):
+    """ Returns the user's unread notification count """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+    return jsonify({'unread': unread_count(user_id)}), 200
+
+
+@bp.route('/notifications/<int:notification_id>/read', methods=['POST'])
+@jwt_required()
+def read_notification(notification_id):
+    """ Marks one notification as read """
+    notification = db.session.get(Notification, notification_id)
+    if notification is None:
+        return jsonify({'message': 'Notification not found'}), 404
+    if not current_auth().can_access(notification.user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    user_id = notification.user_id
+    mark_read(user_id, ids=[notification_id])
+    db.session.commit()
+    return jsonify({'message': 'Notification marked as read',
+                    'unread': unread_count(user_id)}), 200
+
+
+@bp.route('/users/<int:user_id>/notifications/read', methods=['POST'])
+@jwt_required()
+def read_notifications(user_id):
+    """ Marks the given ids, everything up to an id, or all notifications read """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        ids = _ids_argument(data, 'ids')
+        up_to = data.get('up_to')
+        if up_to is not None and (not isinstance(up_to, int) or isinstance(up_to, bool)):
+            raise ValueError('up_to must be an integer')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    marked = mark_read(user_id, ids=ids, up_to=up_to)
+    db.session.commit()
+    return jsonify({'marked': marked, 'unread': unread_count(user_id)}), 200
+
+
+@bp.route('/users/<int:user_id>/notifications/poll', methods=['GET'])
+@jwt_required()
+def poll_notifications(user_id):
+    """ Waits up to ?timeout= seconds for notifications newer than ?after= """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    max_timeout = current_app.config['NOTIFICATIONS_POLL_TIMEOUT']
+    try:
+        after = int(request.args.get('after', 0))
+        timeout = float(request.args.get('timeout', max_timeout))
+    except ValueError:
+        return jsonify({'message': 'after and timeout must be numbers'}), 400
+    if not math.isfinite(timeout):
+        # nan would pass through min()/max() and make the wait unbounded.
+        return jsonify({'message': 'timeout must be a finite number'}), 400
+    timeout = min(max(timeout, 0), max_timeout)
+
+    hub = get_notification_hub()
+    recheck = current_app.config['NOTIFICATIONS_POLL_RECHECK']
+    deadline = time.monotonic() + timeout
+    while True:
+        # Read the version before querying so a commit in between is not missed.
+        version = hub.version(user_id)
+        notifications = db.session.query(Notification) \
+            .filter(Notification.user_id == user_id, Notification.id > after) \
+            .order_by(Notification.id).limit(current_app.config['PAGE_SIZE_MAX']).all()
+        remaining = deadline - time.monotonic()
+        if notifications or remaining <= 0:
+            break
+        # Hand the connection back while waiting; this may take a while.
+        db.session.rollback()
+        hub.wait(user_id, version, min(remaining, recheck))
+
+    return jsonify({
+        'items': [notification.to_dict() for notification in notifications],
+        'last_id': notifications[-1].id if notifications else after,
+        'unread': unread_count(user_id)
+    }), 200
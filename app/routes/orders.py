@@ -1,62 +1,199 @@
-from flask import Blueprint, request, jsonify
+from datetime import datetime
+from flask import Blueprint, current_app, request, jsonify
 from app.models.order import Order
+from app.models.order_item import OrderItem
 from app.models.product import Product
-from app.models.user import User
 from app import db
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.auth import current_auth
+from app.idempotency import hold, idempotent
+from app.inventory import InsufficientStock, release_stock, reserve_stock
+from app.notifications import notify
+from app.order_writer import OrderWriterBusy, get_order_writer, write_order
+from app.fields import ORDER_FIELDS, InvalidFields, serialize_orders
+from app.pagination import InvalidCursor, get_limit, keyset_page
+from flask_jwt_extended import jwt_required
+from sqlalchemy import func, update
 
 bp = Blueprint('orders', __name__)
 
+# Orders still holding their stock: only these can be edited or canceled.
+OPEN_STATUSES = ('pending', 'processing')
+CANCELED = 'Order Canceled'
+
+
+def _settle_when_committed(future):
+    """ Settles the request's Idempotency-Key once a queued order finishes """
+    settle = hold()
+    if settle is None:
+        return
+
+    def done(future):
+        error = future.exception()
+        if error is None:
+            settle(future.result(), 201)
+        elif isinstance(error, InsufficientStock):
+            settle({'message': 'Insufficient stock', 'errors': [
+                {'field': 'product_id', 'message': str(error)}]}, 409)
+        else:
+            settle(None)
+    future.add_done_callback(done)
+
+
+def _parse_lines(data):
+    """ Returns ({product_id: quantity}, errors) for an order payload.
+
+    Accepts either {"items": [{"product_id", "quantity"}, ...]} or the
+    single-product form {"product_id", "quantity"}.
+    """
+    if 'items' in data:
+        lines, prefix = data['items'], 'items[{}].'
+        if not isinstance(lines, list) or not lines:
+            return {}, [{'field': 'items', 'message': 'Items must be a non-empty list'}]
+    else:
+        lines, prefix = [data], ''
+
+    errors = []
+    if len(lines) > current_app.config['ORDER_MAX_ITEMS']:
+        errors.append({'field': 'items', 'message':
+                       f"An order can have at most {current_app.config['ORDER_MAX_ITEMS']} items"})
+        return {}, errors
+
+    quantities = {}
+    for index, line in enumerate(lines):
+        field = prefix.format(index)
+        if not isinstance(line, dict):
+            errors.append({'field': field.rstrip('.'), 'message': 'Invalid item'})
+            continue
+        product_id = line.get('product_id')
+        quantity = line.get('quantity', 1)
+        if not product_id:
+            errors.append({'field': field + 'product_id', 'message': 'Missing product ID'})
+        elif not isinstance(product_id, int) or isinstance(product_id, bool):
+            errors.append({'field': field + 'product_id', 'message': 'Invalid product ID'})
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            errors.append({'field': field + 'quantity',
+                           'message': 'Quantity must be a positive integer'})
+        elif isinstance(product_id, int) and product_id:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities, errors
+
+
 @bp.route('/orders', methods=['POST'])
 @jwt_required()
+@idempotent
 def create_order():
     """
-      Create a new order.
+      Create a new order with one or more items.
     """
     data = request.get_json()
     if not data:
         return jsonify({'message': 'Missing order data'}), 400
-    user_id = get_jwt_identity()
+    user_id = current_auth().user_id
 
-    errors = []
-    if not data.get('product_id'):
-        errors.append({'field': 'product_id', 'message': 'Missing product ID'})
-    if data.get('quantity', 1) <= 0:
-        errors.append({'field': 'quantity', 'message': 'Quantity must be a positive integer'})
-    product = db.session.get(Product, data.get('product_id'))
-    if not product:
-        errors.append({'field': 'product_id', 'message': 'Product not found'})
+    quantities, errors = _parse_lines(data)
+    # One IN (...) query for every product in the order.
+    products = {}
+    if quantities:
+        products = {product.id: product for product in
+                    db.session.query(Product).filter(Product.id.in_(quantities))}
+    for product_id in quantities:
+        if product_id not in products:
+            errors.append({'field': 'product_id', 'message': f'Product not found: {product_id}'})
 
     if errors:
         return jsonify({'message': 'Validation errors', 'errors': errors}), 400
-    
-    order = Order(
-        user_id=user_id,
-        product_id=product.id,
-        quantity=data['quantity'],
-        total_price=product.price * data['quantity']
-    )
-
-    db.session.add(order)
-    db.session.commit()
 
-    return jsonify(order.to_dict()), 201
+    items = [{'product_id': product_id, 'quantity': quantity,
+              'unit_price': products[product_id].price}
+             for product_id, quantity in quantities.items()]
+
+    try:
+        writer = get_order_writer()
+        if writer is not None:
+            # Give the connection back while the writer commits the batch.
+            db.session.rollback()
+            payload = writer.submit(user_id, items)
+        else:
+            payload = write_order(user_id, items)
+            db.session.commit()
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({'message': 'Insufficient stock', 'errors': [
+            {'field': 'product_id', 'message': str(e)}]}), 409
+    except OrderWriterBusy as e:
+        # The order may still be committed: a retry with the same key must
+        # wait for it rather than place it again.
+        if e.future is not None:
+            _settle_when_committed(e.future)
+        response = jsonify({'message': 'Order service is busy, try again'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    return jsonify(payload), 201
+
+
+def _parse_date(name):
+    """ Reads an ISO 8601 date or datetime query parameter """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidCursor(f'{name} must be an ISO 8601 date')
+
+
+def _order_page(*criteria):
+    """ Returns one newest-first keyset page of the orders matching criteria.
+
+    Supports ?status=, ?from= and ?to= (date_ordered in [from, to)), and
+    ?fields= to select only the columns of those fields.
+    """
+    try:
+        fields = ORDER_FIELDS.parse(request.args)
+        if fields is None:
+            query = db.session.query(Order)
+        else:
+            query = db.session.query(*ORDER_FIELDS.columns(fields, Order.date_ordered, Order.id))
+        query = query.filter(*criteria)
+        if request.args.get('status'):
+            query = query.filter(Order.status == request.args['status'])
+        date_from, date_to = _parse_date('from'), _parse_date('to')
+        if date_from:
+            query = query.filter(Order.date_ordered >= date_from)
+        if date_to:
+            query = query.filter(Order.date_ordered < date_to)
+        limit = get_limit(request.args)
+        orders, next_cursor = keyset_page(
+            query, Order.date_ordered, Order.id,
+            cursor=request.args.get('cursor'), limit=limit,
+            descending=True, sort_name='-date_ordered')
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({'message': str(e)}), 400
+
+    return jsonify({
+        'items': ([order.to_dict() for order in orders] if fields is None
+                  else serialize_orders(orders, fields)),
+        'limit': limit,
+        'next_cursor': next_cursor
+    }), 200
 
 
 @bp.route('/orders', methods=['GET'])
 @jwt_required()
 def get_orders():
     """
-       Retrieve a list of all orders (admin only or filter by user).
+       Retrieve a page of orders, newest first (admins see every order,
+       or one user's with ?user_id=; other users only their own).
     """
-    user_id = get_jwt_identity()
-    user = db.session.get(User, user_id)
+    auth = current_auth()
 
-    if user.is_admin:
-        orders = db.session.query(Order).all()
-    else:
-        orders = db.session.query(Order).filter_by(user_id=user.id)
-    return jsonify([order.to_dict() for order in orders]), 200
+    criteria = []
+    if not auth.is_admin:
+        criteria.append(Order.user_id == auth.user_id)
+    elif request.args.get('user_id', type=int):
+        criteria.append(Order.user_id == request.args.get('user_id', type=int))
+    return _order_page(*criteria)
 
 
 @bp.route('/orders/<int:order_id>', methods=['GET'])
@@ -65,13 +202,11 @@ def get_order_by_id(order_id):
     """
       Retrieve a specific order by ID.
     """
-    user_id = get_jwt_identity()
-    user = db.session.get(User, user_id)
     order = db.session.get(Order, order_id)
     if not order:
         return jsonify({'message': 'Oder not found'}), 404
 
-    if not user.is_admin and order.user_id != user.id:
+    if not current_auth().can_access(order.user_id):
         return jsonify({'message': 'Unauthorized access'}), 403
 
     return jsonify(order.to_dict()), 200
@@ -91,11 +226,35 @@ def update_order(order_id):
     if not order:
         return jsonify({'message': 'Order not found'}), 404
 
-    if not current_user.is_admin and order.user_id != current_user.id:
+    if not current_auth().can_access(order.user_id):
         return jsonify({'message': 'Unauthorized access'}), 403
 
-    order.quantity = data.get('quantity', order.quantity)
-    order.total_price = order.product.price * order.quantity
+    if 'quantity' in data:
+        quantity = data['quantity']
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            return jsonify({'message': 'Quantity must be a positive integer'}), 400
+        # Lock the order so a concurrent cancel releases the edited quantity.
+        order = db.session.get(Order, order_id, with_for_update=True, populate_existing=True)
+        if order.status.lower() not in OPEN_STATUSES:
+            return jsonify({'message': 'Quantity can only be changed on open orders'}), 400
+        if len(order.items) > 1:
+            return jsonify({'message': 'Quantity can only be changed on single-item orders'}), 400
+        line = order.to_dict()['items'][0]
+        if order.items:
+            # Only itemized orders reserved stock when they were placed.
+            delta = quantity - order.quantity
+            try:
+                if delta > 0:
+                    reserve_stock({line['product_id']: delta})
+                elif delta < 0:
+                    release_stock({line['product_id']: -delta})
+            except InsufficientStock as e:
+                db.session.rollback()
+                return jsonify({'message': str(e)}), 409
+            order.items[0].quantity = quantity
+        unit_price = line['unit_price']
+        order.quantity = quantity
+        order.total_price = round(unit_price * quantity, 2)
 
     db.session.commit()
     return jsonify(order.to_dict()), 200
@@ -115,10 +274,23 @@ def update_order_status(order_id):
     if not data or 'status' not in data:
         return jsonify({'message': 'Missing status information'}), 400
 
-    if not current_user.is_admin and order.user_id != current_user.id:
-        return jsonify({'message': 'Unauthorized access'}), 403
+    if not current_auth().is_admin:
+        return jsonify({'message': 'Only admins can update order status'}), 403
 
-    order.status = data.get('status', order.status)
+    status = data.get('status', order.status)
+    if status == CANCELED:
+        return jsonify({'message': f'Use POST /orders/{order.id}/cancel to cancel orders'}), 400
+    if status != order.status:
+        # Canceled orders gave their stock back and cannot be reopened.
+        result = db.session.execute(
+            update(Order)
+            .where(Order.id == order.id, Order.status != CANCELED)
+            .values(status=status)
+            .execution_options(synchronize_session=False))
+        if result.rowcount != 1:
+            db.session.rollback()
+            return jsonify({'message': 'Canceled orders cannot be updated'}), 400
+        notify(order.user_id, f'Order {order.id} is now {status}', kind='order_status')
     db.session.commit()
     return jsonify({'message': 'Order updated successfully', 'order': order.to_dict()}), 200
 
@@ -127,10 +299,11 @@ def update_order_status(order_id):
 @jwt_required()
 def order_history(user_id):
     """
-       Retrieve a list of the user's past orders.
+       Retrieve a page of the user's past orders, newest first.
     """
-    orders = db.session.query(Order).filter_by(user_id=current_user_id).all()
-    return jsonify([order.to_dict() for order in orders]), 200
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+    return _order_page(Order.user_id == user_id)
 
 
 @bp.route('/orders/<int:order_id>/cancel', methods=['POST'])
@@ -143,13 +316,23 @@ def cancel_order(order_id):
     if not order:
         return jsonify({'message': 'Order not found'}), 404
 
-    if not current_user.is_admin and order.user_id != current_user.id:
+    if not current_auth().can_access(order.user_id):
         return jsonify({'message': 'Unauthorized access'}), 403
 
-    if order.status not in ['pending', 'processing']:
+    # The conditional UPDATE makes the transition happen once, so the stock
+    # is released once even for concurrent or repeated cancels.
+    result = db.session.execute(
+        update(Order)
+        .where(Order.id == order.id, func.lower(Order.status).in_(OPEN_STATUSES))
+        .values(status=CANCELED)
+        .execution_options(synchronize_session=False))
+    if result.rowcount != 1:
+        db.session.rollback()
         return jsonify({'message': 'Order cannot be canceled'}), 400
 
-
-    order.status = 'Order Canceled'
+    items = db.session.query(OrderItem).filter_by(order_id=order.id) \
+        .with_for_update().populate_existing()
+    release_stock({item.product_id: item.quantity for item in items})
+    notify(order.user_id, f'Order {order.id} was canceled', kind='order_status')
     db.session.commit()
     return jsonify(order.to_dict()), 200
@@ -1,22 +1,105 @@
 
 from flask import Blueprint, request, jsonify, abort
 from app.models.product import Product
-from app.models.user import User
 from app.models.order import Order
 from app.models.category import Category
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from app import db
+from app.auth import current_auth
+from app.cache import cached_response, get_cache, invalidate
+from app.changes import SyncTokenExpired, changes_page
+from app.db_routing import read_replica
+from app.fields import PRODUCT_FIELDS, InvalidFields
+from app.inventory import clear_shards
+from app.pagination import (
+        InvalidCursor, decode_cursor, encode_cursor, get_limit, keyset_page
+)
+from app.product_import import FORMATS as IMPORT_FORMATS, import_products as run_import, iter_rows
+from app.search import get_search_backend
+from app.singleflight import coalesced, get_single_flight
+from app.wishlist import WISHLIST_ARG, with_wishlist
 
 bp = Blueprint('products', __name__)
 
+SORT_COLUMNS = {
+    'id': Product.id,
+    'name': Product.name,
+    'price': Product.price,
+    'rating': Product.rating_avg,
+}
+
+
+def _product_page(*criteria):
+    """ Returns one keyset page of the products matching criteria as a JSON response.
+
+    With ?fields= only the columns of those fields are selected.
+    """
+    sort = request.args.get('sort', 'id')
+    descending = sort.startswith('-')
+    sort_name = sort.lstrip('-')
+    if sort_name not in SORT_COLUMNS:
+        return jsonify({'error': f'Cannot sort by {sort_name}'}), 400
+
+    try:
+        fields = PRODUCT_FIELDS.parse(request.args)
+        if fields is None:
+            query, serialize = db.session.query(Product), Product.to_dict
+        else:
+            query = db.session.query(
+                *PRODUCT_FIELDS.columns(fields, SORT_COLUMNS[sort_name], Product.id))
+
+            def serialize(row):
+                return PRODUCT_FIELDS.serialize(row, fields)
+
+        limit = get_limit(request.args)
+        products, next_cursor = keyset_page(
+            query.filter(*criteria), SORT_COLUMNS[sort_name], Product.id,
+            cursor=request.args.get('cursor'), limit=limit,
+            descending=descending, sort_name=sort)
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'items': [serialize(product) for product in products],
+        'limit': limit,
+        'next_cursor': next_cursor
+    }), 200
+
+
 @bp.route('/products', methods=['GET'])
+@with_wishlist
+@cached_response('products', ignore_args=(WISHLIST_ARG,))
+@read_replica
 def get_all_products():
-    """ Returns list of all products """
-    products = db.session.query(Product).all()
-    return jsonify([product.to_dict() for product in products]), 200
+    """ Returns a page of products """
+    return _product_page()
+
+
+@bp.route('/products/changes', methods=['GET'])
+@read_replica
+def get_product_changes():
+    """ Returns a page of catalog changes after ?since=, oldest first """
+    try:
+        limit = get_limit(request.args)
+        items, next_cursor, sync_token = changes_page(
+            since=request.args.get('since'), cursor=request.args.get('cursor'), limit=limit)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except SyncTokenExpired as e:
+        return jsonify({'error': str(e)}), 410
+
+    return jsonify({
+        'items': items,
+        'limit': limit,
+        'next_cursor': next_cursor,
+        'sync_token': sync_token
+    }), 200
 
 
 @bp.route('/products/<int:product_id>', methods=['GET'])
+@cached_response(lambda product_id: f'product:{product_id}')
+@coalesced()
+@read_replica
 def get_product(product_id):
     """ Retrieve a specific product by ID. """
     product = db.session.get(Product, product_id)
@@ -26,15 +109,50 @@ def get_product(product_id):
 
 
 @bp.route('/products/search', methods=['GET'])
+@with_wishlist
+@coalesced(ignore_args=(WISHLIST_ARG,))
+@read_replica
 def search_products():
-    """ Search products by keyword."""
+    """ Search products by keyword in their name and description """
     query = request.args.get('query', '')
-    products = db.session.query(Product).filter(Product.name.like(f'%{query}%')).all()
-    return jsonify([product.to_dict() for product in products]), 200
+    try:
+        fields = PRODUCT_FIELDS.parse(request.args)
+        limit = get_limit(request.args)
+        offset = 0
+        if request.args.get('cursor'):
+            position = decode_cursor(request.args['cursor'])
+            if position.get('s') != 'relevance' or not isinstance(position.get('o'), int):
+                raise InvalidCursor('Cursor does not match the requested sort')
+            offset = position['o']
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
+
+    ids = get_search_backend().search(query, limit + 1, offset)
+    next_cursor = None
+    if len(ids) > limit:
+        ids = ids[:limit]
+        next_cursor = encode_cursor({'s': 'relevance', 'o': offset + limit})
+
+    products = {}
+    if ids:
+        if fields is None:
+            products = {product.id: product.to_dict() for product in
+                        db.session.query(Product).filter(Product.id.in_(ids))}
+        else:
+            products = {row.id: PRODUCT_FIELDS.serialize(row, fields) for row in
+                        db.session.query(*PRODUCT_FIELDS.columns(fields))
+                        .filter(Product.id.in_(ids))}
+    return jsonify({
+        'items': [products[i] for i in ids if i in products],
+        'limit': limit,
+        'next_cursor': next_cursor
+    }), 200
 
 
 
 @bp.route('/products/categories', methods=['GET'])
+@cached_response('categories')
+@read_replica
 def get_categories():
     """ Retrieve product by category"""
     categories = db.session.query(Category).all()
@@ -42,18 +160,19 @@ def get_categories():
 
 
 @bp.route('/products/category/<int:category_id>', methods=['GET'])
+@with_wishlist
+@cached_response('products', ignore_args=(WISHLIST_ARG,))
+@read_replica
 def get_products_by_category(category_id):
-    products = db.session.query(Product).filter_by(category_id=category_id).all()
-    return jsonify([product.to_dict() for product in products]), 200
+    """ Returns a page of products in a category """
+    return _product_page(Product.category_id == category_id)
 
 
 @bp.route('/products', methods=['POST'])
 @jwt_required()
 def create_product():
     """ Create produt by admin"""
-    user_id = get_jwt_identity()
-    user = db.session.get(User, user_id)
-    if not user.is_admin:
+    if not current_auth().is_admin:
         return jsonify({'error': 'Only admins can create products'}), 403
     
     data = request.get_json()
@@ -68,6 +187,8 @@ def create_product():
 
     db.session.add(product)
     db.session.commit()
+    get_search_backend().index(product)
+    invalidate('products')
     return jsonify(product.to_dict()), 201
 
 
@@ -75,9 +196,7 @@ def create_product():
 @jwt_required()
 def update_product(product_id):
     """  Updates an existing product."""
-    user_id = get_jwt_identity()
-    user = db.session.get(User, user_id)
-    if not user.is_admin:
+    if not current_auth().is_admin:
         return jsonify({'error': 'Only admins can update products'}), 403
 
     product = db.session.get(Product, product_id)
@@ -88,10 +207,14 @@ def update_product(product_id):
     product.name = data.get('name', product.name)
     product.description = data.get('description', product.description)
     product.price = data.get('price', product.price)
-    product.stock = data.get('stock', product.stock)
+    if 'stock' in data:
+        clear_shards([product_id])
+        product.stock = data['stock']
     product.category_id = data.get('category_id', product.category_id)
 
     db.session.commit()
+    get_search_backend().index(product)
+    invalidate(f'product:{product_id}', 'products')
     return jsonify(product.to_dict()), 200
 
 
@@ -99,9 +222,7 @@ def update_product(product_id):
 @jwt_required()
 def delete_product(product_id):
     """ Delete a product """
-    user_id = get_jwt_identity()
-    user = db.session.get(User, user_id)
-    if not user.is_admin:
+    if not current_auth().is_admin:
         return jsonify({'error': 'Only admins can delete products'}), 403
 
     product = db.session.get(Product, product_id)
@@ -110,4 +231,34 @@ def delete_product(product_id):
 
     db.session.delete(product)
     db.session.commit()
+    get_search_backend().remove(product_id)
+    invalidate(f'product:{product_id}', 'products')
     return '', 204
+
+
+@bp.route('/products/import', methods=['POST'])
+@jwt_required()
+def import_products():
+    """ Bulk upsert products from a streamed CSV or NDJSON body (admin only) """
+    if not current_auth().is_admin:
+        return jsonify({'error': 'Only admins can import products'}), 403
+
+    import_format = request.args.get('format')
+    if not import_format:
+        import_format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    if import_format not in IMPORT_FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    chunk_size = request.args.get('chunk_size', type=int)
+
+    report = run_import(iter_rows(request.stream, import_format), chunk_size)
+    return jsonify(report), 200
+
+
+@bp.route('/products/cache/stats', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    """ Returns hit/miss counters of the catalog cache (admin only) """
+    if not current_auth().is_admin:
+        return jsonify({'error': 'Only admins can view cache statistics'}), 403
+    return jsonify(dict(get_cache().stats(),
+                        single_flight=get_single_flight().stats())), 200
@@ -0,0 +1,124 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.auth import current_auth
+from app.cache import invalidate
+from app.db_routing import read_replica
+from app.idempotency import idempotent
+from app.models.product import Product
+from app.models.review import Review
+from app.pagination import InvalidCursor, get_limit, keyset_page
+from app.ratings import apply_rating, valid_rating
+
+bp = Blueprint('reviews', __name__)
+
+
+def _review_fields(data, partial=False):
+    """ Returns (fields, error) for a review payload """
+    fields = {}
+    if 'rating' in data or not partial:
+        if not valid_rating(data.get('rating')):
+            return None, 'Rating must be an integer from 1 to 5'
+        fields['rating'] = data['rating']
+    if 'comment' in data:
+        comment = data['comment']
+        if comment is not None and not isinstance(comment, str):
+            return None, 'Comment must be a string'
+        fields['comment'] = comment
+    return fields, None
+
+
+def _locked_review(review_id):
+    """ Loads a review, locking it so its old rating cannot change under us """
+    return db.session.query(Review).filter_by(id=review_id).with_for_update().first()
+
+
+@bp.route('/products/<int:product_id>/reviews', methods=['POST'])
+@jwt_required()
+@idempotent
+def add_review(product_id):
+    """ Adds the caller's review of a product """
+    fields, error = _review_fields(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({'message': error}), 400
+    if db.session.get(Product, product_id) is None:
+        return jsonify({'message': 'Product not found'}), 404
+
+    review = Review(product_id=product_id, user_id=current_auth().user_id, **fields)
+    db.session.add(review)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'message': 'You have already reviewed this product'}), 409
+    apply_rating(product_id, new=review.rating)
+    db.session.commit()
+    invalidate(f'product:{product_id}', 'products')
+    return jsonify(review.to_dict()), 201
+
+
+@bp.route('/products/<int:product_id>/reviews', methods=['GET'])
+@read_replica
+def get_reviews(product_id):
+    """ Returns a newest-first page of a product's reviews and its rating """
+    product = db.session.get(Product, product_id)
+    if product is None:
+        return jsonify({'message': 'Product not found'}), 404
+    try:
+        limit = get_limit(request.args)
+        reviews, next_cursor = keyset_page(
+            db.session.query(Review).filter_by(product_id=product_id),
+            Review.id, Review.id,
+            cursor=request.args.get('cursor'), limit=limit,
+            descending=True, sort_name='-id')
+    except InvalidCursor as e:
+        return jsonify({'message': str(e)}), 400
+
+    return jsonify({
+        'items': [review.to_dict() for review in reviews],
+        'limit': limit,
+        'next_cursor': next_cursor,
+        'rating': product.to_dict()['rating']
+    }), 200
+
+
+@bp.route('/reviews/<int:review_id>', methods=['PUT'])
+@jwt_required()
+def update_review(review_id):
+    """ Updates the rating and/or comment of a review """
+    fields, error = _review_fields(request.get_json(silent=True) or {}, partial=True)
+    if error:
+        return jsonify({'message': error}), 400
+    review = _locked_review(review_id)
+    if review is None:
+        return jsonify({'message': 'Review not found'}), 404
+    if not current_auth().can_access(review.user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    old_rating = review.rating
+    for name, value in fields.items():
+        setattr(review, name, value)
+    apply_rating(review.product_id, old=old_rating, new=review.rating)
+    db.session.commit()
+    invalidate(f'product:{review.product_id}', 'products')
+    return jsonify(review.to_dict()), 200
+
+
+@bp.route('/reviews/<int:review_id>', methods=['DELETE'])
+@jwt_required()
+def delete_review(review_id):
+    """ Deletes a review """
+    review = _locked_review(review_id)
+    if review is None:
+        return jsonify({'message': 'Review not found'}), 404
+    if not current_auth().can_access(review.user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    product_id = review.product_id
+    db.session.delete(review)
+    apply_rating(product_id, old=review.rating)
+    db.session.commit()
+    invalidate(f'product:{product_id}', 'products')
+    return '', 204
@@ -1,20 +1,25 @@
+from datetime import datetime
 from flask import Blueprint, request, jsonify, abort
-from app import db
+from app import db, jwt
+from app.auth import current_auth, issue_tokens
+from app.blocklist import get_token_blocklist
 from app.models.user import User
+from app.passwords import PasswordHasherBusy
 from app.models.blacklist import TokenBlacklist
-from flask_jwt_extended import (
-        create_access_token, create_refresh_token, jwt_required,
-        get_jwt_identity, get_jwt, JWTManager
-)
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 
 bp = Blueprint('auth', __name__, url_prefix='/users')
-jwt = JWTManager()
 
 @jwt.token_in_blocklist_loader
 def check_if_token_is_revoked(jwt_header, jwt_payload):
-    jti = jwt_payload["jti"]
-    token = TokenBlacklist.query.filter_by(jti=jti).first()
-    return token is not None
+    return get_token_blocklist().is_revoked(jwt_payload["jti"])
+
+
+def _hasher_busy():
+    """ Response used when the password hashing pool is saturated """
+    response = jsonify({"error": "Server busy, please retry shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 
 @bp.route('/register', methods=['POST'])
@@ -49,6 +54,9 @@ def register():
         db.session.add(new_user)
         db.session.commit()
         return jsonify({"message": "User registered successfully"}), 201
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return _hasher_busy()
     except Exception as e:
         return jsonify({"error": "User registration failed"}), 500
 
@@ -65,22 +73,42 @@ def login():
 
     user = db.session.query(User).filter_by(email=email).first()
 
-    if user is None or not user.check_password(password):
-        return jsonify({'message': 'Invalid email or password'}), 401
-    
-    access_token = create_access_token(identity=user.id)
-    return jsonify({'message': 'Login successful', 'access_token': access_token}), 200 
+    try:
+        if user is None or not user.check_password(password):
+            return jsonify({'message': 'Invalid email or password'}), 401
+        if user.password_needs_rehash():
+            # Upgrade hashes made at an older cost while we know the password.
+            user.set_password(password)
+            db.session.commit()
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return _hasher_busy()
+
+    return jsonify({'message': 'Login successful', **issue_tokens(user)}), 200
+
+
+@bp.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    """ Exchange a refresh token for a new access token with current claims """
+    user = db.session.get(User, get_jwt_identity())
+    if not user:
+        return jsonify({"error": "User not found"}), 401
+    return jsonify({'access_token': issue_tokens(user)['access_token']}), 200
 
 
 @bp.route('/logout', methods=['POST'])
-@jwt_required()
+@jwt_required(verify_type=False)
 def logout():
-    """ Logout a user """
-    jti = get_jwt()['jti']
+    """ Logout a user by revoking the access or refresh token presented """
+    token = get_jwt()
+    jti = token['jti']
+    expires_at = datetime.utcfromtimestamp(token['exp']) if 'exp' in token else None
     try:
-        blacklisted_token = TokenBlacklist(jti=jti)
+        blacklisted_token = TokenBlacklist(jti=jti, expires_at=expires_at)
         db.session.add(blacklisted_token)
         db.session.commit()
+        get_token_blocklist().revoke(jti, expires_at or datetime.max)
         return jsonify({'message': 'Logged out successfully'}), 200
     except Exception as e:
         return jsonify({"error": "Failed to log out"}), 500
@@ -127,21 +155,24 @@ def update_user(user_id):
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    if get_jwt_identity() != user.id:
+    if current_auth().user_id != user.id:
         return jsonify({"error": "You do not have permission to update this user"}), 403
 
     data = request.get_json()
     user.username = data.get('username', user.username)
     user.email = data.get('email', user.email)
 
-    if 'password' in data:
-        user.set_password(data['password'])
     try:
+        if 'password' in data:
+            user.set_password(data['password'])
         User.validate_email(user.email)
         db.session.commit()
         return jsonify({"message": "User updated successfully"}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return _hasher_busy()
     except Exception as e:
         return jsonify({"error": "Failed to update user"}), 500
 
@@ -169,7 +200,7 @@ def delete_user(user_id):
     user = db.session.get(User, user_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
-    if get_jwt_identity() != user.id and not get_jwt_identity().is_admin:
+    if not current_auth().can_access(user.id):
         return jsonify({"error": "You do not have permission to delete this user"}), 403
 
     try:
@@ -0,0 +1,76 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.auth import current_auth
+from app.models.product import Product
+from app.models.wishlist_item import WishlistItem
+from app.pagination import InvalidCursor, get_limit, keyset_page
+
+bp = Blueprint('wishlist', __name__)
+
+
+@bp.route('/users/<int:user_id>/wishlist/add', methods=['POST'])
+@jwt_required()
+def add_to_wishlist(user_id):
+    """ Adds a product to the user's wishlist; adding it twice is a no-op """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+    data = request.get_json(silent=True) or {}
+    product_id = data.get('product_id')
+    if not isinstance(product_id, int) or isinstance(product_id, bool):
+        return jsonify({'message': 'Invalid product ID'}), 400
+    if db.session.get(Product, product_id) is None:
+        return jsonify({'message': 'Product not found'}), 404
+
+    item = WishlistItem.query.filter_by(user_id=user_id, product_id=product_id).first()
+    if item is not None:
+        return jsonify(item.to_dict()), 200
+    item = WishlistItem(user_id=user_id, product_id=product_id)
+    db.session.add(item)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request added it first.
+        db.session.rollback()
+        item = WishlistItem.query.filter_by(user_id=user_id, product_id=product_id).one()
+        return jsonify(item.to_dict()), 200
+    return jsonify(item.to_dict()), 201
+
+
+@bp.route('/users/<int:user_id>/wishlist/items/<int:product_id>', methods=['DELETE'])
+@jwt_required()
+def remove_from_wishlist(user_id, product_id):
+    """ Removes a product from the user's wishlist """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+    removed = WishlistItem.query.filter_by(user_id=user_id, product_id=product_id) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    if not removed:
+        return jsonify({'message': 'Product not in wishlist'}), 404
+    return '', 204
+
+
+@bp.route('/users/<int:user_id>/wishlist/items', methods=['GET'])
+@jwt_required()
+def get_wishlist(user_id):
+    """ Returns a newest-first page of the user's wishlist """
+    if not current_auth().can_access(user_id):
+        return jsonify({'message': 'Unauthorized access'}), 403
+    try:
+        limit = get_limit(request.args)
+        items, next_cursor = keyset_page(
+            db.session.query(WishlistItem).filter_by(user_id=user_id),
+            WishlistItem.id, WishlistItem.id,
+            cursor=request.args.get('cursor'), limit=limit,
+            descending=True, sort_name='-id')
+    except InvalidCursor as e:
+        return jsonify({'message': str(e)}), 400
+
+    return jsonify({
+        'items': [item.to_dict() for item in items],
+        'limit': limit,
+        'next_cursor': next_cursor
+    }), 200
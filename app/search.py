@@ -0,0 +1,296 @@
+""" This module contains the product search backends.
+
+Every backend answers the same question: given a free-text query, which
+product ids match, best first. Backends are picked with the SEARCH_BACKEND
+setting:
+
+    mysql   - MATCH ... AGAINST on a FULLTEXT index (production)
+    sqlite  - an FTS5 virtual table kept in sync by triggers
+    memory  - an in-process inverted index (tests, single process setups)
+"""
+
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import DDL, event, text
+
+from app import db
+from app.models.product import Product
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Matches in the name count more than matches in the description.
+NAME_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+
+event.listen(
+    Product.__table__, 'after_create',
+    DDL('ALTER TABLE products ADD FULLTEXT INDEX ix_products_fulltext '
+        '(name, description)').execute_if(dialect='mysql'))
+
+
+def tokenize(value):
+    """ Splits text into lowercase word tokens """
+    if not value:
+        return []
+    return TOKEN_RE.findall(value.lower())
+
+
+class SearchBackend:
+    """ Interface shared by every search backend """
+
+    def search(self, query, limit, offset=0):
+        """ Returns the ids of matching products, most relevant first """
+        raise NotImplementedError
+
+    def index(self, product):
+        """ Adds or refreshes a product after it has been committed """
+
+    def remove(self, product_id):
+        """ Drops a deleted product """
+
+    def rebuild(self):
+        """ Rebuilds the index from the products table """
+
+    def mark_stale(self):
+        """ Called after bulk writes that bypassed index()/remove() """
+
+
+class MySQLFulltextBackend(SearchBackend):
+    """ Uses the FULLTEXT index on products(name, description).
+
+    InnoDB maintains the index itself, so index() and remove() are no-ops.
+    """
+
+    def search(self, query, limit, offset=0):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        # Boolean mode: every term is required and may be a prefix.
+        boolean_query = ' '.join(f'+{term}*' for term in terms)
+        rows = db.session.execute(text(
+            'SELECT id FROM products '
+            'WHERE MATCH(name, description) AGAINST (:q IN BOOLEAN MODE) '
+            'ORDER BY MATCH(name, description) AGAINST (:q IN BOOLEAN MODE) DESC, id '
+            'LIMIT :limit OFFSET :offset'
+        ), {'q': boolean_query, 'limit': limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+
+class SQLiteFTS5Backend(SearchBackend):
+    """ Uses an external content FTS5 table that mirrors products.
+
+    Triggers keep products_fts in sync with the products table, so index()
+    and remove() are no-ops once the schema exists.
+    """
+
+    SCHEMA = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+        "name, description, content='products', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+        "INSERT INTO products_fts(rowid, name, description) "
+        "VALUES (new.id, new.name, new.description); END",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); END",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "INSERT INTO products_fts(rowid, name, description) "
+        "VALUES (new.id, new.name, new.description); END",
+    ]
+
+    def __init__(self):
+        self._ready = False
+
+    def _ensure_schema(self):
+        if self._ready:
+            return
+        exists = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")).first()
+        for statement in self.SCHEMA:
+            db.session.execute(text(statement))
+        if not exists:
+            db.session.execute(text(
+                "INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+        db.session.commit()
+        self._ready = True
+
+    def search(self, query, limit, offset=0):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        self._ensure_schema()
+        match = ' AND '.join(f'"{term}"*' for term in terms)
+        rows = db.session.execute(text(
+            'SELECT rowid FROM products_fts WHERE products_fts MATCH :q '
+            'ORDER BY bm25(products_fts, :name_weight, :description_weight), rowid '
+            'LIMIT :limit OFFSET :offset'
+        ), {'q': match, 'name_weight': NAME_WEIGHT,
+            'description_weight': DESCRIPTION_WEIGHT,
+            'limit': limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+    def index(self, product):
+        self._ensure_schema()
+
+    def rebuild(self):
+        self._ensure_schema()
+        db.session.execute(text(
+            "INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+        db.session.commit()
+
+
+class InMemorySearchBackend(SearchBackend):
+    """ An in-process inverted index over product name and description.
+
+    Postings map a token to {product_id: weighted term frequency}, and a
+    sorted token list answers prefix lookups with a binary search. Results
+    are ranked with BM25. The index is loaded from the database on first
+    use and must be fed through index()/remove() by the write routes, so it
+    only suits a single process.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._postings = defaultdict(dict)
+        self._doc_tokens = {}
+        self._doc_lengths = {}
+        self._total_length = 0.0
+        self._tokens = []
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = db.session.execute(
+                db.select(Product.id, Product.name, Product.description)
+                .execution_options(yield_per=1000))
+            for product_id, name, description in rows:
+                self._add(product_id, name, description)
+            self._tokens = sorted(self._postings)
+            self._loaded = True
+
+    def _add(self, product_id, name, description):
+        weights = defaultdict(float)
+        for token in tokenize(name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(description):
+            weights[token] += DESCRIPTION_WEIGHT
+        for token, weight in weights.items():
+            self._postings[token][product_id] = weight
+        self._doc_tokens[product_id] = list(weights)
+        self._doc_lengths[product_id] = sum(weights.values())
+        self._total_length += self._doc_lengths[product_id]
+
+    def _discard(self, product_id):
+        for token in self._doc_tokens.pop(product_id, []):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+        self._total_length -= self._doc_lengths.pop(product_id, 0.0)
+
+    def _expand(self, term):
+        """ Returns every indexed token starting with term """
+        tokens = self._tokens
+        position = bisect.bisect_left(tokens, term)
+        matches = []
+        while position < len(tokens) and tokens[position].startswith(term):
+            matches.append(tokens[position])
+            position += 1
+        return matches
+
+    def search(self, query, limit, offset=0):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        self._load()
+        with self._lock:
+            total_docs = len(self._doc_lengths) or 1
+            average_length = self._total_length / total_docs or 1.0
+            scores = None
+            for term in terms:
+                term_scores = defaultdict(float)
+                for token in self._expand(term):
+                    postings = self._postings[token]
+                    idf = math.log(1 + (total_docs - len(postings) + 0.5)
+                                   / (len(postings) + 0.5))
+                    for product_id, frequency in postings.items():
+                        norm = self.K1 * (1 - self.B + self.B
+                                          * self._doc_lengths[product_id]
+                                          / average_length)
+                        term_scores[product_id] += (
+                            idf * frequency * (self.K1 + 1) / (frequency + norm))
+                # Every term has to match somewhere in the product.
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {product_id: score + term_scores[product_id]
+                              for product_id, score in scores.items()
+                              if product_id in term_scores}
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [product_id for product_id, _ in ranked[offset:offset + limit]]
+
+    def index(self, product):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._discard(product.id)
+            self._add(product.id, product.name, product.description)
+            self._tokens = sorted(self._postings)
+
+    def remove(self, product_id):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._discard(product_id)
+            self._tokens = sorted(self._postings)
+
+    def mark_stale(self):
+        # Reload from the table on the next search.
+        with self._lock:
+            self._loaded = False
+            self._postings.clear()
+            self._doc_tokens.clear()
+            self._doc_lengths.clear()
+            self._total_length = 0.0
+            self._tokens = []
+
+    def rebuild(self):
+        self.mark_stale()
+        self._load()
+
+
+BACKENDS = {
+    'mysql': MySQLFulltextBackend,
+    'sqlite': SQLiteFTS5Backend,
+    'memory': InMemorySearchBackend,
+}
+
+
+def init_app(app):
+    """ Creates the configured search backend for app """
+    name = app.config.get('SEARCH_BACKEND', 'memory')
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown SEARCH_BACKEND {name!r}')
+    app.extensions['search'] = BACKENDS[name]()
+
+
+def get_search_backend():
+    """ Returns the search backend of the current app """
+    return current_app.extensions['search']
@@ -0,0 +1,127 @@
+""" This module coalesces identical concurrent read requests.
+
+When many requests for the same hot product or search arrive together, the
+first one (the leader) runs the view while the others with the same key wait
+for it and reuse its serialized response, so the database runs the query
+once. Nothing is kept after the leader finishes; caching is cache.py's job.
+A follower that waits longer than SINGLE_FLIGHT_TIMEOUT, or whose leader
+failed, runs the view itself. Callers in their read-your-writes window run
+the view themselves too: the leader may have read a lagging replica.
+"""
+
+import threading
+from functools import wraps
+
+from flask import current_app, make_response
+
+from app.cache import request_key
+from app.db_routing import reads_own_writes
+
+
+class _Call:
+    """ One in-flight execution and the requests waiting on it """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class SingleFlight:
+    """ Runs at most one function call per key at a time """
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout=None):
+        """ Returns fn(), sharing the result with concurrent calls for key """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException:
+                call.failed = True
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                self.timeouts += 1
+            return fn()
+        if call.failed:
+            return fn()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'in_flight': len(self._calls),
+            }
+
+
+def init_app(app):
+    """ Creates the single-flight group for app """
+    app.extensions['single_flight'] = SingleFlight(
+        timeout=app.config.get('SINGLE_FLIGHT_TIMEOUT', 5.0))
+
+
+def get_single_flight():
+    """ Returns the single-flight group of the current app """
+    return current_app.extensions['single_flight']
+
+
+def coalesced(key=None, timeout=None, ignore_args=()):
+    """ Shares one execution of a GET view between identical concurrent requests.
+
+    key is a callable receiving the view arguments and returning a string;
+    by default requests are identical when their path and query string,
+    minus ignore_args, are.
+    Only the serialized body, status and headers are shared, never objects
+    bound to the leader's database session.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if reads_own_writes():
+                return view(*args, **kwargs)
+            call_key = (view.__name__,
+                        key(**kwargs) if key else request_key(ignore_args))
+            own = []
+
+            def run():
+                response = make_response(view(*args, **kwargs))
+                own.append(response)
+                if response.direct_passthrough:
+                    return None
+                return (response.get_data(), response.status_code,
+                        list(response.headers.items()))
+
+            shared = get_single_flight().do(call_key, run, timeout)
+            if own:
+                return own[0]
+            if shared is None:
+                return make_response(view(*args, **kwargs))
+            body, status, headers = shared
+            return current_app.response_class(body, status, headers)
+        return wrapper
+    return decorator
@@ -0,0 +1,66 @@
+""" This module annotates product listings with the caller's wishlist.
+
+Listing screens show an "in my wishlist" heart on every tile. Product pages
+are cached and coalesced for every caller, so the annotation is applied to
+the finished response instead: with_wishlist runs outside those layers,
+looks up the whole page in one IN (...) query on (user_id, product_id) and
+adds an in_wishlist flag to each item. The cache and single-flight keys
+ignore ?with_wishlist=, so annotated and plain requests share one entry.
+"""
+
+import json
+from functools import wraps
+
+from flask import make_response, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from sqlalchemy import select
+
+from app import db
+from app.cache import make_etag
+from app.models.wishlist_item import WishlistItem
+
+WISHLIST_ARG = 'with_wishlist'
+
+
+def wishlisted(user_id, product_ids):
+    """ Returns the subset of product_ids in the user's wishlist """
+    if user_id is None or not product_ids:
+        return set()
+    return set(db.session.scalars(
+        select(WishlistItem.product_id).where(WishlistItem.user_id == user_id,
+                                              WishlistItem.product_id.in_(product_ids))))
+
+
+def with_wishlist(view):
+    """ Adds in_wishlist to each item of a product page when ?with_wishlist=1.
+
+    Anonymous callers get in_wishlist false everywhere. The annotated body
+    gets its own ETag, so conditional requests still work per user.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.args.get(WISHLIST_ARG) not in ('1', 'true'):
+            return view(*args, **kwargs)
+
+        verify_jwt_in_request(optional=True)
+        user_id = get_jwt_identity()
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or not response.is_json:
+            return response
+
+        payload = json.loads(response.get_data())
+        items = payload.get('items', [])
+        saved = wishlisted(user_id, [item['id'] for item in items])
+        for item in items:
+            item['in_wishlist'] = item['id'] in saved
+
+        body = json.dumps(payload).encode('utf-8')
+        etag = make_etag(body)
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            response = make_response(body, 200)
+            response.mimetype = 'application/json'
+        response.set_etag(etag)
+        return response
+    return wrapper
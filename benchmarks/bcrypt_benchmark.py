@@ -0,0 +1,59 @@
+""" Reports password verifications (logins) per second at each bcrypt cost.
+
+Usage: python benchmarks/bcrypt_benchmark.py [--costs 10 11 12] [--clients 16]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.passwords import PasswordHasher, PasswordHasherBusy
+
+
+def run(cost, workers, clients, logins):
+    hasher = PasswordHasher(rounds=cost, workers=workers, queue_size=clients)
+    hashed = hasher.hash('correct horse battery')
+    rejected = 0
+
+    def login(_):
+        nonlocal rejected
+        try:
+            hasher.verify('correct horse battery', hashed)
+        except PasswordHasherBusy:
+            rejected += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - started
+    print(f'cost {cost:>2}: {(logins - rejected) / elapsed:8.1f} logins/s '
+          f'{elapsed / logins * 1000 * clients:8.1f} ms avg latency '
+          f'({rejected} rejected)')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--costs', type=int, nargs='+', default=[4, 8, 10, 11, 12, 13])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f'{args.workers} hashing workers, {args.clients} concurrent clients')
+    for cost in args.costs:
+        # Size each run to roughly --seconds of work.
+        probe = PasswordHasher(rounds=cost, workers=1)
+        hashed = probe.hash('probe')
+        started = time.perf_counter()
+        probe.verify('probe', hashed)
+        per_login = time.perf_counter() - started
+        logins = max(args.workers, int(args.seconds * args.workers / per_login))
+        run(cost, args.workers, args.clients, logins)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,661 @@
+""" Drives every API route with a weighted request mix and reports latency.
+
+Seeds a throwaway SQLite database through create_app(TestingConfig) with
+--users/--categories/--products/--orders rows, then sends --requests
+requests from --threads threads, each request picked from MIX by weight.
+Reports p50/p95/p99 latency per route and overall requests/s, and writes
+them to --output as a JSON baseline. With --compare BASELINE it exits 1 if
+any route's p95, or the overall throughput, is worse than the baseline by
+more than --threshold.
+
+The same --seed gives the same data and the same request sequence per
+thread, so two runs on one machine are comparable.
+
+Usage:
+    python benchmarks/loadtest.py --output baseline.json
+    python benchmarks/loadtest.py --compare baseline.json --threshold 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token, create_refresh_token
+from sqlalchemy import insert, select
+
+from config import TestingConfig
+from app import create_app, db
+from app.models import Category, Notification, Order, OrderItem, Product, User
+from app.passwords import get_password_hasher
+
+PASSWORD = 'benchmark-password'
+WORDS = ('red', 'blue', 'green', 'lamp', 'chair', 'table', 'desk', 'phone', 'case',
+         'cable', 'wooden', 'steel', 'cotton', 'shirt', 'shoe', 'bag', 'bottle',
+         'mug', 'kettle', 'pan', 'knife', 'pillow', 'blanket', 'clock', 'watch')
+
+
+def seed(app, users, categories, products, orders, rng):
+    """ Bulk inserts the benchmark data set; returns ids the mix needs """
+    with app.app_context():
+        db.create_all()
+        password_hash = get_password_hasher().hash(PASSWORD)
+        db.session.execute(insert(User), [
+            {'username': f'user{i}', 'email': f'user{i}@bench.test',
+             'password_hash': password_hash, 'is_admin': i == 0}
+            for i in range(users)])
+        db.session.execute(insert(Category), [
+            {'name': f'Category {i}', 'description': f'Benchmark category {i}'}
+            for i in range(categories)])
+        db.session.commit()
+        user_ids = list(db.session.scalars(select(User.id).order_by(User.id)))
+        category_ids = list(db.session.scalars(select(Category.id)))
+
+        db.session.execute(insert(Product), [
+            {'name': ' '.join(rng.sample(WORDS, 3)),
+             'description': ' '.join(rng.sample(WORDS, 8)),
+             'price': round(rng.uniform(1, 500), 2),
+             'category_id': rng.choice(category_ids),
+             'stock': 10 ** 9, 'status': 'available'}
+            for _ in range(products)])
+        db.session.commit()
+        product_ids = list(db.session.scalars(select(Product.id)))
+
+        start = datetime(2024, 1, 1)
+        rows = []
+        for i in range(orders):
+            quantity = rng.randint(1, 5)
+            rows.append({'user_id': rng.choice(user_ids), 'product_id': rng.choice(product_ids),
+                         'quantity': quantity, 'total_price': quantity * 10.0,
+                         'status': rng.choice(('Pending', 'Shipped', 'Delivered')),
+                         'date_ordered': start + timedelta(minutes=i)})
+        for offset in range(0, len(rows), 5000):
+            db.session.execute(insert(Order), rows[offset:offset + 5000])
+        db.session.commit()
+
+        orders_by_user = defaultdict(list)
+        item_rows = []
+        for order_id, user_id, product_id, quantity in db.session.execute(
+                select(Order.id, Order.user_id, Order.product_id, Order.quantity)):
+            orders_by_user[user_id].append(order_id)
+            item_rows.append({'order_id': order_id, 'product_id': product_id,
+                              'quantity': quantity, 'unit_price': 10.0})
+        for offset in range(0, len(item_rows), 5000):
+            db.session.execute(insert(OrderItem), item_rows[offset:offset + 5000])
+        db.session.commit()
+
+        # Search indexes are built lazily; build it now so it is not timed.
+        from app.search import get_search_backend
+        get_search_backend().rebuild()
+
+        return {'user_ids': user_ids, 'admin_id': user_ids[0],
+                'category_ids': category_ids, 'product_ids': product_ids,
+                'orders_by_user': dict(orders_by_user)}
+
+
+class Scenario:
+    """ Shared state of one run: ids, tokens and rows created by the mix """
+
+    def __init__(self, app, data):
+        self.app = app
+        self.data = data
+        self.lock = threading.Lock()
+        self.created_products = []
+        self.created_orders = []
+        self.created_reviews = []
+        self.registered = []
+        self.serial = 0
+        with app.app_context():
+            self.admin_token = self._access_token(data['admin_id'], True)
+            self.tokens = {user_id: self._access_token(user_id, False)
+                           for user_id in data['user_ids'][1:]}
+
+    def _access_token(self, user_id, is_admin):
+        return create_access_token(identity=user_id, additional_claims={'is_admin': is_admin})
+
+    def next_serial(self):
+        with self.lock:
+            self.serial += 1
+            return self.serial
+
+    def token(self, user_id, refresh=False):
+        with self.app.app_context():
+            if refresh:
+                return create_refresh_token(identity=user_id)
+            return self._access_token(user_id, False)
+
+
+def _auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+class Worker:
+    """ One thread's client, random stream and current user """
+
+    def __init__(self, scenario, rng):
+        self.scenario = scenario
+        self.data = scenario.data
+        self.rng = rng
+        self.client = scenario.app.test_client()
+
+    def actor(self):
+        user_id = self.rng.choice(self.data['user_ids'][1:])
+        return user_id, _auth(self.scenario.tokens[user_id])
+
+    def admin(self):
+        return _auth(self.scenario.admin_token)
+
+    def product_id(self):
+        # A skewed pick, so a few hot products get most of the reads.
+        ids = self.data['product_ids']
+        return ids[min(int(self.rng.expovariate(1 / 50)), len(ids) - 1)]
+
+    # Each op prepares untimed state, then returns a callable that sends
+    # the timed request.
+
+    def products_list(self):
+        sort = self.rng.choice(('id', 'name', '-price'))
+        return lambda: self.client.get(f'/products?sort={sort}&limit=20')
+
+    def products_get(self):
+        product_id = self.product_id()
+        return lambda: self.client.get(f'/products/{product_id}')
+
+    def products_search(self):
+        query = ' '.join(self.rng.sample(WORDS, self.rng.randint(1, 2)))
+        return lambda: self.client.get(f'/products/search?query={query}&limit=20')
+
+    def products_categories(self):
+        return lambda: self.client.get('/products/categories')
+
+    def products_by_category(self):
+        category_id = self.rng.choice(self.data['category_ids'])
+        return lambda: self.client.get(f'/products/category/{category_id}?limit=20')
+
+    def products_create(self):
+        body = {'name': f'Bench product {self.scenario.next_serial()}', 'price': 9.99,
+                'stock': 100, 'category_id': self.rng.choice(self.data['category_ids'])}
+
+        def send():
+            response = self.client.post('/products', json=body, headers=self.admin())
+            if response.status_code == 201:
+                with self.scenario.lock:
+                    self.scenario.created_products.append(response.get_json()['id'])
+            return response
+        return send
+
+    def products_update(self):
+        product_id = self.product_id()
+        body = {'price': round(self.rng.uniform(1, 500), 2)}
+        return lambda: self.client.put(f'/products/{product_id}', json=body,
+                                       headers=self.admin())
+
+    def products_delete(self):
+        with self.scenario.lock:
+            created = self.scenario.created_products
+            product_id = created.pop() if created else None
+        if product_id is None:
+            return None
+        return lambda: self.client.delete(f'/products/{product_id}', headers=self.admin())
+
+    def products_import(self):
+        rows = [{'id': self.product_id(), 'price': round(self.rng.uniform(1, 500), 2)}
+                for _ in range(20)]
+        body = '\n'.join(json.dumps(row) for row in rows)
+        return lambda: self.client.post('/products/import?format=ndjson', data=body,
+                                        headers=self.admin())
+
+    def products_cache_stats(self):
+        return lambda: self.client.get('/products/cache/stats', headers=self.admin())
+
+    def products_changes(self):
+        return lambda: self.client.get('/products/changes?limit=100')
+
+    def orders_create(self):
+        user_id, headers = self.actor()
+        if self.rng.random() < 0.7:
+            body = {'product_id': self.product_id(), 'quantity': self.rng.randint(1, 3)}
+        else:
+            body = {'items': [{'product_id': product_id, 'quantity': 1}
+                              for product_id in {self.product_id() for _ in range(4)}]}
+
+        def send():
+            response = self.client.post('/orders', json=body, headers=headers)
+            if response.status_code == 201:
+                with self.scenario.lock:
+                    self.scenario.created_orders.append((user_id, response.get_json()['id']))
+            return response
+        return send
+
+    def _own_order(self):
+        user_id = self.rng.choice(list(self.data['orders_by_user']))
+        order_id = self.rng.choice(self.data['orders_by_user'][user_id])
+        return order_id, _auth(self.scenario.tokens.get(user_id, self.scenario.admin_token))
+
+    def orders_list(self):
+        _, headers = self.actor()
+        status = self.rng.choice(('', '&status=Pending'))
+        return lambda: self.client.get(f'/orders?limit=20{status}', headers=headers)
+
+    def orders_get(self):
+        order_id, headers = self._own_order()
+        return lambda: self.client.get(f'/orders/{order_id}', headers=headers)
+
+    def orders_history(self):
+        user_id, headers = self.actor()
+        return lambda: self.client.get(f'/orders/history/{user_id}?limit=20', headers=headers)
+
+    def orders_update(self):
+        order_id, headers = self._own_order()
+        body = {'quantity': self.rng.randint(1, 5)}
+        return lambda: self.client.put(f'/orders/{order_id}', json=body, headers=headers)
+
+    def orders_status(self):
+        order_id, _ = self._own_order()
+        body = {'status': self.rng.choice(('Pending', 'Processing'))}
+        return lambda: self.client.put(f'/orders/{order_id}/status', json=body,
+                                       headers=self.admin())
+
+    def orders_cancel(self):
+        with self.scenario.lock:
+            created = self.scenario.created_orders
+            entry = created.pop() if created else None
+        if entry is None:
+            return None
+        user_id, order_id = entry
+        headers = _auth(self.scenario.tokens[user_id])
+        return lambda: self.client.post(f'/orders/{order_id}/cancel', headers=headers)
+
+    def users_register(self):
+        serial = self.scenario.next_serial()
+        body = {'username': f'bench{serial}', 'email': f'bench{serial}@bench.test',
+                'password': PASSWORD}
+
+        def send():
+            response = self.client.post('/users/register', json=body)
+            if response.status_code == 201:
+                with self.scenario.lock:
+                    self.scenario.registered.append(body['email'])
+            return response
+        return send
+
+    def users_login(self):
+        index = self.rng.randrange(1, len(self.data['user_ids']))
+        body = {'email': f'user{index}@bench.test', 'password': PASSWORD}
+        return lambda: self.client.post('/users/login', json=body)
+
+    def users_refresh(self):
+        user_id, _ = self.actor()
+        headers = _auth(self.scenario.token(user_id, refresh=True))
+        return lambda: self.client.post('/users/refresh', headers=headers)
+
+    def users_logout(self):
+        user_id, _ = self.actor()
+        headers = _auth(self.scenario.token(user_id))
+        return lambda: self.client.post('/users/logout', headers=headers)
+
+    def users_profile(self):
+        _, headers = self.actor()
+        return lambda: self.client.get('/users/profile', headers=headers)
+
+    def users_get(self):
+        user_id, headers = self.actor()
+        return lambda: self.client.get(f'/users/{user_id}', headers=headers)
+
+    def users_update(self):
+        user_id, headers = self.actor()
+        index = self.data['user_ids'].index(user_id)
+        body = {'email': f'user{index}@bench.test'}
+        return lambda: self.client.put(f'/users/{user_id}', json=body, headers=headers)
+
+    def users_reset_password(self):
+        index = self.rng.randrange(len(self.data['user_ids']))
+        return lambda: self.client.post(f'/users/reset-password?email=user{index}@bench.test')
+
+    def users_delete(self):
+        with self.scenario.lock:
+            email = self.scenario.registered.pop() if self.scenario.registered else None
+        if email is None:
+            return None
+        with self.scenario.app.app_context():
+            user_id = db.session.scalar(select(User.id).where(User.email == email))
+            db.session.remove()
+        headers = _auth(self.scenario.token(user_id))
+        return lambda: self.client.delete(f'/users/{user_id}', headers=headers)
+
+    def exports_orders(self):
+        return lambda: self.client.get('/exports/orders?to=2024-01-02', headers=self.admin())
+
+    def exports_order_items(self):
+        return lambda: self.client.get('/exports/order-items?to=2024-01-02',
+                                       headers=self.admin())
+
+    def exports_products(self):
+        return lambda: self.client.get('/exports/products?format=csv', headers=self.admin())
+
+    def cart_product_id(self):
+        # Carts draw from a few products so updates and removals find their line.
+        return self.data['product_ids'][self.rng.randrange(10)]
+
+    def carts_get(self):
+        user_id, headers = self.actor()
+        return lambda: self.client.get(f'/carts/{user_id}', headers=headers)
+
+    def carts_get_item(self):
+        user_id, headers = self.actor()
+        product_id = self.cart_product_id()
+        return lambda: self.client.get(f'/carts/{user_id}/{product_id}', headers=headers)
+
+    def carts_add(self):
+        user_id, headers = self.actor()
+        body = {'product_id': self.cart_product_id(), 'quantity': self.rng.randint(1, 3)}
+        return lambda: self.client.post(f'/carts/{user_id}/items', json=body, headers=headers)
+
+    def carts_update(self):
+        user_id, headers = self.actor()
+        product_id = self.cart_product_id()
+        body = {'quantity': self.rng.randint(1, 5)}
+        return lambda: self.client.put(f'/carts/{user_id}/items/{product_id}', json=body,
+                                       headers=headers)
+
+    def carts_remove(self):
+        user_id, headers = self.actor()
+        product_id = self.cart_product_id()
+        return lambda: self.client.delete(f'/carts/{user_id}/items/{product_id}',
+                                          headers=headers)
+
+    def wishlist_get(self):
+        user_id, headers = self.actor()
+        return lambda: self.client.get(f'/users/{user_id}/wishlist/items?limit=20',
+                                       headers=headers)
+
+    def wishlist_add(self):
+        user_id, headers = self.actor()
+        body = {'product_id': self.product_id()}
+        return lambda: self.client.post(f'/users/{user_id}/wishlist/add', json=body,
+                                        headers=headers)
+
+    def wishlist_remove(self):
+        user_id, headers = self.actor()
+        product_id = self.product_id()
+        return lambda: self.client.delete(f'/users/{user_id}/wishlist/items/{product_id}',
+                                          headers=headers)
+
+    def reviews_list(self):
+        product_id = self.product_id()
+        return lambda: self.client.get(f'/products/{product_id}/reviews?limit=20')
+
+    def reviews_create(self):
+        user_id, headers = self.actor()
+        product_id = self.product_id()
+        body = {'rating': self.rng.randint(1, 5), 'comment': ' '.join(self.rng.sample(WORDS, 6))}
+
+        def send():
+            response = self.client.post(f'/products/{product_id}/reviews', json=body,
+                                        headers=headers)
+            if response.status_code == 201:
+                with self.scenario.lock:
+                    self.scenario.created_reviews.append((user_id, response.get_json()['id']))
+            return response
+        return send
+
+    def reviews_update(self):
+        with self.scenario.lock:
+            created = self.scenario.created_reviews
+            entry = self.rng.choice(created) if created else None
+        if entry is None:
+            return None
+        user_id, review_id = entry
+        headers = _auth(self.scenario.tokens[user_id])
+        body = {'rating': self.rng.randint(1, 5)}
+        return lambda: self.client.put(f'/reviews/{review_id}', json=body, headers=headers)
+
+    def reviews_delete(self):
+        with self.scenario.lock:
+            created = self.scenario.created_reviews
+            entry = created.pop() if created else None
+        if entry is None:
+            return None
+        user_id, review_id = entry
+        headers = _auth(self.scenario.tokens[user_id])
+        return lambda: self.client.delete(f'/reviews/{review_id}', headers=headers)
+
+    def notifications_list(self):
+        user_id, headers = self.actor()
+        unread = self.rng.choice(('', '&unread=1'))
+        return lambda: self.client.get(f'/users/{user_id}/notifications?limit=20{unread}',
+                                       headers=headers)
+
+    def notifications_unread_count(self):
+        user_id, headers = self.actor()
+        return lambda: self.client.get(f'/users/{user_id}/notifications/unread-count',
+                                       headers=headers)
+
+    def notifications_poll(self):
+        # timeout=0 answers at once, so a poll does not hold a worker thread.
+        user_id, headers = self.actor()
+        return lambda: self.client.get(f'/users/{user_id}/notifications/poll?timeout=0',
+                                       headers=headers)
+
+    def notifications_read(self):
+        user_id, headers = self.actor()
+        with self.scenario.app.app_context():
+            notification_id = db.session.scalar(
+                select(Notification.id).where(Notification.user_id == user_id)
+                .order_by(Notification.id.desc()).limit(1))
+            db.session.remove()
+        if notification_id is None:
+            return None
+        return lambda: self.client.post(f'/notifications/{notification_id}/read',
+                                        headers=headers)
+
+    def notifications_read_all(self):
+        user_id, headers = self.actor()
+        return lambda: self.client.post(f'/users/{user_id}/notifications/read', json={},
+                                        headers=headers)
+
+    def metrics(self):
+        return lambda: self.client.get('/metrics', headers=self.admin())
+
+
+# (op, weight): a read-heavy storefront mix that still touches every route.
+MIX = (
+    ('products_get', 20), ('products_list', 14), ('products_search', 10),
+    ('products_by_category', 8), ('products_categories', 4),
+    ('orders_list', 6), ('orders_get', 5), ('orders_history', 4), ('orders_create', 6),
+    ('orders_update', 1), ('orders_status', 1), ('orders_cancel', 1),
+    ('users_profile', 3), ('users_get', 2), ('users_login', 2), ('users_refresh', 1),
+    ('users_update', 1), ('users_register', 1), ('users_reset_password', 1),
+    ('users_logout', 1), ('users_delete', 0.5),
+    ('products_create', 0.5), ('products_update', 0.5), ('products_delete', 0.5),
+    ('products_import', 0.2), ('products_cache_stats', 0.3),
+    ('exports_orders', 0.2), ('exports_order_items', 0.2), ('exports_products', 0.2),
+    ('carts_get', 4), ('carts_get_item', 1), ('carts_add', 3), ('carts_update', 1),
+    ('carts_remove', 1),
+    ('wishlist_get', 2), ('wishlist_add', 1), ('wishlist_remove', 0.5),
+    ('reviews_list', 4), ('reviews_create', 0.5), ('reviews_update', 0.2),
+    ('reviews_delete', 0.2),
+    ('notifications_list', 2), ('notifications_unread_count', 3),
+    ('notifications_poll', 2), ('notifications_read', 0.5), ('notifications_read_all', 0.5),
+    ('products_changes', 1), ('metrics', 0.1),
+)
+
+
+def percentile(values, fraction):
+    """ Nearest-rank percentile of sorted values """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def drive(scenario, threads, requests, seed_value, mix):
+    """ Sends requests from threads; returns ({op: [(seconds, status)]}, elapsed) """
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    results = defaultdict(list)
+    per_thread = [requests // threads + (i < requests % threads) for i in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def work(index):
+        worker = Worker(scenario, random.Random(seed_value * 1000 + index))
+        local = defaultdict(list)
+        barrier.wait()
+        for _ in range(per_thread[index]):
+            name = worker.rng.choices(names, weights)[0]
+            send = getattr(worker, name)()
+            if send is None:
+                continue
+            started = time.perf_counter()
+            response = send()
+            response.get_data()  # drain streamed bodies inside the timing
+            local[name].append((time.perf_counter() - started, response.status_code))
+        with scenario.lock:
+            for name, samples in local.items():
+                results[name].extend(samples)
+
+    pool = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(samples):
+    latencies = sorted(seconds * 1000 for seconds, _ in samples)
+    statuses = defaultdict(int)
+    for _, status in samples:
+        statuses[str(status)] += 1
+    return {
+        'count': len(samples),
+        'errors': sum(count for status, count in statuses.items() if int(status) >= 500),
+        'statuses': dict(sorted(statuses.items())),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+    }
+
+
+def compare(report, baseline, threshold, min_delta_ms, min_count):
+    """ Returns the regressions of report against baseline """
+    regressions = []
+    for name, route in sorted(report['routes'].items()):
+        base = baseline['routes'].get(name)
+        # p95 of a handful of samples is noise, not a regression.
+        if not base or min(base['count'], route['count']) < min_count:
+            continue
+        limit = max(base['p95_ms'] * (1 + threshold), base['p95_ms'] + min_delta_ms)
+        if route['p95_ms'] > limit:
+            regressions.append(f"{name}: p95 {route['p95_ms']:.2f}ms vs "
+                               f"{base['p95_ms']:.2f}ms baseline")
+    rps, base_rps = report['total']['requests_per_second'], baseline['total']['requests_per_second']
+    if rps < base_rps * (1 - threshold):
+        regressions.append(f'throughput {rps:.1f} req/s vs {base_rps:.1f} req/s baseline')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=500,
+                        help='Requests sent, and discarded, before measuring')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', nargs='+', help='Restrict the mix to these ops')
+    parser.add_argument('--output', help='Write the report as a JSON baseline')
+    parser.add_argument('--compare', help='Baseline JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Allowed slowdown as a fraction (default 0.15)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='Ignore p95 slowdowns smaller than this')
+    parser.add_argument('--min-count', type=int, default=50,
+                        help='Only compare routes with at least this many samples')
+    args = parser.parse_args()
+
+    mix = MIX
+    if args.only:
+        unknown = set(args.only) - {name for name, _ in MIX}
+        if unknown:
+            parser.error(f'Unknown ops: {", ".join(sorted(unknown))}')
+        mix = tuple((name, weight) for name, weight in MIX if name in args.only)
+
+    path = os.path.join(tempfile.mkdtemp(), 'loadtest.db')
+
+    class BenchmarkConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 60, 'check_same_thread': False}}
+        # Every simulated client shares one address; measure the routes, not the limiter.
+        RATE_LIMIT_ENABLED = False
+
+    app = create_app(BenchmarkConfig)
+    app.logger.disabled = True
+    print(f'Seeding {args.users} users, {args.categories} categories, '
+          f'{args.products} products, {args.orders} orders...')
+    data = seed(app, args.users, args.categories, args.products, args.orders,
+                random.Random(args.seed))
+    scenario = Scenario(app, data)
+    if args.warmup:
+        drive(scenario, args.threads, args.warmup, args.seed + 1, mix)
+
+    results, elapsed = drive(scenario, args.threads, args.requests, args.seed, mix)
+    with app.app_context():
+        db.engine.dispose()
+
+    all_samples = [sample for samples in results.values() for sample in samples]
+    report = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                        'machine': platform.machine()},
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('output', 'compare')},
+        'total': dict(summarize(all_samples),
+                      requests_per_second=round(len(all_samples) / elapsed, 1),
+                      seconds=round(elapsed, 3)),
+        'routes': {name: summarize(samples) for name, samples in sorted(results.items())},
+    }
+
+    print(f"{'route':<26} {'count':>6} {'5xx':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, route in report['routes'].items():
+        print(f"{name:<26} {route['count']:>6} {route['errors']:>4} {route['p50_ms']:>8.2f} "
+              f"{route['p95_ms']:>8.2f} {route['p99_ms']:>8.2f}")
+    total = report['total']
+    print(f"{'total':<26} {total['count']:>6} {total['errors']:>4} {total['p50_ms']:>8.2f} "
+          f"{total['p95_ms']:>8.2f} {total['p99_ms']:>8.2f}   "
+          f"{total['requests_per_second']:.1f} req/s with {args.threads} threads")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f'Wrote {args.output}')
+
+    failed = total['errors'] > 0
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file),
+                                  args.threshold, args.min_delta_ms, args.min_count)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if not regressions:
+            print(f'No regressions beyond {args.threshold:.0%} of {args.compare}')
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+""" Compares order placement with per-request commits and group commit.
+
+Places --orders single-item orders from each --threads count against a
+SQLite file database (synchronous=FULL, so every commit is an fsync), once
+committing in the request and once through the group-commit OrderWriter,
+and reports orders/sec and commits per order.
+
+Usage: python benchmarks/order_commit_benchmark.py [--threads 1 8 32] [--orders 2000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from config import TestingConfig
+from app import create_app, db
+from app.models import Order, Product, User
+
+
+def run(threads, orders, group_commit, batch_size, wait_ms):
+    path = os.path.join(tempfile.mkdtemp(), 'orders.db')
+
+    class BenchmarkConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 60}}
+        ORDER_GROUP_COMMIT = group_commit
+        ORDER_GROUP_COMMIT_SIZE = batch_size
+        ORDER_GROUP_COMMIT_WAIT_MS = wait_ms
+
+    app = create_app(BenchmarkConfig)
+    commits = []
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def full_sync(connection, _):
+            connection.execute('PRAGMA synchronous=FULL')
+
+        @event.listens_for(db.engine, 'commit')
+        def count_commit(_):
+            commits.append(1)
+
+        db.create_all()
+        user = User(username='buyer', email='buyer@test.com', password_hash='unused')
+        products = [Product(name=f'Product {i}', price=1.0, stock=orders) for i in range(20)]
+        db.session.add_all([user, *products])
+        db.session.commit()
+        product_ids = [product.id for product in products]
+        token = create_access_token(identity=user.id)
+    commits.clear()
+
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def place_order(index):
+        body = {'product_id': product_ids[index % len(product_ids)], 'quantity': 1}
+        return app.test_client().post('/orders', json=body, headers=headers).status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(place_order, range(orders)))
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        placed = Order.query.count()
+        db.engine.dispose()
+    mode = f'group commit ({batch_size}/{wait_ms}ms)' if group_commit else 'per-request commit'
+    print(f'{mode:<26} {threads:>3} threads: {orders / elapsed:8.1f} orders/s, '
+          f'{len(commits) / orders:5.2f} commits/order, '
+          f'{statuses.count(201)} placed, {placed} stored')
+    return statuses.count(201) == placed == orders
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--wait-ms', type=int, default=0)
+    args = parser.parse_args()
+
+    ok = True
+    for group_commit in (False, True):
+        for threads in args.threads:
+            ok &= run(threads, args.orders, group_commit, args.batch_size, args.wait_ms)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+""" Compares the search backends with the old LIKE '%q%' scan.
+
+Usage: python benchmarks/search_benchmark.py [--rows 100000] [--queries 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import TestingConfig
+from app import create_app, db
+from app.models import Product
+from app.search import BACKENDS
+
+
+def make_words(count, rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return sorted({''.join(rng.choices(letters, k=rng.randint(4, 9)))
+                   for _ in range(count)})
+
+
+WORDS = make_words(20000, random.Random(1))
+
+
+def seed(rows):
+    rng = random.Random(42)
+    for start in range(0, rows, 5000):
+        db.session.execute(db.insert(Product), [{
+            'name': ' '.join(rng.sample(WORDS, 3)),
+            'description': ' '.join(rng.sample(WORDS, 20)),
+            'price': round(rng.uniform(1, 500), 2),
+            'stock': rng.randint(0, 100),
+        } for i in range(min(5000, rows - start))])
+    db.session.commit()
+
+
+def like_search(query, limit):
+    """ The previous implementation: unranked, name only, no limit """
+    return [p.id for p in db.session.query(Product)
+            .filter(Product.name.like(f'%{query}%')).all()]
+
+
+def timed(label, fn, queries, limit):
+    started = time.perf_counter()
+    for query in queries:
+        fn(query, limit)
+    elapsed = time.perf_counter() - started
+    print(f'{label:<10} {len(queries) / elapsed:10.1f} queries/s '
+          f'{elapsed / len(queries) * 1000:8.2f} ms/query')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'search.db')
+
+    class BenchmarkConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+
+    app = create_app(BenchmarkConfig)
+    rng = random.Random(7)
+    queries = [rng.choice(WORDS)[:rng.randint(4, 6)] for _ in range(args.queries)]
+    with app.app_context():
+        db.create_all()
+        seed(args.rows)
+        print(f'{args.rows} products, {args.queries} queries, limit {args.limit}')
+        timed('like', like_search, queries, args.limit)
+        for name in ('memory', 'sqlite'):
+            backend = BACKENDS[name]()
+            started = time.perf_counter()
+            backend.rebuild()
+            print(f'{name} index built in {time.perf_counter() - started:.2f}s')
+            timed(name, backend.search, queries, args.limit)
+
+
+if __name__ == '__main__':
+    main()
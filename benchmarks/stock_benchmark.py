@@ -0,0 +1,85 @@
+""" Hammers one product with concurrent orders and reports orders/sec.
+
+Checks that exactly --stock orders succeed (no overselling) at every
+thread count, in plain row mode and in sharded stock mode.
+
+Usage: python benchmarks/stock_benchmark.py [--threads 1 8 64] [--stock 2000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+
+from config import TestingConfig
+from app import create_app, db
+from app.inventory import available_stock, split_stock
+from app.models import Order, Product, User
+
+
+def run(threads, shards, stock, attempts):
+    path = os.path.join(tempfile.mkdtemp(), 'stock.db')
+
+    class BenchmarkConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 60}}
+        STOCK_SHARDS = shards
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        user = User(username='buyer', email='buyer@test.com', password_hash='unused')
+        product = Product(name='Flash Sale', price=1.0, stock=stock)
+        db.session.add_all([user, product])
+        db.session.commit()
+        if shards:
+            split_stock(product.id, shards)
+        product_id = product.id
+        token = create_access_token(identity=user.id)
+
+    headers = {'Authorization': f'Bearer {token}'}
+    body = {'product_id': product_id, 'quantity': 1}
+
+    def place_order(_):
+        return app.test_client().post('/orders', json=body, headers=headers).status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(place_order, range(attempts)))
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        remaining = available_stock(product_id)
+        orders = Order.query.count()
+        db.engine.dispose()
+    ok = statuses.count(201) == orders == stock and remaining == 0
+    mode = f'sharded x{shards}' if shards else 'row'
+    print(f'{mode:<11} {threads:>3} threads: {attempts / elapsed:8.1f} requests/s, '
+          f'{orders / elapsed:8.1f} orders/s, {statuses.count(201)} placed, '
+          f'stock left {remaining} {"OK" if ok else "OVERSOLD/LOST"}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--stock', type=int, default=1000)
+    parser.add_argument('--attempts', type=int, default=1200)
+    args = parser.parse_args()
+
+    ok = True
+    for shards in (0, args.shards):
+        for threads in args.threads:
+            ok &= run(threads, shards, args.stock, args.attempts)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
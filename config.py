@@ -11,10 +11,84 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Pool settings, applied to MySQL engines (SQLite keeps its own pools).
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    # Comma-separated read replica URLs for the @read_replica handlers.
+    DATABASE_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                             if url]
+    DB_REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
-    JWT_ACCESS_TOKEN_EXPIRES = 3600
+    # Access tokens carry role claims, so keep them short-lived and let
+    # clients pick up role changes through /users/refresh.
+    JWT_ACCESS_TOKEN_EXPIRES = int(os.environ.get('JWT_ACCESS_TOKEN_EXPIRES', 900))
+    JWT_REFRESH_TOKEN_EXPIRES = int(os.environ.get('JWT_REFRESH_TOKEN_EXPIRES', 30 * 24 * 3600))
+    JWT_BLOCKLIST_REFRESH_SECONDS = int(os.environ.get('JWT_BLOCKLIST_REFRESH_SECONDS', 5))
+    JWT_BLOCKLIST_PURGE_SECONDS = int(os.environ.get('JWT_BLOCKLIST_PURGE_SECONDS', 600))
+    JWT_BLOCKLIST_BLOOM_CAPACITY = int(os.environ.get('JWT_BLOCKLIST_BLOOM_CAPACITY', 0))
     UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
 
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 16))
+    PASSWORD_HASH_TIMEOUT = int(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+    PAGE_SIZE_DEFAULT = int(os.environ.get('PAGE_SIZE_DEFAULT', 50))
+    PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', 200))
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'mysql')
+    ORDER_MAX_ITEMS = int(os.environ.get('ORDER_MAX_ITEMS', 100))
+    # Commit orders in batches on a writer thread instead of one per request.
+    ORDER_GROUP_COMMIT = os.environ.get('ORDER_GROUP_COMMIT', '0') == '1'
+    ORDER_GROUP_COMMIT_SIZE = int(os.environ.get('ORDER_GROUP_COMMIT_SIZE', 50))
+    ORDER_GROUP_COMMIT_WAIT_MS = int(os.environ.get('ORDER_GROUP_COMMIT_WAIT_MS', 0))
+    ORDER_GROUP_COMMIT_TIMEOUT = int(os.environ.get('ORDER_GROUP_COMMIT_TIMEOUT', 10))
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+    IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', 1000))
+    # 0 keeps all stock on products.stock; >0 enables sharded stock counters.
+    STOCK_SHARDS = int(os.environ.get('STOCK_SHARDS', 0))
+    # Longest a notifications long-poll may wait, and how often it re-queries
+    # for notifications committed by other processes.
+    NOTIFICATIONS_POLL_TIMEOUT = int(os.environ.get('NOTIFICATIONS_POLL_TIMEOUT', 25))
+    NOTIFICATIONS_POLL_RECHECK = int(os.environ.get('NOTIFICATIONS_POLL_RECHECK', 5))
+    # Carts live in CART_STORE and are written to the database every
+    # CART_FLUSH_INTERVAL seconds (0 writes through on every change).
+    CART_STORE = 'local'
+    CART_TTL = int(os.environ.get('CART_TTL', 7 * 24 * 3600))
+    CART_FLUSH_INTERVAL = int(os.environ.get('CART_FLUSH_INTERVAL', 5))
+    CART_PRICE_TTL = int(os.environ.get('CART_PRICE_TTL', 60))
+    # Days deleted catalog rows stay in GET /products/changes ('flask changes prune').
+    CHANGES_TOMBSTONE_DAYS = int(os.environ.get('CHANGES_TOMBSTONE_DAYS', 30))
+    CACHE_BACKEND = 'local'
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 2048))
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))
+    # Seconds a coalesced request waits for the identical one in flight.
+    SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', 5))
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    # Bearer token for scraping /metrics; without it only admin JWTs may read them.
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # A request running one statement this many times is logged as an N+1.
+    METRICS_N_PLUS_ONE_THRESHOLD = int(os.environ.get('METRICS_N_PLUS_ONE_THRESHOLD', 10))
+    # Responses to requests with an Idempotency-Key are replayed for
+    # IDEMPOTENCY_TTL seconds, or until IDEMPOTENCY_MAX_ENTRIES newer keys
+    # evict them; duplicates wait up to IDEMPOTENCY_WAIT_TIMEOUT seconds for
+    # the original to finish.
+    IDEMPOTENCY_STORE = 'local'
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+    IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000))
+    IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', 10))
+    # Per-endpoint limits, 'scope:algorithm:count/seconds' (see app/ratelimit.py).
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    RATE_LIMIT_BACKEND = 'local'
+    RATE_LIMITS = {
+        'auth.login': ['ip:bucket:20/60', 'account:window:10/300'],
+        'auth.register': ['ip:bucket:5/60', 'ip:window:20/3600'],
+        'auth.reset_password': ['ip:bucket:5/60', 'account:window:3/3600'],
+    }
+
 
     MYSQL_HOST = os.environ.get('MYSQL_HOST')
     MYSQL_USER = os.environ.get('MYSQL_USER')
@@ -24,3 +98,7 @@ class Config:
 class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL')
     SQLALCHEMY_DATABASE_NAME = 'test_database'
+    SEARCH_BACKEND = os.environ.get('TEST_SEARCH_BACKEND', 'memory')
+    DATABASE_REPLICA_URLS = []
+    BCRYPT_LOG_ROUNDS = 4
+    CART_FLUSH_INTERVAL = 0
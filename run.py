@@ -1,7 +1,8 @@
-""" This module includes logic to create the tables. """
+""" This module runs the app after bringing the schema up to date. """
 
-from app import create_app, db
-from app.models import user, product, order
+from app import create_app
+from app.migrations import upgrade
+from config import TestingConfig
 import os
 
 
@@ -12,7 +13,7 @@ else:
     app = create_app()
 
 with app.app_context():
-        db.create_all()
+    upgrade()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+""" Prints the query plan of every query the API routes run.
+
+Run it against a copy of production (or a seeded database) after schema or
+query changes and look for full table scans and temporary sorts.
+
+Usage: python scripts/explain_queries.py [--database sqlite:///catalog.db]
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import and_, or_, select
+
+from config import Config
+from app import create_app, db
+from app.migrations import upgrade
+from app.models import Category, Order, OrderItem, Product, TokenBlacklist, User
+
+NOW = datetime(2024, 1, 1)
+
+
+def route_queries():
+    """ (route, statement) pairs mirroring the queries in app/routes """
+    return [
+        ('GET /products', select(Product).order_by(Product.id).limit(51)),
+        ('GET /products?cursor', select(Product).where(Product.id > 1000)
+            .order_by(Product.id).limit(51)),
+        ('GET /products?sort=-price&cursor', select(Product).where(or_(
+            Product.price < 10.0, and_(Product.price == 10.0, Product.id < 1000)))
+            .order_by(Product.price.desc(), Product.id.desc()).limit(51)),
+        ('GET /products/<id>', select(Product).where(Product.id == 1)),
+        ('GET /products/search (hydrate)', select(Product).where(Product.id.in_([1, 2, 3]))),
+        ('GET /products/categories', select(Category)),
+        ('GET /products/category/<id>', select(Product).where(Product.category_id == 1)
+            .order_by(Product.id).limit(51)),
+        ('GET /products/category/<id>?cursor', select(Product).where(
+            Product.category_id == 1, Product.id > 1000).order_by(Product.id).limit(51)),
+        ('POST /orders (products)', select(Product).where(Product.id.in_([1, 2, 3]))),
+        ('GET /orders (admin)', select(Order).order_by(
+            Order.date_ordered.desc(), Order.id.desc()).limit(51)),
+        ('GET /orders (user)', select(Order).where(Order.user_id == 1).order_by(
+            Order.date_ordered.desc(), Order.id.desc()).limit(51)),
+        ('GET /orders?status', select(Order).where(Order.status == 'Pending').order_by(
+            Order.date_ordered.desc(), Order.id.desc()).limit(51)),
+        ('GET /orders (items)', select(OrderItem).where(OrderItem.order_id.in_([1, 2, 3]))),
+        ('GET /orders/history/<user_id>', select(Order).where(
+            Order.user_id == 1, Order.date_ordered < NOW).order_by(
+            Order.date_ordered.desc(), Order.id.desc()).limit(51)),
+        ('POST /users/login', select(User).where(User.email == 'user@example.com')),
+        ('POST /users/register', select(User).where(User.username == 'user')),
+        ('JWT blocklist refresh', select(TokenBlacklist.jti).where(
+            TokenBlacklist.created_at >= NOW)),
+    ]
+
+
+def explain(connection, statement):
+    sql = str(statement.compile(dialect=connection.dialect,
+                                compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.dialect.name == 'sqlite' else 'EXPLAIN '
+    result = connection.exec_driver_sql(prefix + sql)
+    return list(result.keys()), result.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='database URL, defaults to DATABASE_URL')
+    args = parser.parse_args()
+
+    class ExplainConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database or Config.SQLALCHEMY_DATABASE_URI
+
+    app = create_app(ExplainConfig)
+    with app.app_context():
+        upgrade()
+        with db.engine.connect() as connection:
+            for route, statement in route_queries():
+                columns, rows = explain(connection, statement)
+                print(f'== {route}')
+                for row in rows:
+                    print('   ' + ' | '.join(f'{c}={v}' for c, v in zip(columns, row)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+""" This module tests the cart endpoints and their write-behind store """
+
+import unittest
+
+from flask_jwt_extended import create_access_token
+
+from config import TestingConfig
+from app import create_app, db
+from app.carts import CartFlusher, flush_carts, get_cart_store, load_cart
+from app.models import Cart, CartItem, Product, User
+
+
+class TestCarts(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config_class=TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='user', email='user@test.com', password_hash='unused')
+        self.other = User(username='other', email='other@test.com', password_hash='unused')
+        self.lamp = Product(name='Lamp', price=10.0, stock=5)
+        self.chair = Product(name='Chair', price=2.5, stock=5)
+        db.session.add_all([self.user, self.other, self.lamp, self.chair])
+        db.session.commit()
+        self.headers = {'Authorization': f'Bearer {create_access_token(identity=self.user.id)}'}
+        self.path = f'/carts/{self.user.id}'
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _add(self, product_id, quantity=1):
+        return self.client.post(f'{self.path}/items', headers=self.headers,
+                                json={'product_id': product_id, 'quantity': quantity})
+
+    def test_totals_follow_item_changes(self):
+        self._add(self.lamp.id, 2)
+        response = self._add(self.chair.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['item_count'], 3)
+        self.assertEqual(response.get_json()['subtotal'], 22.5)
+
+        response = self._add(self.lamp.id)
+        self.assertEqual(response.get_json()['subtotal'], 32.5)
+        response = self.client.put(f'{self.path}/items/{self.chair.id}', headers=self.headers,
+                                   json={'quantity': 4})
+        self.assertEqual(response.get_json()['subtotal'], 40.0)
+        response = self.client.patch(f'{self.path}/{self.chair.id}', headers=self.headers,
+                                     json={'quantity': 2})
+        self.assertEqual(response.get_json()['item_count'], 5)
+
+        response = self.client.delete(f'{self.path}/items/{self.lamp.id}', headers=self.headers)
+        self.assertEqual(response.get_json(), {
+            'user_id': self.user.id, 'item_count': 2, 'subtotal': 5.0,
+            'items': [{'product_id': self.chair.id, 'name': 'Chair', 'quantity': 2,
+                       'unit_price': 2.5, 'line_total': 5.0}]})
+
+        response = self.client.get(f'{self.path}/{self.chair.id}', headers=self.headers)
+        self.assertEqual(response.get_json()['quantity'], 2)
+        response = self.client.get(f'{self.path}/{self.lamp.id}', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_validation_and_access(self):
+        self.assertEqual(self._add(999).status_code, 404)
+        self.assertEqual(self._add(self.lamp.id, 0).status_code, 400)
+        response = self.client.put(f'{self.path}/items/{self.lamp.id}', headers=self.headers,
+                                   json={'quantity': 1})
+        self.assertEqual(response.status_code, 404)
+        other = {'Authorization': f'Bearer {create_access_token(identity=self.other.id)}'}
+        self.assertEqual(self.client.get(self.path, headers=other).status_code, 403)
+
+    def test_cart_survives_the_store_and_reprices(self):
+        self._add(self.lamp.id, 2)
+        self.assertEqual(db.session.get(Cart, self.user.id).subtotal, 20.0)
+
+        # A new process: empty store, cart comes back from the database and
+        # picks up the current price.
+        self.app.extensions['cart_store'] = type(get_cart_store())()
+        self.lamp.price = 12.0
+        db.session.commit()
+        response = self.client.get(self.path, headers=self.headers)
+        self.assertEqual(response.get_json()['subtotal'], 24.0)
+        self.assertEqual(response.get_json()['items'][0]['name'], 'Lamp')
+
+        self.client.delete(f'{self.path}/items/{self.lamp.id}', headers=self.headers)
+        self.assertIsNone(db.session.get(Cart, self.user.id))
+        self.assertEqual(CartItem.query.count(), 0)
+
+    def test_write_behind_batches_changes(self):
+        store = get_cart_store()
+        self.app.extensions['cart_flusher'] = CartFlusher(self.app, store, interval=3600)
+        self.app.extensions['cart_flusher']._thread = object()  # never start it
+        self._add(self.lamp.id)
+        self._add(self.chair.id, 3)
+        self.assertEqual(Cart.query.count(), 0)
+
+        self.assertEqual(flush_carts(store), 1)
+        db.session.expire_all()
+        cart = db.session.get(Cart, self.user.id)
+        self.assertEqual((cart.item_count, cart.subtotal), (4, 17.5))
+        self.assertEqual(len(cart.items), 2)
+        self.assertEqual(flush_carts(store), 0)
+
+    def test_one_bad_cart_does_not_block_the_others(self):
+        store = get_cart_store()
+        self.app.extensions['cart_flusher'] = CartFlusher(self.app, store, interval=3600)
+        self.app.extensions['cart_flusher']._thread = object()  # never start it
+        user_id, other_id, lamp_id = self.user.id, self.other.id, self.lamp.id
+        self._add(lamp_id)
+        other = {'Authorization': f'Bearer {create_access_token(identity=other_id)}'}
+        self.client.post(f'/carts/{other_id}/items', headers=other,
+                         json={'product_id': self.chair.id, 'quantity': 2})
+        # A line whose product was deleted after it was added.
+        store.mutate(user_id, lambda cart: cart.set_line(999, 1, 1.0, 'Gone'), load_cart)
+
+        self._foreign_keys('ON')
+        try:
+            self.assertEqual(flush_carts(store), 2)
+        finally:
+            self._foreign_keys('OFF')
+        self.assertEqual([item.product_id for item in db.session.get(Cart, user_id).items],
+                         [lamp_id])
+        self.assertEqual(db.session.get(Cart, other_id).item_count, 2)
+        self.assertNotIn(999, store.get(user_id).lines)
+        self.assertEqual(flush_carts(store), 0)
+
+    def _foreign_keys(self, state):
+        """ SQLite only enforces foreign keys when asked to """
+        if db.engine.dialect.name == 'sqlite':
+            db.session.remove()
+            with db.engine.connect() as connection:
+                connection.exec_driver_sql(f'PRAGMA foreign_keys={state}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+""" This module tests catalog change versions and GET /products/changes """
+
+import io
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from flask_jwt_extended import create_access_token
+
+from config import TestingConfig
+from app import create_app, db
+from app.changes import decode_sync_token, prune_tombstones
+from app.db_routing import get_replica_engines
+from app.models import Category, ChangeSequence, ChangeTombstone, Product, User
+
+
+class TestChanges(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config_class=TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        admin = User(username='admin', email='admin@test.com', password_hash='unused',
+                     is_admin=True)
+        self.category = Category(name='Lighting')
+        db.session.add_all([admin, self.category])
+        db.session.commit()
+        self.admin = {'Authorization': f'Bearer {create_access_token(identity=admin.id)}'}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _create(self, name):
+        response = self.client.post('/products', headers=self.admin,
+                                    json={'name': name, 'price': 10.0})
+        return response.get_json()['id']
+
+    def _sync(self, since=None, limit=50):
+        """ Follows next_cursor to the end; returns (items, sync_token) """
+        items, args = [], {'limit': limit}
+        if since:
+            args['since'] = since
+        while True:
+            page = self.client.get('/products/changes', query_string=args).get_json()
+            items += page['items']
+            if not page['next_cursor']:
+                return items, page['sync_token']
+            args = {'limit': limit, 'cursor': page['next_cursor']}
+
+    def test_full_then_incremental_sync(self):
+        lamp, chair, desk = (self._create(name) for name in ('Lamp', 'Chair', 'Desk'))
+        items, token = self._sync(limit=2)
+        self.assertEqual([(item['entity'], item['id']) for item in items],
+                         [('category', self.category.id), ('product', lamp),
+                          ('product', chair), ('product', desk)])
+        self.assertEqual(self._sync(since=token), ([], token))
+
+        self.client.put(f'/products/{chair}', headers=self.admin, json={'price': 12.0})
+        self.client.delete(f'/products/{lamp}', headers=self.admin)
+        shelf = self._create('Shelf')
+        items, new_token = self._sync(since=token, limit=1)
+        self.assertEqual([(item['op'], item['id']) for item in items],
+                         [('upsert', chair), ('delete', lamp), ('upsert', shelf)])
+        self.assertEqual(items[0]['data']['price'], 12.0)
+        self.assertNotEqual(new_token, token)
+
+        # Stock is not a catalog change.
+        self.client.put(f'/products/{desk}', headers=self.admin, json={'stock': 3})
+        self.assertEqual(self._sync(since=new_token), ([], new_token))
+
+    def test_imports_are_versioned(self):
+        lamp = self._create('Lamp')
+        _, token = self._sync()
+        body = f'id,name,price\n{lamp},Lamp,15.0\n,Rug,30.0\n'
+        self.client.post('/products/import?format=csv', headers=self.admin,
+                         data=io.BytesIO(body.encode()), content_type='text/csv')
+        items, _ = self._sync(since=token)
+        self.assertEqual([item['data']['name'] for item in items], ['Lamp', 'Rug'])
+        self.assertEqual(items[0]['version'], items[1]['version'])
+
+    def test_bad_and_expired_tokens(self):
+        self.assertEqual(self.client.get('/products/changes?since=junk').status_code, 400)
+        self.assertEqual(self.client.get('/products/changes?cursor=junk').status_code, 400)
+
+        lamp = self._create('Lamp')
+        _, token = self._sync()
+        self.client.delete(f'/products/{lamp}', headers=self.admin)
+        self._create('Chair')
+        ChangeTombstone.query.update({'deleted_at': datetime.utcnow() - timedelta(days=40)})
+        db.session.commit()
+        self.assertEqual(prune_tombstones(30), 1)
+        self.assertEqual(self.client.get(f'/products/changes?since={token}').status_code, 410)
+        _, fresh = self._sync()
+        self.assertEqual(self.client.get(f'/products/changes?since={fresh}').status_code, 200)
+
+
+class TestChangesOnReplicas(unittest.TestCase):
+    """ Syncing against replicas with different lag never skips a change """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        paths = [os.path.join(self.directory.name, f'{name}.db')
+                 for name in ('primary', 'current', 'lagging')]
+
+        class ReplicaConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{paths[0]}'
+            DATABASE_REPLICA_URLS = [f'sqlite:///{path}' for path in paths[1:]]
+
+        self.app = create_app(config_class=ReplicaConfig)
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+            admin = User(username='admin', email='admin@test.com', password_hash='unused',
+                         is_admin=True)
+            db.session.add(admin)
+            db.session.commit()
+            headers = {'Authorization': f'Bearer {create_access_token(identity=admin.id)}'}
+            for name in ('Lamp', 'Chair'):
+                self.client.post('/products', headers=headers,
+                                 json={'name': name, 'price': 10.0})
+            products = [row._asdict() for row in db.session.execute(
+                db.select(Product.__table__).order_by(Product.id))]
+            sequences = [row._asdict() for row in db.session.execute(
+                db.select(ChangeSequence.__table__))]
+            self.versions = {row['id']: row['change_version'] for row in products}
+            # One replica is current, the other has not seen the Chair yet.
+            current, lagging = get_replica_engines()
+            for engine, lag in ((current, 0), (lagging, 1)):
+                db.metadata.create_all(engine)
+                with engine.begin() as connection:
+                    connection.execute(Product.__table__.insert(), products[:len(products) - lag])
+                    connection.execute(ChangeSequence.__table__.insert(), [
+                        dict(row, value=row['value'] - lag) for row in sequences])
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            for engine in [db.engine, *get_replica_engines()]:
+                engine.dispose()
+        self.directory.cleanup()
+
+    def test_sync_token_covers_every_returned_version(self):
+        for skip in range(2):
+            # Start the round-robin on each replica in turn.
+            for _ in range(skip):
+                self.client.get('/products/changes')
+            seen, args = set(), {'limit': 1}
+            while True:
+                page = self.client.get('/products/changes', query_string=args).get_json()
+                seen.update(item['id'] for item in page['items'])
+                if not page['next_cursor']:
+                    break
+                args = {'limit': 1, 'cursor': page['next_cursor']}
+            with self.app.app_context():
+                synced = decode_sync_token(page['sync_token'])
+            self.assertEqual(seen, {product_id for product_id, version in self.versions.items()
+                                    if version <= synced})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+""" This module tests the export endpoints """
+
+import csv
+import io
+import unittest
+from datetime import datetime
+from flask import json
+from config import TestingConfig
+from flask_jwt_extended import create_access_token
+from app import create_app, db
+from app.inventory import split_stock
+from app.models.user import User
+from app.models.product import Product
+from app.models.order import Order
+from app.models.order_item import OrderItem
+
+
+class TestExportEndpoints(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config_class=TestingConfig)
+        self.app.config['EXPORT_BATCH_SIZE'] = 2
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.admin_user = User(username='admin', email='admin@test.com', is_admin=True)
+        self.admin_user.set_password('adminpass')
+        self.regular_user = User(username='user', email='user@test.com', is_admin=False)
+        self.regular_user.set_password('userpass')
+        product = Product(name='Test, "quoted" Product', price=10.0, stock=5)
+        db.session.add_all([self.admin_user, self.regular_user, product])
+        db.session.commit()
+        db.session.add_all([Order(user_id=self.regular_user.id, product_id=product.id,
+                                  quantity=1, total_price=10.0,
+                                  status='Shipped' if i % 2 else 'Pending',
+                                  date_ordered=datetime(2024, 1, i + 1))
+                            for i in range(5)])
+        db.session.commit()
+
+        admin_token = create_access_token(identity=self.admin_user.id)
+        user_token = create_access_token(identity=self.regular_user.id)
+        self.admin_headers = {'Authorization': f'Bearer {admin_token}'}
+        self.user_headers = {'Authorization': f'Bearer {user_token}'}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_export_orders_ndjson(self):
+        response = self.client.get('/exports/orders', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], sorted(row['id'] for row in rows))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['date_ordered'], '2024-01-01T00:00:00')
+
+    def test_export_orders_filters(self):
+        url = '/exports/orders?status=Shipped&from=2024-01-02&to=2024-01-04'
+        response = self.client.get(url, headers=self.admin_headers)
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['status'], 'Shipped')
+
+        response = self.client.get('/exports/orders?from=soon', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_order_items(self):
+        product_id = Product.query.first().id
+        order = Order(user_id=self.regular_user.id, quantity=3, total_price=25.0,
+                      status='Pending', date_ordered=datetime(2024, 2, 1))
+        db.session.add(order)
+        db.session.flush()
+        db.session.add_all([
+            OrderItem(order_id=order.id, product_id=product_id, quantity=1, unit_price=5.0),
+            OrderItem(order_id=order.id, product_id=product_id, quantity=2, unit_price=10.0)])
+        db.session.commit()
+
+        response = self.client.get('/exports/order-items?from=2024-01-05',
+                                   headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        # The order without item rows exports its single line from the order.
+        self.assertEqual([(row['order_id'], row['product_id'], row['quantity'], row['unit_price'])
+                          for row in rows],
+                         [(order.id - 1, product_id, 1, 10.0),
+                          (order.id, product_id, 1, 5.0), (order.id, product_id, 2, 10.0)])
+        self.assertEqual(rows[-1]['status'], 'Pending')
+
+    def test_export_products_csv(self):
+        response = self.client.get('/exports/products?format=csv', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(io.StringIO(response.data.decode())))
+        self.assertEqual(rows[0][:2], ['id', 'name'])
+        self.assertEqual(rows[1][1], 'Test, "quoted" Product')
+
+    def test_export_products_reports_sharded_stock(self):
+        split_stock(Product.query.first().id, 2)
+        response = self.client.get('/exports/products', headers=self.admin_headers)
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(rows[0]['stock'], 5)
+
+    def test_export_requires_admin(self):
+        response = self.client.get('/exports/orders', headers=self.user_headers)
+        self.assertEqual(response.status_code, 403)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+""" This module tests sparse fieldsets (?fields=) on list routes """
+
+import unittest
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from config import TestingConfig
+from app import create_app, db
+from app.fields import ORDER_FIELDS, PRODUCT_FIELDS
+from app.models import Category, Order, OrderItem, Product, User
+
+
+class TestFields(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config_class=TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='user', email='user@test.com', password_hash='unused')
+        self.category = Category(name='Lighting')
+        db.session.add_all([self.user, self.category])
+        db.session.flush()
+        self.products = [Product(name=f'Lamp {n}', price=10.0 + n, stock=1,
+                                 description='x' * 1000, image_path=f'/img/{n}.jpg',
+                                 category_id=self.category.id) for n in range(3)]
+        db.session.add_all(self.products)
+        db.session.flush()
+        order = Order(user_id=self.user.id, quantity=2, total_price=20.0)
+        legacy = Order(user_id=self.user.id, product_id=self.products[0].id, quantity=1,
+                       total_price=10.0)
+        db.session.add_all([order, legacy])
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, product_id=self.products[1].id,
+                                 quantity=2, unit_price=10.0))
+        db.session.commit()
+        self.headers = {'Authorization': f'Bearer {create_access_token(identity=self.user.id)}'}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _statements(self, path, **kwargs):
+        statements = []
+
+        def listener(*args):
+            statements.append(args[2])
+
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = self.client.get(path, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return response, statements
+
+    def test_product_lists_select_only_the_requested_columns(self):
+        response, statements = self._statements('/products?fields=name,image_path&sort=-price')
+        items = response.get_json()['items']
+        self.assertEqual(items[0], {'id': self.products[2].id, 'name': 'Lamp 2',
+                                    'image_path': '/img/2.jpg'})
+        self.assertNotIn('description', statements[0])
+
+        response = self.client.get(
+            f'/products/category/{self.category.id}?fields=price&limit=2')
+        page = response.get_json()
+        self.assertEqual([item['price'] for item in page['items']], [10.0, 11.0])
+        response = self.client.get(
+            f"/products/category/{self.category.id}?fields=price&cursor={page['next_cursor']}")
+        self.assertEqual([item['price'] for item in response.get_json()['items']], [12.0])
+
+        response = self.client.get('/products?fields=name,secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', response.get_json()['error'])
+
+    def test_all_fields_match_to_dict(self):
+        names = [name for name in PRODUCT_FIELDS.fields if name != 'image_path']
+        response = self.client.get(f"/products?fields={','.join(names)}")
+        self.assertEqual(response.get_json()['items'],
+                         self.client.get('/products').get_json()['items'])
+
+        names = [name for name in ORDER_FIELDS.fields if name != 'date_ordered']
+        response = self.client.get(f"/orders?fields={','.join(names)}", headers=self.headers)
+        self.assertEqual(response.get_json()['items'],
+                         self.client.get('/orders', headers=self.headers).get_json()['items'])
+
+    def test_order_lists(self):
+        path = f'/orders/history/{self.user.id}?fields=status,items'
+        response, statements = self._statements(path, headers=self.headers)
+        items = response.get_json()['items']
+        self.assertEqual(set(items[0]), {'id', 'status', 'items'})
+        self.assertEqual(sorted(len(item['items']) for item in items), [1, 1])
+        self.assertEqual(len([s for s in statements if 'order_items' in s]), 1)
+
+        response = self.client.get('/orders?fields=date_ordered', headers=self.headers)
+        self.assertIn('date_ordered', response.get_json()['items'][0])
+        response = self.client.get('/orders?fields=nope', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+""" This module tests Idempotency-Key handling on write endpoints """
+
+import threading
+import unittest
+from concurrent.futures import Future
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from config import TestingConfig
+from app import create_app, db
+from app.idempotency import LocalIdempotencyStore
+from app.models import Order, Product, User
+from app.order_writer import OrderWriterBusy
+
+
+class TestIdempotency(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config_class=TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='user', email='user@test.com', password_hash='unused')
+        self.other = User(username='other', email='other@test.com', password_hash='unused')
+        self.product = Product(name='Lamp', price=10.0, stock=10)
+        db.session.add_all([self.user, self.other, self.product])
+        db.session.commit()
+        self.token = create_access_token(identity=self.user.id)
+        self.product_id = self.product.id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _order(self, key, quantity=1, token=None):
+        headers = {'Authorization': f'Bearer {token or self.token}'}
+        if key is not None:
+            headers['Idempotency-Key'] = key
+        return self.client.post('/orders', headers=headers,
+                                json={'product_id': self.product_id, 'quantity': quantity})
+
+    def test_retry_replays_the_first_response(self):
+        first = self._order('key-1')
+        self.assertEqual(first.status_code, 201)
+        statements = []
+
+        def listener(*args):
+            statements.append(args[2])
+
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            retry = self._order('key-1')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(statements, [])
+        self.assertEqual(Order.query.count(), 1)
+
+        self.assertEqual(self._order('key-2').status_code, 201)
+        self.assertEqual(self._order(None).status_code, 201)
+        self.assertEqual(Order.query.count(), 3)
+
+    def test_keys_are_scoped_and_bound_to_the_body(self):
+        self._order('key-1')
+        self.assertEqual(self._order('key-1', quantity=2).status_code, 422)
+        other = create_access_token(identity=self.other.id)
+        self.assertEqual(self._order('key-1', token=other).status_code, 201)
+        self.assertEqual(Order.query.count(), 2)
+        self.assertEqual(self._order('x' * 256).status_code, 400)
+
+    def test_failed_requests_can_be_retried(self):
+        self.product.stock = 0
+        db.session.commit()
+        self.assertEqual(self._order('key-1').status_code, 409)
+
+        self.product.stock = 5
+        db.session.commit()
+        self.assertEqual(self._order('key-1').status_code, 409)
+        self.assertEqual(self._order('key-2').status_code, 201)
+
+    def test_timed_out_orders_settle_the_key_later(self):
+        writer = BusyWriter()
+        self.app.extensions['order_writer'] = writer
+        self.assertEqual(self._order('key-1').status_code, 503)
+        # Still in flight: the retry waits and then reports it as in progress.
+        self.app.config['IDEMPOTENCY_WAIT_TIMEOUT'] = 0
+        self.assertEqual(self._order('key-1').status_code, 409)
+
+        writer.future.set_result({'id': 42})
+        retry = self._order('key-1')
+        self.assertEqual((retry.status_code, retry.get_json()), (201, {'id': 42}))
+
+        self.assertEqual(self._order('key-2').status_code, 503)
+        writer.future.set_exception(RuntimeError('lost'))
+        self.assertEqual(self._order('key-2').status_code, 503)
+
+    def test_concurrent_duplicates_wait_for_the_original(self):
+        store = LocalIdempotencyStore(ttl=60)
+        self.assertIsNone(store.begin('key', 'print', timeout=1))
+        results = []
+        waiter = threading.Thread(
+            target=lambda: results.append(store.begin('key', 'print', timeout=5)))
+        waiter.start()
+        store.complete('key', (b'{}', 201, []))
+        waiter.join()
+        self.assertEqual(results[0].response, (b'{}', 201, []))
+
+        self.assertIsNone(store.begin('slow', 'print', timeout=1))
+        self.assertIsNone(store.begin('slow', 'print', timeout=0).response)
+        store.release('slow')
+        self.assertIsNone(store.begin('slow', 'print', timeout=0))
+
+    def test_records_expire(self):
+        store = LocalIdempotencyStore(ttl=0)
+        store.begin('key', 'print', timeout=0)
+        store.complete('key', (b'{}', 201, []))
+        self.assertIsNone(store.begin('key', 'print', timeout=0))
+        self.assertEqual(len(store), 1)
+
+    def test_oldest_records_are_evicted_past_max_entries(self):
+        store = LocalIdempotencyStore(ttl=60, max_entries=2)
+        for key in ('first', 'second', 'third'):
+            store.begin(key, 'print', timeout=0)
+            store.complete(key, (b'{}', 201, []))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.evictions, 1)
+        self.assertIsNone(store.begin('first', 'print', timeout=0))
+        self.assertIsNotNone(store.begin('third', 'print', timeout=0).response)
+
+    def test_in_flight_records_are_not_evicted(self):
+        store = LocalIdempotencyStore(ttl=60, max_entries=1)
+        store.begin('running', 'print', timeout=0)
+        store.begin('done', 'print', timeout=0)
+        store.complete('done', (b'{}', 201, []))
+        store.begin('next', 'print', timeout=0)
+        self.assertEqual(store.evictions, 1)
+        # The retry of the running request waits for it instead of running again.
+        self.assertIsNone(store.begin('running', 'print', timeout=0).response)
+        self.assertIsNone(store.begin('done', 'print', timeout=0))
+
+
+class BusyWriter:
+    """ An order writer whose orders always outlive the request """
+
+    def submit(self, user_id, items):
+        self.future = Future()
+        raise OrderWriterBusy('Order was not committed in time', self.future)
+
+
+if __name__ == '__main__':
+    unittest.main()
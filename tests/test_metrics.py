@@ -0,0 +1,83 @@
+import unittest
+
+from flask_jwt_extended import create_access_token
+
+from config import TestingConfig
+from app import create_app, db
+from app.models import Product
+
+
+class TestMetrics(unittest.TestCase):
+    """ Request latency, SQL counters and the /metrics endpoint """
+
+    def setUp(self):
+        class MetricsConfig(TestingConfig):
+            METRICS_N_PLUS_ONE_THRESHOLD = 3
+            METRICS_TOKEN = 'scrape-secret'
+
+        self.app = create_app(config_class=MetricsConfig)
+
+        @self.app.route('/test/n-plus-one')
+        def n_plus_one():
+            for product_id in range(1, 4):
+                db.session.get(Product, product_id)
+            return 'ok'
+
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add(Product(id=1, name='Lamp', price=5.0, stock=1))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _scrape(self):
+        response = self.client.get('/metrics',
+                                   headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        return response.get_data(as_text=True).splitlines()
+
+    def test_latency_and_statement_counts(self):
+        self.client.get('/products/1')
+        self.client.get('/products/1')
+        self.client.get('/products/404')
+        lines = self._scrape()
+
+        self.assertIn('# TYPE http_request_duration_seconds histogram', lines)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{endpoint="products.get_product",method="GET"} 3', lines)
+        self.assertIn('http_request_duration_seconds_bucket'
+                      '{endpoint="products.get_product",method="GET",le="+Inf"} 3', lines)
+        self.assertIn('http_requests_total'
+                      '{endpoint="products.get_product",method="GET",status="404"} 1', lines)
+        # Two cache misses ran one SELECT each; the cache hit ran none.
+        self.assertIn('db_statements_per_request_sum{endpoint="products.get_product"} 2', lines)
+        self.assertIn('response_cache_hits_total 1', lines)
+        self.assertFalse(any(line.startswith('http_requests_total{endpoint="metrics"')
+                             for line in lines))
+
+    def test_n_plus_one_is_flagged(self):
+        with self.assertLogs(self.app.logger, level='WARNING') as logs:
+            self.client.get('/test/n-plus-one')
+        self.assertIn('Suspected N+1 in n_plus_one', logs.output[0])
+        self.assertIn('db_n_plus_one_suspected_total{endpoint="n_plus_one"} 1', self._scrape())
+
+    def test_metrics_require_the_token_or_an_admin(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 401)
+        user_token = create_access_token(identity=1, additional_claims={'is_admin': False})
+        response = self.client.get('/metrics', headers={'Authorization': f'Bearer {user_token}'})
+        self.assertEqual(response.status_code, 403)
+        admin_token = create_access_token(identity=1, additional_claims={'is_admin': True})
+        response = self.client.get('/metrics', headers={'Authorization': f'Bearer {admin_token}'})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+""" This module tests the schema migrations """
+
+import unittest
+from sqlalchemy import inspect, text
+from config import TestingConfig
+from app import create_app, db
+from app.migrations import MIGRATIONS, current_version, upgrade
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config_class=TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('DROP TABLE IF EXISTS schema_version')
+        self.app_context.pop()
+
+    def test_upgrade_is_versioned_and_idempotent(self):
+        applied = upgrade()
+        self.assertEqual(applied, [version for version, _, _ in MIGRATIONS])
+        with db.engine.begin() as connection:
+            self.assertEqual(current_version(connection), MIGRATIONS[-1][0])
+        self.assertEqual(upgrade(), [])
+
+        inspector = inspect(db.engine)
+        self.assertIn('order_items', inspector.get_table_names())
+        indexes = {index['name'] for index in inspector.get_indexes('orders')}
+        self.assertIn('ix_orders_user_id_date_ordered', indexes)
+
+    def test_upgrade_from_baseline_schema(self):
+        # The tables as the first release created them, before any migration.
+        with db.engine.begin() as connection:
+            for statement in (
+                    'CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, '
+                    'username VARCHAR(64) NOT NULL UNIQUE, email VARCHAR(120) NOT NULL UNIQUE, '
+                    'password_hash VARCHAR(255) NOT NULL, is_admin BOOLEAN, created_at DATETIME)',
+                    'CREATE TABLE categories (id INTEGER NOT NULL PRIMARY KEY, '
+                    'name VARCHAR(100) NOT NULL UNIQUE, description TEXT)',
+                    'CREATE TABLE products (id INTEGER NOT NULL PRIMARY KEY, '
+                    'name VARCHAR(100) NOT NULL, description TEXT, price FLOAT NOT NULL, '
+                    'image_path VARCHAR(255), category_id INTEGER REFERENCES categories (id), '
+                    'stock INTEGER NOT NULL, status VARCHAR(20) NOT NULL)',
+                    'CREATE TABLE orders (id INTEGER NOT NULL PRIMARY KEY, '
+                    'user_id INTEGER NOT NULL REFERENCES users (id), '
+                    'product_id INTEGER NOT NULL REFERENCES products (id), '
+                    'quantity INTEGER NOT NULL, total_price FLOAT NOT NULL, '
+                    'status VARCHAR(20) NOT NULL, date_ordered DATETIME NOT NULL)',
+                    'CREATE TABLE token_blacklist (id INTEGER NOT NULL PRIMARY KEY, '
+                    'jti VARCHAR(36) NOT NULL UNIQUE, created_at DATETIME)',
+                    "INSERT INTO users (id, username, email, password_hash, is_admin) "
+                    "VALUES (1, 'old', 'old@example.com', 'x', 0)",
+                    "INSERT INTO products (id, name, price, stock, status) "
+                    "VALUES (1, 'Old product', 5.0, 3, 'available')",
+                    "INSERT INTO orders (id, user_id, product_id, quantity, total_price, status, "
+                    "date_ordered) VALUES (1, 1, 1, 2, 10.0, 'Pending', '2024-01-01 00:00:00')"):
+                connection.execute(text(statement))
+
+        self.assertEqual(upgrade(), [version for version, _, _ in MIGRATIONS])
+
+        inspector = inspect(db.engine)
+        product_indexes = {index['name'] for index in inspector.get_indexes('products')}
+        self.assertLessEqual({'ix_products_name_id', 'ix_products_rating_avg_id',
+                              'ix_products_change_version_id'}, product_indexes)
+        self.assertIn('ix_orders_user_id_date_ordered',
+                      {index['name'] for index in inspector.get_indexes('orders')})
+        product_id = next(column for column in inspector.get_columns('orders')
+                          if column['name'] == 'product_id')
+        self.assertTrue(product_id['nullable'])
+        with db.engine.begin() as connection:
+            self.assertEqual(connection.execute(text(
+                'SELECT rating_count, change_version FROM products WHERE id = 1')).one(), (0, 0))
+            self.assertEqual(connection.execute(text(
+                'SELECT quantity FROM orders WHERE id = 1')).scalar(), 2)
+            # Multi-item orders have no product_id.
+            connection.execute(text(
+                "INSERT INTO orders (user_id, quantity, total_price, status, date_ordered) "
+                "VALUES (1, 1, 5.0, 'Pending', '2024-01-02 00:00:00')"))
+
+
+if __name__ == '__main__':
+    unittest.main()
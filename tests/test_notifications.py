@@ -0,0 +1,150 @@
+""" This module tests notifications and unread counters """
+
+import threading
+import time
+import unittest
+
+from flask_jwt_extended import create_access_token
+
+from config import TestingConfig
+from app import create_app, db
+from app.models import Notification, NotificationCounter, Order, User
+from app.notifications import notify
+
+
+class TestNotifications(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config_class=TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='user', email='user@test.com', password_hash='unused')
+        self.other = User(username='other', email='other@test.com', password_hash='unused')
+        db.session.add_all([self.user, self.other])
+        db.session.commit()
+        self.headers = {'Authorization': f'Bearer {create_access_token(identity=self.user.id)}'}
+        self.other_headers = {
+            'Authorization': f'Bearer {create_access_token(identity=self.other.id)}'}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _notify(self, count):
+        for number in range(count):
+            notify(self.user.id, f'Message {number}')
+        db.session.commit()
+        return [notification.id for notification in
+                Notification.query.filter_by(user_id=self.user.id).order_by(Notification.id)]
+
+    def _unread(self):
+        response = self.client.get(f'/users/{self.user.id}/notifications/unread-count',
+                                   headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['unread']
+
+    def test_order_status_change_notifies_owner(self):
+        order = Order(user_id=self.user.id, quantity=1, total_price=1.0, status='Pending')
+        db.session.add(order)
+        db.session.commit()
+        admin_token = create_access_token(identity=self.other.id,
+                                          additional_claims={'is_admin': True})
+        self.client.put(f'/orders/{order.id}/status', json={'status': 'Processing'},
+                        headers={'Authorization': f'Bearer {admin_token}'})
+        self.client.post(f'/orders/{order.id}/cancel', headers=self.headers)
+
+        response = self.client.get(f'/users/{self.user.id}/notifications',
+                                   headers=self.headers)
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['unread'], 2)
+        self.assertEqual([item['kind'] for item in data['items']], ['order_status'] * 2)
+        self.assertEqual(data['items'][1]['message'], f'Order {order.id} is now Processing')
+
+    def test_listing_is_keyset_paginated_newest_first(self):
+        ids = self._notify(5)
+        path = f'/users/{self.user.id}/notifications?limit=2'
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(path + (f'&cursor={cursor}' if cursor else ''),
+                                       headers=self.headers)
+            data = response.get_json()
+            seen.extend(item['id'] for item in data['items'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, ids[::-1])
+
+        response = self.client.get(f'/users/{self.user.id}/notifications',
+                                   headers=self.other_headers)
+        self.assertEqual(response.status_code, 403)
+
+    def test_mark_read_keeps_counter_in_step(self):
+        ids = self._notify(5)
+        self.assertEqual(self._unread(), 5)
+
+        response = self.client.post(f'/notifications/{ids[0]}/read', headers=self.headers)
+        self.assertEqual(response.get_json()['unread'], 4)
+        # Marking it again changes nothing.
+        self.client.post(f'/notifications/{ids[0]}/read', headers=self.headers)
+        self.assertEqual(self._unread(), 4)
+        response = self.client.post(f'/notifications/{ids[1]}/read', headers=self.other_headers)
+        self.assertEqual(response.status_code, 403)
+
+        path = f'/users/{self.user.id}/notifications/read'
+        response = self.client.post(path, json={'up_to': ids[2]}, headers=self.headers)
+        self.assertEqual(response.get_json(), {'marked': 2, 'unread': 2})
+        response = self.client.post(path, json={'ids': 'all'}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(path, headers=self.headers)
+        self.assertEqual(response.get_json(), {'marked': 2, 'unread': 0})
+
+        response = self.client.get(f'/users/{self.user.id}/notifications?unread=1',
+                                   headers=self.headers)
+        self.assertEqual(response.get_json()['items'], [])
+        unread = db.session.get(NotificationCounter, self.user.id).unread
+        self.assertEqual(unread, Notification.query.filter_by(is_read=False).count())
+
+    def test_poll_returns_newer_notifications_or_times_out(self):
+        ids = self._notify(2)
+        path = f'/users/{self.user.id}/notifications/poll'
+        response = self.client.get(f'{path}?after={ids[0]}', headers=self.headers)
+        data = response.get_json()
+        self.assertEqual([item['id'] for item in data['items']], [ids[1]])
+        self.assertEqual(data['last_id'], ids[1])
+
+        response = self.client.get(f'{path}?after={ids[1]}&timeout=0.05', headers=self.headers)
+        self.assertEqual(response.get_json()['items'], [])
+        self.assertEqual(response.get_json()['last_id'], ids[1])
+
+        for timeout in ('nan', 'inf', '-inf'):
+            response = self.client.get(f'{path}?after={ids[1]}&timeout={timeout}',
+                                       headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_poll_wakes_when_notification_is_committed(self):
+        ids = self._notify(1)
+
+        def send_later():
+            time.sleep(0.2)
+            with self.app.app_context():
+                notify(self.user.id, 'Your order shipped')
+                db.session.commit()
+
+        thread = threading.Thread(target=send_later)
+        thread.start()
+        started = time.monotonic()
+        response = self.client.get(
+            f'/users/{self.user.id}/notifications/poll?after={ids[0]}&timeout=10',
+            headers=self.headers)
+        thread.join()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([item['message'] for item in response.get_json()['items']],
+                         ['Your order shipped'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
 """ This module is to test orders """
 
+import os
+import tempfile
 import unittest
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, json
 from config import TestingConfig
 from flask_jwt_extended import create_access_token
@@ -8,6 +12,10 @@ from app import create_app, db
 from app.models.user import User
 from app.models.product import Product
 from app.models.order import Order
+from app.models.order_item import OrderItem
+from app.models.stock_shard import ProductStockShard
+from app.inventory import available_stock, collect_stock, split_stock
+from app.order_writer import OrderWriter
 
 
 class TestOrdersEndpoints(unittest.TestCase):
@@ -38,7 +46,7 @@ class TestOrdersEndpoints(unittest.TestCase):
 
     def test_create_order(self):
         """ Create a user and a product """
-        product = Product(name='Test Product', price=10.99)
+        product = Product(name='Test Product', price=10.99, stock=5)
         db.session.add(product)
         db.session.commit()
 
@@ -51,6 +59,15 @@ class TestOrdersEndpoints(unittest.TestCase):
         self.assertEqual(data['product_id'], product.id)
         self.assertEqual(data['quantity'], 2)
         self.assertEqual(data['total_price'], 21.98)
+        db.session.refresh(product)
+        self.assertEqual(product.stock, 3)
+
+        # Test ordering more than is in stock
+        response = self.client.post('/orders', json={'product_id': product.id, 'quantity': 4},
+                                    headers={'Authorization': f'Bearer {self.user_token}'})
+        self.assertEqual(response.status_code, 409)
+        db.session.refresh(product)
+        self.assertEqual(product.stock, 3)
 
         # Test missing product_id
         invalid_order = {'quantity': 1}
@@ -66,6 +83,167 @@ class TestOrdersEndpoints(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn('Product not found', str(data['errors']))
 
+    def test_create_multi_item_order(self):
+        """ Create an order with several lines in one request """
+        shoe = Product(name='Shoe', price=40.0, stock=1)
+        sock = Product(name='Sock', price=2.5, stock=10)
+        db.session.add_all([shoe, sock])
+        db.session.commit()
+
+        order_data = {'items': [{'product_id': shoe.id, 'quantity': 1},
+                                {'product_id': sock.id, 'quantity': 3},
+                                {'product_id': sock.id, 'quantity': 1}]}
+        response = self.client.post('/orders', json=order_data,
+                                    headers={'Authorization': f'Bearer {self.user_token}'})
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual(data['total_price'], 50.0)
+        self.assertEqual(data['quantity'], 5)
+        self.assertIsNone(data['product_id'])
+        self.assertEqual(sorted((i['product_id'], i['quantity']) for i in data['items']),
+                         [(shoe.id, 1), (sock.id, 4)])
+        self.assertEqual(OrderItem.query.filter_by(order_id=data['id']).count(), 2)
+
+        response = self.client.get(f"/orders/{data['id']}",
+                                   headers={'Authorization': f'Bearer {self.user_token}'})
+        self.assertEqual(len(json.loads(response.data)['items']), 2)
+
+        # Nothing is written when any line is invalid
+        order_data = {'items': [{'product_id': shoe.id, 'quantity': 1},
+                                {'product_id': 999, 'quantity': 1},
+                                {'product_id': sock.id, 'quantity': 0}]}
+        response = self.client.post('/orders', json=order_data,
+                                    headers={'Authorization': f'Bearer {self.user_token}'})
+        self.assertEqual(response.status_code, 400)
+        fields = [error['field'] for error in json.loads(response.data)['errors']]
+        self.assertIn('items[2].quantity', fields)
+        self.assertIn('Product not found: 999', str(json.loads(response.data)['errors']))
+        self.assertEqual(Order.query.count(), 1)
+
+        # A line without enough stock undoes the reservations before it
+        order_data = {'items': [{'product_id': sock.id, 'quantity': 1},
+                                {'product_id': shoe.id, 'quantity': 1}]}
+        response = self.client.post('/orders', json=order_data,
+                                    headers={'Authorization': f'Bearer {self.user_token}'})
+        self.assertEqual(response.status_code, 409)
+        db.session.refresh(sock)
+        self.assertEqual(sock.stock, 6)
+
+    def test_cancel_order_releases_stock(self):
+        """ Canceling an order puts its items back in stock """
+        product = Product(name='Test Product', price=10.0, stock=5)
+        db.session.add(product)
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {self.user_token}'}
+        response = self.client.post('/orders', json={'product_id': product.id, 'quantity': 2},
+                                    headers=headers)
+        order_id = json.loads(response.data)['id']
+
+        response = self.client.post(f'/orders/{order_id}/cancel', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        db.session.refresh(product)
+        self.assertEqual(product.stock, 5)
+
+    def test_canceled_order_stock_is_released_once(self):
+        """ A canceled order cannot be reopened, edited or canceled again """
+        product = Product(name='Test Product', price=10.0, stock=5)
+        db.session.add(product)
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {self.user_token}'}
+        admin_headers = {'Authorization': f'Bearer {self.admin_token}'}
+        response = self.client.post('/orders', json={'product_id': product.id, 'quantity': 2},
+                                    headers=headers)
+        order_id = json.loads(response.data)['id']
+
+        # Only admins change statuses
+        response = self.client.put(f'/orders/{order_id}/status', json={'status': 'Shipped'},
+                                   headers=headers)
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.post(f'/orders/{order_id}/cancel', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['status'], 'Order Canceled')
+
+        response = self.client.put(f'/orders/{order_id}/status', json={'status': 'Pending'},
+                                   headers=admin_headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.put(f'/orders/{order_id}', json={'quantity': 1}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f'/orders/{order_id}/cancel', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        db.session.refresh(product)
+        self.assertEqual(product.stock, 5)
+
+    def test_sharded_stock_reservation(self):
+        """ Orders draw from shard rows once a product's stock is split """
+        self.app.config['STOCK_SHARDS'] = 4
+        product = Product(name='Hot Product', price=1.0, stock=10)
+        db.session.add(product)
+        db.session.commit()
+        split_stock(product.id, 4)
+        self.assertEqual(ProductStockShard.query.filter_by(product_id=product.id).count(), 4)
+        self.assertEqual(available_stock(product.id), 10)
+
+        headers = {'Authorization': f'Bearer {self.user_token}'}
+        statuses = [self.client.post('/orders', json={'product_id': product.id, 'quantity': 1},
+                                     headers=headers).status_code for _ in range(12)]
+        # Single units can always be served while any shard has stock left
+        self.assertEqual(statuses.count(201), 10)
+        self.assertEqual(available_stock(product.id), 0)
+
+        collect_stock(product.id)
+        self.assertEqual(ProductStockShard.query.count(), 0)
+
+    def test_sharded_stock_spans_shards_and_reports_total(self):
+        """ Quantities no single shard holds are gathered across shards """
+        self.app.config['STOCK_SHARDS'] = 4
+        product = Product(name='Hot Product', price=1.0, stock=10)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+        split_stock(product_id, 4)
+        headers = {'Authorization': f'Bearer {self.user_token}'}
+
+        # Split stock is reported in full, and cached pages follow orders.
+        response = self.client.get(f'/products/{product_id}')
+        self.assertEqual(response.get_json()['stock'], 10)
+        response = self.client.get('/products?fields=stock')
+        self.assertEqual(response.get_json()['items'][0]['stock'], 10)
+
+        response = self.client.post('/orders', json={'product_id': product_id, 'quantity': 7},
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(available_stock(product_id), 3)
+        self.assertEqual(self.client.get(f'/products/{product_id}').get_json()['stock'], 3)
+        response = self.client.get('/products?fields=stock')
+        self.assertEqual(response.get_json()['items'][0]['stock'], 3)
+
+        # A shortfall takes nothing
+        response = self.client.post('/orders', json={'product_id': product_id, 'quantity': 4},
+                                    headers=headers)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(available_stock(product_id), 3)
+
+    def test_setting_stock_replaces_sharded_stock(self):
+        """ An absolute stock value is the new total, not added to the shards """
+        product = Product(name='Hot Product', price=1.0, stock=100)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+        split_stock(product_id, 4)
+        headers = {'Authorization': f'Bearer {self.admin_token}'}
+
+        response = self.client.put(f'/products/{product_id}', json={'stock': 10},
+                                   headers=headers)
+        self.assertEqual(response.get_json()['stock'], 10)
+        self.assertEqual(available_stock(product_id), 10)
+
+        split_stock(product_id, 4)
+        response = self.client.post('/products/import?format=ndjson', headers=headers,
+                                    data=f'{{"id": {product_id}, "stock": 7}}\n')
+        self.assertEqual(response.get_json()['updated'], 1)
+        self.assertEqual(available_stock(product_id), 7)
+        self.assertEqual(self.client.get(f'/products/{product_id}').get_json()['stock'], 7)
 
     def test_get_orders(self):
         """ Create a user and some orders """
@@ -82,17 +260,52 @@ class TestOrdersEndpoints(unittest.TestCase):
         # Test admin user can see all orders
         response = self.client.get('/orders', headers={'Authorization': f'Bearer {self.admin_token}'})
         self.assertEqual(response.status_code, 200)
-        data = json.loads(response.data)
+        data = json.loads(response.data)['items']
         self.assertEqual(len(data), 2)
 
 
         # Test regular user can only see their own orders
         response = self.client.get('/orders', headers={'Authorization': f'Bearer {self.user_token}'})
         self.assertEqual(response.status_code, 200)
-        data = json.loads(response.data)
+        data = json.loads(response.data)['items']
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]['user_id'], self.regular_user.id)
 
+    def test_get_orders_pagination_and_filters(self):
+        """ Orders come newest first, page by cursor and filter by status/date """
+        product = Product(name='Test Product', price=1.0)
+        db.session.add(product)
+        db.session.commit()
+        start = datetime(2024, 1, 1)
+        db.session.add_all([Order(user_id=self.regular_user.id, product_id=product.id,
+                                  quantity=1, total_price=1.0,
+                                  status='Shipped' if day % 2 else 'Pending',
+                                  date_ordered=start + timedelta(days=day // 2))
+                            for day in range(7)])
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {self.admin_token}'}
+
+        seen, cursor = [], None
+        while True:
+            url = '/orders?limit=3' + (f'&cursor={cursor}' if cursor else '')
+            data = json.loads(self.client.get(url, headers=headers).data)
+            seen.extend(data['items'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len({order['id'] for order in seen}), 7)
+        dates = [db.session.get(Order, order['id']).date_ordered for order in seen]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+        url = '/orders?status=Shipped&from=2024-01-02&to=2024-01-04'
+        data = json.loads(self.client.get(url, headers=headers).data)
+        self.assertEqual(len(data['items']), 2)
+        self.assertTrue(all(order['status'] == 'Shipped' for order in data['items']))
+
+        response = self.client.get('/orders?from=yesterday', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
     def test_get_order_by_id(self):
         """ Create a user and an order """
         product = Product(name='Test Product', price=10.99)
@@ -127,6 +340,119 @@ class TestOrdersEndpoints(unittest.TestCase):
         response = self.client.get('/orders/999', headers={'Authorization': f'Bearer {self.user_token}'})
         self.assertEqual(response.status_code, 404)
 
+    def test_order_history(self):
+        """ Test users see their own history and admins see anyone's """
+        product = Product(name='Test Product', price=10.99)
+        db.session.add(product)
+        db.session.commit()
+        db.session.add(Order(user_id=self.regular_user.id, product_id=product.id,
+                             quantity=1, total_price=10.99))
+        db.session.commit()
+
+        url = f'/orders/history/{self.regular_user.id}'
+        response = self.client.get(url, headers={'Authorization': f'Bearer {self.user_token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)['items']), 1)
+
+        response = self.client.get(url, headers={'Authorization': f'Bearer {self.admin_token}'})
+        self.assertEqual(response.status_code, 200)
+
+        url = f'/orders/history/{self.admin_user.id}'
+        response = self.client.get(url, headers={'Authorization': f'Bearer {self.user_token}'})
+        self.assertEqual(response.status_code, 403)
+
+
+class TestStockReservationConcurrency(unittest.TestCase):
+    """ Many threads ordering the same product must never oversell it """
+
+    STOCK = 50
+    ATTEMPTS = 120
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'stock.db')
+
+        class FileConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+            SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}}
+
+        self.app = create_app(config_class=FileConfig)
+        with self.app.app_context():
+            db.create_all()
+            user = User(username='buyer', email='buyer@test.com')
+            user.password_hash = 'unused'
+            product = Product(name='Flash Sale', price=1.0, stock=self.STOCK)
+            db.session.add_all([user, product])
+            db.session.commit()
+            self.product_id = product.id
+            self.token = create_access_token(identity=user.id)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.directory.cleanup()
+
+    def _run(self, threads, shards):
+        self.app.config['STOCK_SHARDS'] = shards
+        if shards:
+            with self.app.app_context():
+                split_stock(self.product_id, shards)
+        headers = {'Authorization': f'Bearer {self.token}'}
+        body = {'product_id': self.product_id, 'quantity': 1}
+
+        def place_order(_):
+            return self.app.test_client().post('/orders', json=body, headers=headers).status_code
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            statuses = list(pool.map(place_order, range(self.ATTEMPTS)))
+
+        self.assertEqual(statuses.count(201), self.STOCK)
+        self.assertEqual(statuses.count(409), self.ATTEMPTS - self.STOCK)
+        with self.app.app_context():
+            self.assertEqual(available_stock(self.product_id), 0)
+            self.assertEqual(Order.query.count(), self.STOCK)
+
+    def test_no_oversell_row_mode(self):
+        self._run(threads=16, shards=0)
+
+    def test_no_oversell_sharded_mode(self):
+        self._run(threads=16, shards=4)
+
+    def test_no_oversell_group_commit(self):
+        writer = OrderWriter(self.app, batch_size=16, max_wait_ms=5)
+        self.app.extensions['order_writer'] = writer
+        self._run(threads=16, shards=0)
+        # Every attempt went through the writer, in fewer transactions.
+        self.assertEqual(writer.orders, self.ATTEMPTS)
+        self.assertLess(writer.batches, self.ATTEMPTS)
+
+    def test_group_commit_failed_order_keeps_others(self):
+        self.app.extensions['order_writer'] = OrderWriter(self.app, max_wait_ms=50)
+        with self.app.app_context():
+            sold_out = Product(name='Sold Out', price=2.0, stock=0)
+            db.session.add(sold_out)
+            db.session.commit()
+            sold_out_id = sold_out.id
+        headers = {'Authorization': f'Bearer {self.token}'}
+        bodies = [{'product_id': self.product_id, 'quantity': 2},
+                  {'items': [{'product_id': self.product_id, 'quantity': 3},
+                             {'product_id': sold_out_id, 'quantity': 1}]}]
+
+        def place_order(body):
+            return self.app.test_client().post('/orders', json=body, headers=headers)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            placed, refused = list(pool.map(place_order, bodies))
+
+        self.assertEqual(placed.status_code, 201)
+        self.assertEqual(placed.get_json()['items'][0]['quantity'], 2)
+        self.assertEqual(refused.status_code, 409)
+        with self.app.app_context():
+            # The refused order's reservation of 3 was given back.
+            self.assertEqual(available_stock(self.product_id), self.STOCK - 2)
+            self.assertEqual(Order.query.count(), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,6 +5,15 @@ from app import create_app, db
 from app.models import Product, Category, User
 from flask_jwt_extended import create_access_token
 import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select
+
+from app.db_routing import get_replica_engines, read_replica
+from app.singleflight import SingleFlight, coalesced
 
 os.environ['Testing'] = 'True'
 
@@ -65,8 +74,35 @@ class TestProductEndpoints(unittest.TestCase):
         response = self.client.get('/products')
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
-        self.assertEqual(len(data), 1)
-        self.assertEqual(data[0]['name'], 'Test Product')
+        self.assertEqual(len(data['items']), 1)
+        self.assertEqual(data['items'][0]['name'], 'Test Product')
+        self.assertIsNone(data['next_cursor'])
+
+    def test_get_all_products_pagination(self):
+        """ Test walking the catalog with a cursor """
+        db.session.add_all([Product(name=f'Product {i}', price=float(i))
+                            for i in range(5)])
+        db.session.commit()
+
+        seen = []
+        cursor = None
+        while True:
+            url = '/products?limit=2&sort=-price'
+            if cursor:
+                url += f'&cursor={cursor}'
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertLessEqual(len(data['items']), 2)
+            seen.extend(item['price'] for item in data['items'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(seen), 6)
+
+        response = self.client.get(f'/products?limit=2&cursor={cursor or "bad"}')
+        self.assertEqual(response.status_code, 400)
 
     def test_get_product_by_id_success(self):
         """ Test to get product by id """
@@ -75,6 +111,33 @@ class TestProductEndpoints(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(data['name'], 'Test Product')
 
+    def test_get_product_etag_and_invalidation(self):
+        """ Test cached product reads, 304 replies and write invalidation """
+        response = self.client.get(f'/products/{self.product.id}')
+        etag = response.headers['ETag']
+        self.assertTrue(etag)
+
+        response = self.client.get(f'/products/{self.product.id}',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        token = create_access_token(identity=self.admin_user.id)
+        headers = {'Authorization': f'Bearer {token}'}
+        self.client.put(f'/products/{self.product.id}',
+                        json={'price': 12.5}, headers=headers)
+        response = self.client.get(f'/products/{self.product.id}',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['price'], 12.5)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        response = self.client.get('/products/cache/stats', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.data)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
     def test_get_product_by_id_not_found(self):
         """ Test non-existent product """
         response = self.client.get('/products/100')
@@ -85,8 +148,40 @@ class TestProductEndpoints(unittest.TestCase):
         response = self.client.get('/products/search?query=Test')
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
-        self.assertEqual(len(data), 1)
-        self.assertEqual(data[0]['name'], 'Test Product')
+        self.assertEqual(len(data['items']), 1)
+        self.assertEqual(data['items'][0]['name'], 'Test Product')
+
+    def test_search_products_ranking_and_sync(self):
+        """ Test description matches, prefixes and index updates """
+        db.session.add_all([
+            Product(name='Red Running Shoe', description='Light trainer', price=50.0),
+            Product(name='Trainer Socks', description='Cotton', price=5.0),
+        ])
+        db.session.commit()
+
+        response = self.client.get('/products/search?query=train')
+        names = [item['name'] for item in json.loads(response.data)['items']]
+        self.assertEqual(names, ['Trainer Socks', 'Red Running Shoe'])
+
+        response = self.client.get('/products/search?query=train&limit=1')
+        data = json.loads(response.data)
+        self.assertEqual(len(data['items']), 1)
+        response = self.client.get(
+            f'/products/search?query=train&limit=1&cursor={data["next_cursor"]}')
+        data = json.loads(response.data)
+        self.assertEqual(data['items'][0]['name'], 'Red Running Shoe')
+        self.assertIsNone(data['next_cursor'])
+
+        token = create_access_token(identity=self.admin_user.id)
+        headers = {'Authorization': f'Bearer {token}'}
+        self.client.put(f'/products/{self.product.id}',
+                        json={'name': 'Trainer Laces'}, headers=headers)
+        response = self.client.get('/products/search?query=laces')
+        self.assertEqual(len(json.loads(response.data)['items']), 1)
+
+        self.client.delete(f'/products/{self.product.id}', headers=headers)
+        response = self.client.get('/products/search?query=laces')
+        self.assertEqual(json.loads(response.data)['items'], [])
 
     def test_get_categories(self):
         """ Test to get product category"""
@@ -101,8 +196,8 @@ class TestProductEndpoints(unittest.TestCase):
         response = self.client.get(f'/products/category/{self.category.id}')
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
-        self.assertEqual(len(data), 1)
-        self.assertEqual(data[0]['name'], 'Test Product')
+        self.assertEqual(len(data['items']), 1)
+        self.assertEqual(data['items'][0]['name'], 'Test Product')
 
     def test_create_product_admin(self):
         """ Test to post a product """
@@ -137,6 +232,22 @@ class TestProductEndpoints(unittest.TestCase):
         self.assertIn('error', data)
         self.assertEqual(data['error'], 'Only admins can create products')
 
+    def test_create_product_uses_role_claim(self):
+        """ Test the admin role is read from the token claims """
+        token = create_access_token(identity=self.regular_user.id,
+                                    additional_claims={'is_admin': True})
+        headers = {'Authorization': f'Bearer {token}'}
+        response = self.client.post('/products', json={'name': 'Claimed', 'price': 1.0},
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+        token = create_access_token(identity=self.admin_user.id,
+                                    additional_claims={'is_admin': False})
+        headers = {'Authorization': f'Bearer {token}'}
+        response = self.client.post('/products', json={'name': 'Denied', 'price': 1.0},
+                                    headers=headers)
+        self.assertEqual(response.status_code, 403)
+
     def test_update_product_admin(self):
         """ Test if admin can update product"""
 
@@ -162,6 +273,69 @@ class TestProductEndpoints(unittest.TestCase):
         self.assertIn('error', data)
         self.assertEqual(data['error'], 'Only admins can update products')
 
+    def test_import_products_csv(self):
+        """ Test bulk upserting products with a per-row error report """
+        token = create_access_token(identity=self.admin_user.id)
+        headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'text/csv'}
+        body = ('id,name,price,stock,description\n'
+                f'{self.product.id},,12.5,3,\n'
+                ',Imported One,1.5,10,First\n'
+                ',Imported Two,-1,10,Bad price\n'
+                ',,2.0,1,No name\n'
+                ',Imported Three,abc,1,Bad number\n'
+                ',Imported Four,4.0,,\n')
+        self.client.get('/products/search?query=imported')
+        response = self.client.post('/products/import?chunk_size=2', data=body,
+                                    headers=headers)
+        self.assertEqual(response.status_code, 200)
+        report = json.loads(response.data)
+        self.assertEqual(report['rows'], 6)
+        self.assertEqual(report['inserted'], 2)
+        self.assertEqual(report['updated'], 1)
+        self.assertEqual(report['failed'], 3)
+        self.assertEqual(sorted((e['row'], e['field']) for e in report['errors']),
+                         [(3, 'price'), (4, 'name'), (5, 'price')])
+        self.assertIn('non-negative', str(report['errors']))
+
+        product = db.session.get(Product, self.product.id)
+        db.session.refresh(product)
+        self.assertEqual((product.name, product.price, product.stock), ('Test Product', 12.5, 3))
+        data = json.loads(self.client.get('/products/search?query=imported').data)
+        self.assertEqual(len(data['items']), 2)
+
+    def test_import_products_ndjson(self):
+        """ Test importing NDJSON, including a malformed line """
+        token = create_access_token(identity=self.admin_user.id)
+        headers = {'Authorization': f'Bearer {token}'}
+        body = ('{"name": "Lamp", "price": 20, "category_id": %d}\n'
+                'not json\n'
+                '{"id": 5000, "name": "Chair", "price": 35.5}\n') % self.category.id
+        response = self.client.post('/products/import?format=ndjson', data=body,
+                                    headers=headers)
+        report = json.loads(response.data)
+        self.assertEqual((report['inserted'], report['failed']), (2, 1))
+        self.assertEqual(db.session.get(Product, 5000).name, 'Chair')
+
+        # Non-finite numbers would be stored and break JSON responses.
+        body = ('{"name": "Infinite", "price": Infinity}\n'
+                '{"name": "Unknown", "price": NaN}\n'
+                '{"name": "Endless", "price": 1.0, "stock": Infinity}\n')
+        response = self.client.post('/products/import?format=ndjson', data=body,
+                                    headers=headers)
+        report = json.loads(response.data)
+        self.assertEqual((report['inserted'], report['failed']), (0, 3))
+        self.assertEqual([error['field'] for error in report['errors']],
+                         ['price', 'price', 'stock'])
+        csv_headers = dict(headers, **{'Content-Type': 'text/csv'})
+        response = self.client.post('/products/import', data='name,price\nInfinite,inf\n',
+                                    headers=csv_headers)
+        self.assertEqual(json.loads(response.data)['failed'], 1)
+
+        token = create_access_token(identity=self.regular_user.id)
+        response = self.client.post('/products/import', data=body,
+                                    headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 403)
+
     def test_delete_product_admin(self):
         """ Test to delete a product by an admin"""
         token = create_access_token(identity=self.admin_user.id)
@@ -179,5 +353,203 @@ class TestProductEndpoints(unittest.TestCase):
         self.assertIsNotNone(db.session.get(Product, self.product.id))
 
 
+class TestSingleFlight(unittest.TestCase):
+    """ Identical concurrent calls share one execution """
+
+    def test_concurrent_calls_share_one_execution(self):
+        group = SingleFlight(timeout=5)
+        release = threading.Event()
+        runs = []
+
+        def query():
+            runs.append(1)
+            release.wait(5)
+            return b'{"id": 1}'
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [pool.submit(group.do, 'product:1', query) for _ in range(8)]
+            deadline = time.monotonic() + 5
+            while group.stats()['coalesced'] < 7 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            release.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(set(results), {b'{"id": 1}'})
+        self.assertEqual(group.stats(), {'leaders': 1, 'coalesced': 7,
+                                         'timeouts': 0, 'in_flight': 0})
+
+    def test_follower_runs_itself_after_timeout_or_failure(self):
+        group = SingleFlight(timeout=0.05)
+        release = threading.Event()
+
+        def slow():
+            release.wait(5)
+            return 'leader'
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            leader = pool.submit(group.do, 'key', slow)
+            while not group.stats()['in_flight']:
+                time.sleep(0.01)
+            self.assertEqual(group.do('key', lambda: 'follower'), 'follower')
+            release.set()
+            self.assertEqual(leader.result(), 'leader')
+        self.assertEqual(group.stats()['timeouts'], 1)
+
+        def broken():
+            raise RuntimeError('database went away')
+        with self.assertRaises(RuntimeError):
+            group.do('key', broken)
+        self.assertEqual(group.do('key', lambda: 'retried'), 'retried')
+
+
+class TestReadReplicaRouting(unittest.TestCase):
+    """ Read-only handlers use the replica until the caller writes """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        primary = os.path.join(self.directory.name, 'primary.db')
+        replica = os.path.join(self.directory.name, 'replica.db')
+
+        class ReplicaConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{primary}'
+            DATABASE_REPLICA_URLS = [f'sqlite:///{replica}']
+
+        self.app = create_app(config_class=ReplicaConfig)
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+            replica_engine = get_replica_engines()[0]
+            db.metadata.create_all(replica_engine)
+            admin = User(username='admin', email='admin@test.com', is_admin=True)
+            admin.password_hash = 'unused'
+            db.session.add(admin)
+            db.session.add(Product(id=1, name='Primary copy', price=1.0, stock=1))
+            db.session.commit()
+            self.token = create_access_token(identity=admin.id,
+                                             additional_claims={'is_admin': True})
+            with replica_engine.begin() as connection:
+                connection.execute(Product.__table__.insert().values(
+                    id=1, name='Replica copy', price=1.0, stock=1, status='available'))
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            for engine in [db.engine, *get_replica_engines()]:
+                engine.dispose()
+        self.directory.cleanup()
+
+    def _name(self, headers=None):
+        response = self.client.get('/products/1', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['name']
+
+    def test_reads_go_to_replica(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.assertEqual(self._name(), 'Replica copy')
+        self.assertEqual(self._name(headers), 'Replica copy')
+
+    def test_reads_after_own_write_stick_to_primary(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = self.client.put('/products/1', json={'name': 'Renamed'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._name(headers), 'Renamed')
+        # Other callers keep reading the (lagging) replica.
+        self.assertEqual(self._name(), 'Replica copy')
+
+    def test_writer_skips_cache_refilled_from_replica(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.client.put('/products/1', json={'name': 'Renamed'}, headers=headers)
+        # An anonymous read refills the shared cache from the replica...
+        self.assertEqual(self._name(), 'Replica copy')
+        # ...which the writer must not be served.
+        self.assertEqual(self._name(headers), 'Renamed')
+
+    def test_writer_is_not_coalesced_onto_a_replica_read(self):
+        started, release, calls = threading.Event(), threading.Event(), []
+
+        @self.app.route('/test/slow-name')
+        @coalesced()
+        @read_replica
+        def slow_name():
+            calls.append(None)
+            if len(calls) == 1:
+                started.set()
+                release.wait(5)
+            return {'name': db.session.get(Product, 1).name}
+
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.client.put('/products/1', json={'name': 'Renamed'}, headers=headers)
+        names = {}
+
+        def get(who, request_headers=None):
+            client = self.app.test_client()
+            names[who] = client.get('/test/slow-name', headers=request_headers).get_json()['name']
+
+        # An anonymous leader is reading the replica when the writer asks.
+        leader = threading.Thread(target=get, args=('anonymous',))
+        leader.start()
+        started.wait(5)
+        writer = threading.Thread(target=get, args=('writer', headers))
+        writer.start()
+        writer.join(2)
+        release.set()
+        leader.join(5)
+        writer.join(5)
+        self.assertEqual(names, {'anonymous': 'Replica copy', 'writer': 'Renamed'})
+
+    def test_sticky_window_expires(self):
+        self.app.extensions['db_router'].sticky_seconds = 0
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.client.put('/products/1', json={'name': 'Renamed'}, headers=headers)
+        self.assertEqual(self._name(headers), 'Replica copy')
+
+
+class TestReplicaPinning(unittest.TestCase):
+    """ All queries of one request read the same replica """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        paths = [os.path.join(self.directory.name, f'{name}.db')
+                 for name in ('primary', 'first', 'second')]
+
+        class ReplicaConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{paths[0]}'
+            DATABASE_REPLICA_URLS = [f'sqlite:///{path}' for path in paths[1:]]
+
+        self.app = create_app(config_class=ReplicaConfig)
+
+        @self.app.route('/test/two-reads')
+        @read_replica
+        def two_reads():
+            query = select(Product.name).where(Product.id == 1)
+            return {'names': [db.session.scalar(query) for _ in range(2)]}
+
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+            for engine, name in zip(get_replica_engines(), ('First', 'Second')):
+                db.metadata.create_all(engine)
+                with engine.begin() as connection:
+                    connection.execute(Product.__table__.insert().values(
+                        id=1, name=name, price=1.0, stock=1, status='available'))
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            for engine in [db.engine, *get_replica_engines()]:
+                engine.dispose()
+        self.directory.cleanup()
+
+    def test_one_replica_per_request(self):
+        seen = set()
+        for _ in range(4):
+            names = self.client.get('/test/two-reads').get_json()['names']
+            self.assertEqual(names[0], names[1])
+            seen.add(names[0])
+        # Requests still spread over the replicas.
+        self.assertEqual(seen, {'First', 'Second'})
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,105 @@
+""" This module tests rate limiting of the authentication routes """
+
+import unittest
+from unittest import mock
+
+from config import TestingConfig
+from app import create_app, db
+from app.models import User
+from app.ratelimit import LocalRateLimitBackend, Rule
+
+
+class RateLimitConfig(TestingConfig):
+    RATE_LIMITS = {
+        'auth.login': ['ip:bucket:3/60', 'account:window:2/300'],
+        'auth.reset_password': ['account:window:1/3600'],
+    }
+
+
+class TestRateLimitRoutes(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config_class=RateLimitConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        user = User(username='user', email='user@test.com')
+        user.set_password('correct-password')
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _login(self, email, ip='10.0.0.1'):
+        return self.client.post('/users/login', json={'email': email, 'password': 'wrong'},
+                                environ_base={'REMOTE_ADDR': ip})
+
+    def test_per_account_and_per_ip_limits(self):
+        self.assertEqual(self._login('user@test.com').status_code, 401)
+        self.assertEqual(self._login('USER@test.com', ip='10.0.0.2').status_code, 401)
+        response = self._login('user@test.com', ip='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+
+        # The first address has two tokens left, then runs dry.
+        self.assertEqual(self._login('other@test.com').status_code, 401)
+        self.assertEqual(self._login('third@test.com').status_code, 401)
+        self.assertEqual(self._login('fourth@test.com').status_code, 429)
+        self.assertEqual(self._login('fourth@test.com', ip='10.0.0.4').status_code, 401)
+
+    def test_rejected_requests_consume_nothing(self):
+        self._login('user@test.com', ip='10.0.0.1')
+        self._login('user@test.com', ip='10.0.0.2')
+        for _ in range(3):
+            self.assertEqual(self._login('user@test.com', ip='10.0.0.9').status_code, 429)
+        # The account rejections left the address's bucket full.
+        self.assertEqual([self._login(f'{n}@test.com', ip='10.0.0.9').status_code
+                          for n in range(4)], [401, 401, 401, 429])
+
+    def test_rejections_skip_the_view(self):
+        self.client.post('/users/reset-password?email=user@test.com')
+        with mock.patch('app.routes.users.db') as view_db:
+            response = self.client.post('/users/reset-password?email=user@test.com')
+        self.assertEqual(response.status_code, 429)
+        view_db.session.query.assert_not_called()
+        self.assertEqual(self.client.get('/products').status_code, 200)
+
+
+class TestLocalRateLimitBackend(unittest.TestCase):
+    def test_token_bucket_refills(self):
+        backend = LocalRateLimitBackend()
+        rule = Rule.parse('ip:bucket:2/10')
+        self.assertEqual([backend.hit('k', rule, 100) for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(backend.hit('k', rule, 100), 5.0)
+        self.assertEqual(backend.hit('k', rule, 105), 0)
+        self.assertGreater(backend.hit('k', rule, 105), 0)
+
+    def test_sliding_window_weights_the_previous_window(self):
+        backend = LocalRateLimitBackend()
+        rule = Rule.parse('account:window:4/60')
+        self.assertEqual([backend.hit('k', rule, 10 + n) for n in range(4)], [0] * 4)
+        self.assertAlmostEqual(backend.hit('k', rule, 20), 40.0)
+        # A quarter into the next window, 3 of the previous 4 still count.
+        self.assertEqual(backend.hit('k', rule, 75), 0)
+        self.assertGreater(backend.hit('k', rule, 75), 0)
+        self.assertEqual(backend.hit('k', rule, 200), 0)
+
+    def test_idle_state_is_swept(self):
+        backend = LocalRateLimitBackend()
+        rule = Rule.parse('ip:bucket:1/1')
+        for n in range(backend.SWEEP_EVERY - 1):
+            backend.hit(f'client{n}', rule, 0)
+        backend.hit('late', rule, 10)
+        self.assertEqual(len(backend), 1)
+
+    def test_invalid_rules(self):
+        for spec in ('ip:bucket:0/60', 'user:bucket:1/60', 'ip:leaky:1/60', 'ip:bucket:5'):
+            with self.assertRaises(ValueError):
+                Rule.parse(spec)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+""" This module tests reviews and the rating aggregates kept on products """
+
+import unittest
+
+from flask_jwt_extended import create_access_token
+
+from config import TestingConfig
+from app import create_app, db
+from app.models import Product, Review, User
+
+
+class TestReviews(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config_class=TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.users = [User(username=f'user{n}', email=f'user{n}@test.com',
+                           password_hash='unused') for n in range(3)]
+        self.lamp = Product(name='Lamp', price=10.0, stock=5)
+        self.chair = Product(name='Chair', price=20.0, stock=5)
+        db.session.add_all(self.users + [self.lamp, self.chair])
+        db.session.commit()
+        self.headers = [{'Authorization': f'Bearer {create_access_token(identity=user.id)}'}
+                        for user in self.users]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _review(self, user, product, rating, comment=None):
+        return self.client.post(f'/products/{product.id}/reviews', headers=self.headers[user],
+                                json={'rating': rating, 'comment': comment})
+
+    def _rating(self, product):
+        return self.client.get(f'/products/{product.id}').get_json()['rating']
+
+    def _check_aggregates(self, product):
+        """ The stored aggregates match a recount of the reviews """
+        db.session.expire_all()
+        product = db.session.get(Product, product.id)
+        ratings = [review.rating for review in Review.query.filter_by(product_id=product.id)]
+        self.assertEqual(product.rating_count, len(ratings))
+        self.assertEqual(product.rating_sum, sum(ratings))
+        for stars in range(1, 6):
+            self.assertEqual(getattr(product, f'rating_{stars}'), ratings.count(stars))
+
+    def test_aggregates_follow_review_changes(self):
+        self.assertEqual(self._rating(self.lamp)['count'], 0)
+        first = self._review(0, self.lamp, 5, 'Bright').get_json()['id']
+        self._review(1, self.lamp, 2)
+        rating = self._rating(self.lamp)
+        self.assertEqual(rating, {'average': 3.5, 'count': 2, 'histogram': {
+            '1': 0, '2': 1, '3': 0, '4': 0, '5': 1}})
+        self._check_aggregates(self.lamp)
+
+        response = self.client.put(f'/reviews/{first}', headers=self.headers[0],
+                                   json={'rating': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['comment'], 'Bright')
+        self.assertEqual(self._rating(self.lamp)['average'], 2.5)
+        self._check_aggregates(self.lamp)
+
+        response = self.client.delete(f'/reviews/{first}', headers=self.headers[0])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self._rating(self.lamp)['histogram']['3'], 0)
+        self.assertEqual(self._rating(self.lamp)['average'], 2.0)
+        self._check_aggregates(self.lamp)
+
+    def test_validation_and_access(self):
+        self.assertEqual(self._review(0, self.lamp, 6).status_code, 400)
+        self.assertEqual(self._review(0, self.lamp, True).status_code, 400)
+        review = self._review(0, self.lamp, 4).get_json()['id']
+        self.assertEqual(self._review(0, self.lamp, 1).status_code, 409)
+        self.assertEqual(self._rating(self.lamp)['count'], 1)
+
+        response = self.client.put(f'/reviews/{review}', headers=self.headers[1],
+                                   json={'rating': 1})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.delete(f'/reviews/{review}', headers=self.headers[1])
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.delete('/reviews/999', headers=self.headers[0]).status_code,
+                         404)
+        self.assertEqual(self.client.get('/products/999/reviews').status_code, 404)
+
+    def test_review_pages(self):
+        for user, rating in enumerate((1, 4, 5)):
+            self._review(user, self.lamp, rating, f'Review {user}')
+        response = self.client.get(f'/products/{self.lamp.id}/reviews?limit=2')
+        page = response.get_json()
+        self.assertEqual([review['comment'] for review in page['items']],
+                         ['Review 2', 'Review 1'])
+        self.assertEqual(page['rating']['count'], 3)
+        response = self.client.get(
+            f"/products/{self.lamp.id}/reviews?cursor={page['next_cursor']}")
+        self.assertEqual([review['rating'] for review in response.get_json()['items']], [1])
+
+    def test_sort_by_rating(self):
+        self.client.get('/products?sort=-rating')  # cache the page before reviews
+        self._review(0, self.lamp, 2)
+        self._review(0, self.chair, 5)
+        response = self.client.get('/products?sort=-rating&limit=1')
+        page = response.get_json()
+        self.assertEqual(page['items'][0]['name'], 'Chair')
+        response = self.client.get(f"/products?sort=-rating&cursor={page['next_cursor']}")
+        self.assertEqual([item['name'] for item in response.get_json()['items']], ['Lamp'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,12 @@ from app import create_app, db
 from app.models.user import User
 from app.models.order import Order
 from app.models.blacklist import TokenBlacklist
-from flask_jwt_extended import create_access_token, get_jwt
+from app.blocklist import BloomFilter, get_token_blocklist
+from app.passwords import PasswordHasher, get_password_hasher
+from datetime import datetime, timedelta
+from flask_jwt_extended import (
+        create_access_token, create_refresh_token, decode_token, get_jwt
+)
 import os
 
 os.environ['Testing'] = 'True'
@@ -86,6 +91,39 @@ class TestAuthEndpoints(unittest.TestCase):
         if 'error' in response.json:
             self.assertEqual(response.json['error'], 'Email and password are required')
 
+    def test_login_rehashes_outdated_cost(self):
+        """ Test a hash made at an old cost is upgraded on login """
+        user = User(username='test', email='test@example.com')
+        user.password_hash = get_password_hasher().hash('password', rounds=5)
+        db.session.add(user)
+        db.session.commit()
+
+        data = {'email': 'test@example.com', 'password': 'password'}
+        response = self.client.post('/users/login', json=data)
+        self.assertEqual(response.status_code, 200)
+        db.session.refresh(user)
+        self.assertFalse(user.password_needs_rehash())
+        self.assertTrue(user.check_password('password'))
+
+    def test_login_sheds_load_when_hasher_full(self):
+        """ Test logins get a 503 when the hashing pool is saturated """
+        user = User(username='test', email='test@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+
+        hasher = PasswordHasher(rounds=4, workers=1, queue_size=0)
+        self.app.extensions['password_hasher'] = hasher
+        hasher._slots.acquire()
+        data = {'email': 'test@example.com', 'password': 'password'}
+        response = self.client.post('/users/login', json=data)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+
+        hasher._slots.release()
+        response = self.client.post('/users/login', json=data)
+        self.assertEqual(response.status_code, 200)
+
     def test_logout_user(self):
         user = User(username='test', email='test@example.com')
         user.set_password('password')
@@ -108,6 +146,57 @@ class TestAuthEndpoints(unittest.TestCase):
         blacklisted = TokenBlacklist.query.filter_by(jti=jti).first()
         self.assertIsNotNone(blacklisted)
 
+    def test_revoked_token_rejected_and_purged(self):
+        """ Test a logged out token is refused and expired rows are purged """
+        user = User(username='test', email='test@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=user.id)}'}
+
+        self.assertEqual(self.client.get('/users/profile', headers=headers).status_code, 200)
+        self.assertEqual(self.client.post('/users/logout', headers=headers).status_code, 200)
+        self.assertEqual(self.client.get('/users/profile', headers=headers).status_code, 401)
+
+        expired = TokenBlacklist(jti='expired-jti',
+                                 expires_at=datetime.utcnow() - timedelta(seconds=1))
+        db.session.add(expired)
+        db.session.commit()
+        self.assertEqual(get_token_blocklist().purge(), 1)
+        self.assertIsNone(TokenBlacklist.query.filter_by(jti='expired-jti').first())
+        self.assertEqual(TokenBlacklist.query.count(), 1)
+
+    def test_refresh_token_picks_up_role_change(self):
+        """ Test refreshed access tokens carry the current role claim """
+        user = User(username='test', email='test@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        refresh_token = create_refresh_token(identity=user.id)
+
+        user.is_admin = True
+        db.session.commit()
+        response = self.client.post('/users/refresh',
+                                    headers={'Authorization': f'Bearer {refresh_token}'})
+        self.assertEqual(response.status_code, 200)
+        access_token = response.json['access_token']
+        self.assertTrue(decode_token(access_token)['is_admin'])
+
+        # Refresh tokens are not accepted where an access token is required.
+        response = self.client.get('/users/profile',
+                                   headers={'Authorization': f'Bearer {refresh_token}'})
+        self.assertEqual(response.status_code, 422)
+
+    def test_bloom_filter(self):
+        """ Test the optional Bloom filter never loses a member """
+        bloom = BloomFilter(1000)
+        jtis = [f'jti-{i}' for i in range(1000)]
+        for jti in jtis:
+            bloom.add(jti)
+        self.assertTrue(all(jti in bloom for jti in jtis))
+        false_positives = sum(f'other-{i}' in bloom for i in range(1000))
+        self.assertLess(false_positives, 20)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,109 @@
+""" This module tests the wishlist endpoints and listing annotations """
+
+import unittest
+
+from sqlalchemy import event
+
+from flask_jwt_extended import create_access_token
+
+from config import TestingConfig
+from app import create_app, db
+from app.models import Category, Product, User, WishlistItem
+
+
+class TestWishlist(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config_class=TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='user', email='user@test.com', password_hash='unused')
+        self.other = User(username='other', email='other@test.com', password_hash='unused')
+        self.category = Category(name='Lighting')
+        db.session.add_all([self.user, self.other, self.category])
+        db.session.flush()
+        self.products = [Product(name=f'Lamp {n}', price=10.0, stock=1,
+                                 category_id=self.category.id) for n in range(4)]
+        db.session.add_all(self.products)
+        db.session.commit()
+        self.headers = {'Authorization': f'Bearer {create_access_token(identity=self.user.id)}'}
+        self.path = f'/users/{self.user.id}/wishlist'
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _add(self, product_id):
+        return self.client.post(f'{self.path}/add', headers=self.headers,
+                                json={'product_id': product_id})
+
+    def test_add_list_remove(self):
+        first, second = self.products[0].id, self.products[1].id
+        self.assertEqual(self._add(first).status_code, 201)
+        self.assertEqual(self._add(second).status_code, 201)
+        self.assertEqual(self._add(first).status_code, 200)
+        self.assertEqual(WishlistItem.query.count(), 2)
+        self.assertEqual(self._add(999).status_code, 404)
+
+        response = self.client.get(f'{self.path}/items?limit=1', headers=self.headers)
+        page = response.get_json()
+        self.assertEqual([item['product_id'] for item in page['items']], [second])
+        self.assertEqual(page['items'][0]['product']['name'], 'Lamp 1')
+        response = self.client.get(f"{self.path}/items?cursor={page['next_cursor']}",
+                                   headers=self.headers)
+        self.assertEqual([item['product_id'] for item in response.get_json()['items']], [first])
+
+        response = self.client.delete(f'{self.path}/items/{first}', headers=self.headers)
+        self.assertEqual(response.status_code, 204)
+        response = self.client.delete(f'{self.path}/items/{first}', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+        other = {'Authorization': f'Bearer {create_access_token(identity=self.other.id)}'}
+        self.assertEqual(self.client.get(f'{self.path}/items', headers=other).status_code, 403)
+
+    def test_listings_are_annotated_in_one_query(self):
+        self._add(self.products[1].id)
+        self._add(self.products[3].id)
+        expected = {product.id: product.id in (self.products[1].id, self.products[3].id)
+                    for product in self.products}
+
+        for path in ('/products', f'/products/category/{self.category.id}'):
+            plain = self.client.get(path, headers=self.headers).get_json()
+            self.assertNotIn('in_wishlist', plain['items'][0])
+            statements = []
+
+            def listener(*args):
+                statements.append(args[2])
+
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                response = self.client.get(f'{path}?with_wishlist=1', headers=self.headers)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+            items = response.get_json()['items']
+            self.assertEqual({item['id']: item['in_wishlist'] for item in items}, expected)
+            # The page itself comes from the cache; only the wishlist is queried.
+            self.assertEqual(len(statements), 1)
+            self.assertIn('wishlist_items', statements[0])
+
+        anonymous = self.client.get('/products?with_wishlist=1').get_json()
+        self.assertFalse(any(item['in_wishlist'] for item in anonymous['items']))
+
+    def test_annotated_etag_is_per_user(self):
+        self._add(self.products[0].id)
+        response = self.client.get('/products?with_wishlist=1', headers=self.headers)
+        etag = response.headers['ETag']
+        again = self.client.get('/products?with_wishlist=1',
+                                headers=dict(self.headers, **{'If-None-Match': etag}))
+        self.assertEqual(again.status_code, 304)
+        other = {'Authorization': f'Bearer {create_access_token(identity=self.other.id)}',
+                 'If-None-Match': etag}
+        self.assertEqual(self.client.get('/products?with_wishlist=1', headers=other).status_code,
+                         200)
+
+
+if __name__ == '__main__':
+    unittest.main()